@@ -0,0 +1,254 @@
+#!/usr/bin/python
+import logging, optparse, os, sys, gc, time, json, resource, tempfile, shutil, multiprocessing
+
+from garmin.device import Forerunner
+from garmin.packet import Packet
+from garmin.utils import StructReader
+from garmin.transports import make_transport
+from garmin import synth
+
+log = logging.getLogger('bench')
+
+def init_logging ():
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setFormatter( logging.Formatter("%(message)s") )
+    logger.addHandler(ch)
+
+def parse_options ():
+    parser = optparse.OptionParser()
+    parser.add_option('--points', dest='points', default='10000,100000', help='comma separated track log sizes, default %default')
+    parser.add_option('--laps', dest='laps', type='int', default=2000)
+    parser.add_option('--course-points', dest='course_points', type='int', default=10000)
+    parser.add_option('--almanac', dest='almanac', type='int', default=32)
+    parser.add_option('--stage', dest='stages', action='append', help='only run stages starting with this name')
+    parser.add_option('--save', dest='save', metavar='FILE', help='save the results as a baseline')
+    parser.add_option('--compare', dest='compare', metavar='FILE', help='compare with a saved baseline')
+    parser.add_option('--tolerance', dest='tolerance', type='float', default=0.15, help='allowed slowdown against the baseline, default %default')
+    options, args = parser.parse_args()
+    options.points = [ int(p) for p in options.points.split(',') ]
+    return options
+
+class Counter:
+    # objects still alive at the end of a stage ( allocated minus freed ),
+    # tracemalloc when the interpreter has it. Temporaries freed inside the
+    # stage do not show, python 2 has no count of every allocation.
+    def __init__ (self):
+        try:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+        except ImportError:
+            self.tracemalloc = None
+
+    def start (self):
+        gc.collect()
+        gc.disable()
+        if self.tracemalloc is not None:
+            self.tracemalloc.start()
+            self.base = len( self.tracemalloc.take_snapshot().traces )
+        else:
+            self.base = gc.get_count()[0]
+
+    def stop (self):
+        if self.tracemalloc is not None:
+            count = len( self.tracemalloc.take_snapshot().traces ) - self.base
+            self.tracemalloc.stop()
+        else:
+            count = gc.get_count()[0] - self.base
+        gc.enable()
+        return count
+
+def session (transport):
+    dev = Forerunner( transport )
+    dev.start_session()
+    dev.get_device_capabilities()
+    return dev
+
+def track_packets (points):
+    for transfer in synth.track_log_transfers( points ):
+        for data in transfer:
+            yield data
+
+def make_capture (path, options, points):
+    transport = make_transport( 'synthetic', track_points = points, laps = options.laps, course_points = options.course_points,
+        course_laps = options.laps, almanac = options.almanac )
+    dev = session( make_transport( 'record', transport, path ) )
+    for i in xrange( transfers(points) ):
+        for segment in dev.iter_track_log():
+            pass
+    dev.get_laps()
+    dev.get_course_laps()
+    dev.get_course_tracks()
+    dev.get_almanac()
+    dev.close()
+
+def transfers (points):
+    per_transfer = synth.points_per_transfer()
+    return (points + per_transfer - 1) // per_transfer
+
+# every stage gets its inputs ready, then returns a callable doing the
+# measured work and returning ( packets, records )
+
+def stage_packet (options, points, capture):
+    raw = list( track_packets(points) )
+    def run ():
+        for data in raw:
+            Packet( data )
+        return len(raw), points
+    return run
+
+def stage_decode (options, points, capture):
+    dev = session( make_transport( 'synthetic' ) )
+    packets = [ Packet( data ) for data in track_packets(points) ]
+    def run ():
+        decode = dev.decode
+        for packet in packets:
+            decode( packet )
+        return len(packets), points
+    return run
+
+def decoder_stage (packet_id, stream):
+    def stage (options, points, capture):
+        dev = session( make_transport( 'synthetic' ) )
+        packets = [ Packet( data ) for data in stream(options, points) ]
+        packets = [ packet for packet in packets if packet.id == packet_id ]
+        def run ():
+            decoder = dev.decoders[packet_id]
+            for packet in packets:
+                decoder( StructReader( packet.data, '<', packet.offset, packet.end ) )
+            return len(packets), len(packets)
+        return run
+    return stage
+
+def reader_stage (method, count, columnar = None, segmented = True, pipeline = 0):
+    def stage (options, points, capture):
+        dev = session( make_transport( 'replay', capture ) )
+        dev.set_pipeline( pipeline )
+        def run ():
+            packets = records = 0
+            for i in xrange( method == 'iter_track_log' and transfers(points) or 1 ):
+                if columnar is None:
+                    result = getattr( dev, method )()
+                else:
+                    result = getattr( dev, method )( columnar )
+                for item in result:
+                    records += count(item)
+                    packets += count(item) + (segmented and 1 or 0)
+            return packets, records
+        return run
+    return stage
+
+def stage_lazy_scan (options, points, capture):
+    # time and position only, the lazy records leave the other fields packed
+    dev = session( make_transport( 'replay', capture ) )
+    dev.set_lazy( True )
+    def run ():
+        packets = records = 0
+        for i in xrange( transfers(points) ):
+            for segment in dev.iter_track_log():
+                for point in segment.data:
+                    point.time, point.position
+                records += len(segment.data)
+                packets += len(segment.data) + 1
+        return packets, records
+    return run
+
+def segment_points (segment):
+    return len(segment.data)
+
+STAGES = [
+    ( 'packet.track',               stage_packet,   True )
+    , ( 'decode.track',             stage_decode,   True )
+    , ( 'decoder.track_data',       decoder_stage( Packet.TRACK_DATA, lambda o, p: track_packets(p) ), True )
+    , ( 'decoder.lap',              decoder_stage( Packet.LAP, lambda o, p: synth.laps(o.laps) ), False )
+    , ( 'decoder.course_lap',       decoder_stage( Packet.COURSE_LAP, lambda o, p: synth.course_laps(o.laps) ), False )
+    , ( 'decoder.almanac_data',     decoder_stage( Packet.ALMANAC_DATA, lambda o, p: synth.almanac(o.almanac) ), False )
+    , ( 'reader.track_log',         reader_stage( 'iter_track_log', segment_points, False ), True )
+    , ( 'reader.track_log.columnar', reader_stage( 'iter_track_log', segment_points, True ), True )
+    , ( 'reader.track_log.pipelined', reader_stage( 'iter_track_log', segment_points, False, pipeline = 256 ), True )
+    , ( 'reader.track_log.lazy_scan', stage_lazy_scan, True )
+    , ( 'reader.laps',              reader_stage( 'get_laps', lambda item: 1, segmented = False ), False )
+    , ( 'reader.course_tracks',     reader_stage( 'iter_course_tracks', segment_points, False ), False )
+    , ( 'reader.almanac',           reader_stage( 'get_almanac', lambda item: 1, segmented = False ), False )
+]
+
+def run_stage (args):
+    # runs in its own process so peak RSS belongs to the stage
+    index, options, points, capture = args
+    name, stage, sized = STAGES[index]
+    run = stage( options, points, capture )
+    rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    counter = Counter()
+    counter.start()
+    started = time.time()
+    packets, records = run()
+    elapsed = time.time() - started
+    retained = counter.stop()
+    return dict(
+        packets_per_sec = packets / elapsed
+        , records_per_sec = records / elapsed
+        , peak_rss_kb = max( 0, resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss - rss )
+        , retained_per_record = float(retained) / max( records, 1 )
+        , records = records
+        , seconds = elapsed
+    )
+
+def selected (name, options):
+    if not options.stages:
+        return True
+    return [ prefix for prefix in options.stages if name.startswith(prefix) ]
+
+def run_all (options):
+    results = {}
+    directory = tempfile.mkdtemp( prefix = 'garmin-bench-' )
+    pool = multiprocessing.Pool( 1, maxtasksperchild = 1 )
+    try:
+        for points in options.points:
+            capture = os.path.join( directory, 'session-%d.cap' % points )
+            make_capture( capture, options, points )
+            for index, (name, stage, sized) in enumerate(STAGES):
+                if not selected( name, options ):
+                    continue
+                if not sized and points != options.points[0]:
+                    continue
+                key = sized and '%s.%d' % (name, points) or name
+                results[key] = pool.apply( run_stage, [ (index, options, points, capture) ] )
+                report( key, results[key] )
+    finally:
+        pool.terminate()
+        shutil.rmtree( directory )
+    return results
+
+def report (name, result):
+    msg = '%-36s %12.0f pkt/s %12.0f rec/s %10d kB peak %8.2f retained/rec'
+    log.info( msg, name, result['packets_per_sec'], result['records_per_sec'], result['peak_rss_kb'], result['retained_per_record'] )
+
+def compare (results, baseline, tolerance):
+    regressions = []
+    for name, expected in sorted(baseline.items()):
+        if name not in results:
+            continue
+        ratio = results[name]['records_per_sec'] / expected['records_per_sec']
+        status = 'ok'
+        if ratio < 1 - tolerance:
+            status = 'REGRESSION'
+            regressions.append( name )
+        log.info( '%-36s %6.2fx %s', name, ratio, status )
+    return regressions
+
+def main ():
+    options = parse_options()
+    init_logging()
+    results = run_all( options )
+    if options.save:
+        json.dump( results, open( options.save, 'w' ), indent = 2, sort_keys = True )
+    if options.compare:
+        regressions = compare( results, json.load( open( options.compare ) ), options.tolerance )
+        if regressions:
+            log.error( '%d stage(s) slower than the baseline: %s', len(regressions), ', '.join(regressions) )
+            return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit( main() )
@@ -1,7 +1,14 @@
 #!/usr/bin/python
-import logging
+import logging, optparse
 
 from garmin.device import Forerunner
+from garmin import transports
+from garmin.capabilities import CapabilityCache
+from garmin.sync import SyncState, IncrementalSync
+from garmin.store import ActivityStore
+from garmin.pool import DevicePool
+from garmin.trace import Tracer
+from garmin.batch import BatchDecoder
 
 log = logging.getLogger('main')
 dbg = log.debug
@@ -25,16 +32,100 @@ def dump_many(items, printer= None, prefix='', indent = 0 ):
         log.debug( indentation + '%d %s:', i , prefix)
         (printer or dump_one)(item, indent = indent + 1 )
 
+def parse_options ():
+    parser = optparse.OptionParser()
+    parser.add_option('--record', dest='record', metavar='FILE', help='capture every packet of the session to FILE')
+    parser.add_option('--replay', dest='replay', metavar='FILE', help='replay a captured session instead of using the device')
+    parser.add_option('--pipeline', dest='pipeline', type='int', default=0, metavar='N', help='read up to N packets ahead on a background thread')
+    parser.add_option('--capability-cache', dest='capability_cache', metavar='FILE',
+        help='cache the device capabilities in FILE, a pickle: only give a file no other user can write')
+    parser.add_option('--sync', dest='sync', metavar='FILE', help='only download runs, laps and tracks newer than the watermarks kept in FILE')
+    parser.add_option('--store', dest='store', metavar='FILE', help='save runs, laps, tracks and courses to the activity database FILE')
+    parser.add_option('--retries', dest='retries', type='int', default=0, metavar='N', help='resume a failed transfer up to N times')
+    parser.add_option('--trace', dest='trace', metavar='FILE', help='time every packet and save a Chrome trace to FILE')
+    parser.add_option('--decode-captures', dest='decode_captures', action='store_true',
+        help='decode the capture files given as arguments on every core, into --store when given')
+    parser.add_option('--transport', dest='transport', default='pyusb', metavar='NAME',
+        help='transport to the device: pyusb, synthetic, replay ( with --replay FILE ) or one registered under the'
+            ' garmin.transports entry points with a from_options(), default %default. record wraps the transport, give --record FILE')
+    parser.add_option('--all-devices', dest='all_devices', action='store_true', help='sync every docked device in parallel')
+    options, args = parser.parse_args()
+    options.captures = args
+    return options
+
+def make_transport (options):
+    options.vendor_id = Forerunner.VENDOR_ID
+    options.product_id = Forerunner.PRODUCT_ID
+    transport = transports.open_transport( options.replay and 'replay' or options.transport, options )
+    if options.record:
+        return transports.make_transport( 'record', transport, options.record )
+    return transport
+
+def sync_all (options):
+    cache = options.capability_cache and CapabilityCache( options.capability_cache ) or None
+    pool = DevicePool.discover( capability_cache = cache, pipeline = options.pipeline, retries = options.retries )
+    state = options.sync and SyncState( options.sync ) or None
+    def task (dev):
+        if state is not None:
+            res = IncrementalSync( dev, state ).sync()
+            runs, laps, tracks = res.runs, res.laps, res.track_log
+        else:
+            runs, laps, tracks = dev.get_runs()
+        if options.store:
+            store = ActivityStore( options.store )
+            store.ingest_laps( dev.device_id, laps )
+            store.ingest_runs( dev.device_id, runs, laps )
+            store.ingest_track_log( dev.device_id, tracks )
+            store.close()
+        return len(runs), len(laps), len(tracks)
+    report = pool.run( task )
+    for result in report.results:
+        log.info('%s: %s', result.name, result.ok and '%d runs, %d laps, %d tracks' % result.result or result.error )
+
+def decode_captures (options):
+    decoder = BatchDecoder()
+    if options.store:
+        store = ActivityStore( options.store )
+        log.info('%d rows added', decoder.ingest( options.captures, store ) )
+        store.close()
+        return
+    for session in decoder.sessions( options.captures ):
+        dump_many(session.runs, prefix = '%s runs' % session.path)
+        dump_many(session.laps, prefix = '%s laps' % session.path)
+        dump_many(session.track_log, prefix = '%s tracks' % session.path)
+
 def main():
+    options = parse_options()
     init_logging()
-    dev = Forerunner()
+    if options.all_devices:
+        return sync_all( options )
+    if options.decode_captures:
+        return decode_captures( options )
+    dev = Forerunner( make_transport(options) )
+    dev.set_pipeline( options.pipeline )
+    dev.set_retries( options.retries )
+    tracer = None
+    if options.trace:
+        tracer = Tracer()
+        tracer.attach( dev )
+    if options.capability_cache:
+        dev.set_capability_cache( CapabilityCache( options.capability_cache ) )
     try:
         dev.start_session()
         dev.get_device_capabilities()
 
+        if options.sync:
+            res = IncrementalSync( dev, SyncState( options.sync ) ).sync()
+            dump_many(res.runs, prefix = 'new runs')
+            dump_many(res.laps, prefix = 'new laps')
+            dump_many(res.track_log, prefix = 'new tracks')
+            if options.store:
+                ActivityStore( options.store ).ingest_sync( dev.device_id, res )
+            return
+
         dbg('loading courses')
-        res = dev.get_courses()
-        dbg('res: %s', res )
+        courses = dev.get_courses()
+        dbg('res: %s', courses )
 
         res = dev.get_course_points()
         dump_many(res, prefix ='course points')
@@ -46,6 +137,8 @@ def main():
         log.debug('res: %s', res )
         res = dev.get_course_tracks()
         dump_many(res)
+        if options.store:
+            ActivityStore( options.store ).ingest_courses( dev.device_id, courses, res )
 
         res = dev.get_fitness_profile()
         dump_one(res)
@@ -63,8 +156,16 @@ def main():
         dump_many(laps)
         log.debug("Track:")
         dump_many(tracks)
+        if options.store:
+            store = ActivityStore( options.store )
+            store.ingest_laps( dev.device_id, laps )
+            store.ingest_runs( dev.device_id, runs, laps )
+            store.ingest_track_log( dev.device_id, tracks )
     finally:
         dev.close()
+        if tracer is not None:
+            tracer.log_summary()
+            tracer.write_chrome_trace( options.trace )
 
 if __name__=='__main__':
     try:
@@ -0,0 +1,128 @@
+import bisect, logging
+from garmin.columnar import TrackColumns
+from garmin.store    import to_seconds
+
+log = logging.getLogger('garmin.activity')
+
+# Joins what get_runs returns: a run points at its laps by index range and
+# at its track by track index. The index maps are built once, an activity
+# is then assembled in constant time and track points are split between
+# laps by bisecting the point times.
+
+NO_TRACK = 0xFFFF
+
+def point_times (data):
+    if isinstance(data, TrackColumns):
+        return data.time
+    return [ to_seconds(point.time) for point in data ]
+
+def time_span (data):
+    # times of the first and last point, without converting the others
+    if isinstance(data, TrackColumns):
+        return data.time[0], data.time[-1]
+    return to_seconds( data[0].time ), to_seconds( data[-1].time )
+
+def lap_end (lap):
+    # lap durations are hundredths of seconds
+    return to_seconds( lap.start_time ) + ( lap.duration + 99 ) // 100
+
+class Activity:
+
+    def __init__ (self, run, laps, segments):
+        self.run = run
+        self.laps = laps
+        self.segments = segments
+        self.times = [ point_times( segment.data ) for segment in segments ]
+
+    def lap_points (self, position):
+        # the points of each segment recorded during the lap at position
+        # in self.laps, as slices of the segment data
+        lap = self.laps[position]
+        start = to_seconds( lap.start_time )
+        if position + 1 < len(self.laps):
+            end = to_seconds( self.laps[position + 1].start_time )
+        else:
+            end = lap_end( lap ) + 1
+        result = []
+        for segment, times in zip( self.segments, self.times ):
+            first = bisect.bisect_left( times, start )
+            last = bisect.bisect_left( times, end, first )
+            if first < last:
+                result.append( slice_points( segment.data, first, last ) )
+        return result
+
+    def points (self):
+        return [ segment.data for segment in self.segments ]
+
+    def __repr__ (self):
+        return '<Activity run %d: %d laps, %d segments>' % ( self.run.track_index, len(self.laps), len(self.segments) )
+
+def slice_points (data, start, end):
+    if isinstance(data, TrackColumns):
+        return data.slice( start, end )
+    return data[start:end]
+
+class ActivityIndex:
+
+    def __init__ (self, runs, laps, track_log):
+        self.runs = list(runs)
+        self.laps = sorted( laps, key = lambda lap: to_seconds(lap.start_time) )
+        self.track_log = [ segment for segment in track_log if len(segment.data) ]
+        self.laps_by_index = dict( [ ( lap.index, lap ) for lap in self.laps ] )
+        self.lap_starts = [ to_seconds(lap.start_time) for lap in self.laps ]
+        # track headers are the track index for D311, other headers have
+        # no index and are found by time
+        self.segments_by_index = dict( [ ( segment.header, segment ) for segment in self.track_log
+            if isinstance(segment.header, (int, long)) ] )
+        spans = [ time_span( segment.data ) for segment in self.track_log ]
+        self.segment_order = sorted( range(len(self.track_log)), key = lambda i: spans[i][0] )
+        # segments do not overlap, their ends are in the same order as their
+        # starts
+        self.segment_starts = [ spans[i][0] for i in self.segment_order ]
+        self.segment_ends = [ spans[i][1] for i in self.segment_order ]
+        self.activities = {}
+
+    def __len__ (self):
+        return len(self.runs)
+
+    def __getitem__ (self, position):
+        return self.activity( position )
+
+    def __iter__ (self):
+        for position in xrange(len(self.runs)):
+            yield self.activity( position )
+
+    def activity (self, position):
+        activity = self.activities.get( position, None )
+        if activity is None:
+            run = self.runs[position]
+            laps = [ self.laps_by_index[i] for i in xrange( run.first_lap_index, run.last_lap_index + 1 )
+                if i in self.laps_by_index ]
+            activity = self.activities[position] = Activity( run, laps, self.run_segments( run, laps ) )
+        return activity
+
+    def run_segments (self, run, laps):
+        segment = self.segments_by_index.get( run.track_index, None )
+        if segment is not None and run.track_index != NO_TRACK:
+            return [ segment ]
+        if not laps:
+            return []
+        return self.segments_between( to_seconds(laps[0].start_time), lap_end(laps[-1]) )
+
+    def segments_between (self, start, end):
+        # segments starting before end and not finished at start
+        first = bisect.bisect_left( self.segment_ends, start )
+        last = bisect.bisect_left( self.segment_starts, end, first )
+        return [ self.track_log[ self.segment_order[i] ] for i in xrange( first, last ) ]
+
+    def lap_at (self, seconds):
+        # the lap running at the given garmin seconds or datetime, None
+        # between laps
+        seconds = to_seconds( seconds )
+        position = bisect.bisect_right( self.lap_starts, seconds ) - 1
+        if position < 0:
+            return None
+        lap = self.laps[position]
+        if seconds > lap_end( lap ):
+            return None
+        return lap
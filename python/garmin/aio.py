@@ -0,0 +1,476 @@
+import sys, threading, Queue, time, weakref, atexit, logging
+
+from garmin.packet  import Packet
+from garmin.command import *
+from garmin.device  import Forerunner
+from garmin.usbio   import USBException
+
+log = logging.getLogger('garmin.aio')
+
+# Non blocking interface over a Forerunner for event loop services, built on
+# threads only: it needs no extra package and binds to no event loop.
+#
+# Every device gets one worker thread where its blocking USB reads run, the
+# generator readers of Forerunner are driven there too. A call returns a
+# Call at once, completed on the worker: a thread waits for it with
+# result(), an event loop awaits loop_future( call, loop ). Calls on one
+# device run in order, calls on different devices side by side.
+#
+# Every call takes a timeout in seconds, counted from the moment it starts
+# on the worker: the device reads are bounded by it and transfers check it
+# between two batches of BATCH packets, they can be cancelled there too. A
+# call timed out or cancelled midway leaves the device in the middle of a
+# response, it is closed and start_session opens it again.
+#
+# The iter_* streams are iterators: iterating one blocks the caller until
+# the next record, at most the stream timeout. A stream owns the device from
+# its first record to its last, calls made meanwhile wait for it; a stream
+# closed, or dropped without close(), lets go at once.
+
+class AsyncException (Exception): pass
+class CallTimeout (AsyncException): pass
+class CallCancelled (AsyncException): pass
+
+class Call:
+    # the outcome of a function run on a device worker
+
+    def __init__ (self):
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.value = None
+        self.error = None
+        self.cancel_requested = False
+
+    def done (self):
+        return self.finished.is_set()
+
+    def cancel (self):
+        # a call not finished stops before it starts or before its next
+        # batch, False when it is too late
+        self.cancel_requested = True
+        return not self.done()
+
+    def cancelled (self):
+        return self.done() and self.error is not None and isinstance( self.error[1], CallCancelled )
+
+    def check (self, deadline = None):
+        # on the worker, between two batches
+        if self.cancel_requested:
+            raise CallCancelled, 'Call cancelled'
+        if deadline is not None and time.time() > deadline:
+            raise CallTimeout, 'Transfer timed out'
+
+    def complete (self, value = None, error = None):
+        # error is an exc_info triple
+        self.lock.acquire()
+        try:
+            if self.done():
+                return
+            self.value = value
+            self.error = error
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        finally:
+            self.lock.release()
+        for callback in callbacks:
+            self.run_callback( callback )
+
+    def run_callback (self, callback):
+        try:
+            callback( self )
+        except Exception:
+            log.exception('Call callback failed')
+
+    def add_done_callback (self, callback):
+        # callback( call ) runs on the worker thread, at once when the call
+        # is already done
+        self.lock.acquire()
+        try:
+            if not self.done():
+                self.callbacks.append( callback )
+                return
+        finally:
+            self.lock.release()
+        self.run_callback( callback )
+
+    def result (self, timeout = None):
+        # waits for the call, a timeout only stops waiting
+        if not self.finished.wait( timeout ):
+            raise CallTimeout, 'Call not finished after %s seconds' % timeout
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+    def exception (self, timeout = None):
+        if not self.finished.wait( timeout ):
+            raise CallTimeout, 'Call not finished after %s seconds' % timeout
+        return self.error and self.error[1]
+
+def loop_future (call, loop):
+    # the bridge to asyncio ( or trollius, or any loop with create_future
+    # and call_soon_threadsafe ): a future of loop completed on the loop
+    # thread, cancelling it cancels the call.
+    #   laps = yield From( loop_future( device.get_laps( timeout = 30 ), loop ) )
+    #   laps = await loop_future( device.get_laps( timeout = 30 ), loop )
+    # Streams are awaited record by record with next_call().
+    future = loop.create_future()
+    def settle (call):
+        if future.cancelled():
+            return
+        if call.error is not None:
+            future.set_exception( call.error[1] )
+        else:
+            future.set_result( call.value )
+    def done (future):
+        if future.cancelled():
+            call.cancel()
+    future.add_done_callback( done )
+    call.add_done_callback( lambda call: loop.call_soon_threadsafe( settle, call ) )
+    return future
+
+# the workers still running are stopped at exit, before the interpreter
+# tears down the modules their threads use
+_workers = weakref.WeakSet()
+
+def _stop_workers ():
+    workers = list(_workers)
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join( 1 )
+
+atexit.register( _stop_workers )
+
+class DeviceWorker (threading.Thread):
+    # runs the calls on one device in order. While a transfer owns the
+    # device the calls of anyone else are held back, they run once it lets
+    # go, in the order they were made.
+
+    def __init__ (self, name = 'garmin-aio'):
+        threading.Thread.__init__( self, name = name )
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.owner = None
+        self.held = []
+        _workers.add( self )
+
+    def submit (self, function, args = (), owner = None, call = None):
+        # function( *args ) runs on the worker, its result completes call
+        call = call or Call()
+        self.queue.put( ( owner, function, args, call ) )
+        return call
+
+    def stop (self):
+        self.queue.put( None )
+
+    def acquire (self, owner):
+        # on the worker
+        self.owner = owner
+
+    def release (self, owner):
+        # on the worker
+        if self.owner is owner:
+            self.owner = None
+
+    def next_item (self):
+        if self.owner is None and self.held:
+            return self.held.pop(0)
+        return self.queue.get()
+
+    def run (self):
+        while True:
+            item = self.next_item()
+            if item is None:
+                return
+            owner, function, args, call = item
+            if self.owner is not None and owner is not self.owner:
+                self.held.append( item )
+                continue
+            if call.done():
+                continue
+            try:
+                call.check()
+                call.complete( function( *args ) )
+            except Exception:
+                call.complete( error = sys.exc_info() )
+
+class Transfer:
+    # one transfer driven batch by batch on the worker, items emitted by
+    # the reader are collected in pending
+
+    def __init__ (self, session, command, make_reader, overrides = None):
+        self.session = session
+        self.command = command
+        self.make_reader = make_reader
+        self.overrides = overrides
+        self.pending = []
+        self.reader = None
+        self.done = False
+        self.result = None
+
+    def begin (self):
+        dev = self.session.device
+        self.session.worker.acquire( self )
+        dev.send_command( self.command )
+        self.decoders = dev.dispatch_table( self.overrides )
+        self.reader = self.make_reader( self.pending.append )
+        self.reader.next()
+
+    def step (self, call, deadline = None):
+        # one batch, the transfer ends on any error
+        try:
+            call.check( deadline )
+            if self.reader is None:
+                self.begin()
+            read_response = self.session.device.read_response
+            for i in xrange( self.session.batch ):
+                result = self.reader.send( read_response( self.decoders ) )
+                if result is not None:
+                    self.result = result
+                    self.finish()
+                    return
+        except ( CallCancelled, CallTimeout ):
+            self.abort()
+            raise
+        except Exception:
+            self.finish()
+            raise
+
+    def run (self, call, deadline = None):
+        # the whole transfer, on the worker
+        while not self.done:
+            self.step( call, deadline )
+        return self.result
+
+    def abort (self):
+        if not self.done and self.reader is not None:
+            log.warn('Transfer interrupted, closing the device')
+            try:
+                self.session.device.close()
+            except Exception, ex:
+                log.debug('Closing the device failed: %s', ex )
+        self.finish()
+
+    def finish (self):
+        self.done = True
+        self.session.worker.release( self )
+
+class AsyncStream:
+    # the records of a streaming transfer. Iterating waits at most timeout
+    # seconds for each record, a stream that timed out is closed. close()
+    # stops the transfer early, a stream dropped unfinished is closed too.
+
+    def __init__ (self, transfer, timeout = None):
+        self.transfer = transfer
+        self.timeout = timeout
+        self.position = 0
+
+    def advance (self, call, deadline = None):
+        # on the worker
+        transfer = self.transfer
+        while self.position >= len(transfer.pending):
+            if transfer.done:
+                return None
+            del transfer.pending[:]
+            self.position = 0
+            transfer.step( call, deadline )
+        item = transfer.pending[self.position]
+        self.position += 1
+        return item
+
+    def submit (self, run, timeout):
+        call = Call()
+        session = self.transfer.session
+        return session.worker.submit( session.bounded, ( call, timeout, run ), self.transfer, call )
+
+    def next_call (self):
+        # a Call for the next record, None after the last one
+        return self.submit( lambda call, deadline: self.advance( call, deadline ), self.timeout )
+
+    def __iter__ (self):
+        return self
+
+    def next (self):
+        call = self.next_call()
+        try:
+            item = call.result( self.timeout )
+        except CallTimeout:
+            call.cancel()
+            self.close()
+            raise
+        if item is None:
+            raise StopIteration
+        return item
+
+    def all (self, timeout = None):
+        # a Call for the remaining records in a list
+        def collect (call, deadline):
+            result = []
+            while True:
+                item = self.advance( call, deadline )
+                if item is None:
+                    return result
+                result.append( item )
+        return self.submit( collect, timeout )
+
+    def close (self):
+        transfer = self.transfer
+        if not transfer.done:
+            transfer.session.worker.submit( transfer.abort, (), transfer )
+
+    def __del__ (self):
+        self.close()
+
+class AsyncForerunner:
+
+    # packets read per batch
+    BATCH = 64
+
+    def __init__ (self, device = None, batch = BATCH):
+        # device is a Forerunner, or a transport to make one with
+        if not isinstance(device, Forerunner):
+            device = Forerunner( device )
+        self.device = device
+        self.batch = batch
+        self.worker = DeviceWorker( 'garmin-aio-%x' % id(self) )
+        self.worker.start()
+
+    def call (self, function, *args, **kwargs):
+        # function( *args ) on the worker, with an optional timeout
+        return self.submit( lambda call, deadline: function( *args ), kwargs.get( 'timeout', None ) )
+
+    def submit (self, run, timeout = None):
+        call = Call()
+        return self.worker.submit( self.bounded, ( call, timeout, run ), call = call )
+
+    def bounded (self, call, timeout, run):
+        # on the worker: run( call, deadline ) with every device read bounded
+        # by the time left, a read failing past the deadline times the call out
+        if timeout is None:
+            return run( call, None )
+        dev = self.device
+        deadline = time.time() + timeout
+        timeouts = dev.bulk_timeout, dev.intr_timeout
+        milliseconds = max( 1, int( timeout * 1000 ) )
+        dev.set_timeouts( min( timeouts[0], milliseconds ), min( timeouts[1], milliseconds ) )
+        try:
+            return run( call, deadline )
+        except ( USBException, IOError ):
+            if time.time() < deadline:
+                raise
+            log.warn('Call timed out in the middle of a response, closing the device')
+            try:
+                dev.close()
+            except Exception, ex:
+                log.debug('Closing the device failed: %s', ex )
+            raise CallTimeout, 'Call timed out after %s seconds' % timeout
+        finally:
+            dev.set_timeouts( *timeouts )
+
+    def shutdown (self):
+        # the worker ends once the calls made before are done
+        self.worker.stop()
+
+    def transfer (self, command, make_reader, overrides = None, timeout = None):
+        transfer = Transfer( self, command, make_reader, overrides )
+        return self.submit( transfer.run, timeout )
+
+    def stream (self, command, make_reader, overrides = None, timeout = None):
+        return AsyncStream( Transfer( self, command, make_reader, overrides ), timeout )
+
+    def record_transfer (self, command, packet_id):
+        return command, lambda emit: self.device.record_reader( packet_id ), None
+
+    def track_transfer (self, columnar, course = False):
+        dev = self.device
+        data_type = dev.track_data_type( columnar )
+        if course:
+            return ( TransferCourseTracks, lambda emit: dev.course_track_reader( data_type )
+                , dev.track_overrides( Packet.COURSE_TRACK_DATA, columnar ) )
+        return ( TransferTrackLog, lambda emit: dev.serial_array_reader( Packet.TRACK_HEADER, Packet.TRACK_DATA, data_type )
+            , dev.track_overrides( Packet.TRACK_DATA, columnar ) )
+
+    def transfers (self, timeout, *transfers):
+        # several transfers in one call, a tuple of their results
+        def run (call, deadline):
+            return tuple( [ Transfer( self, command, make_reader, overrides ).run( call, deadline )
+                for command, make_reader, overrides in transfers ] )
+        return self.submit( run, timeout )
+
+    def records (self, command, packet_id, timeout = None):
+        return self.transfer( *self.record_transfer( command, packet_id ), timeout = timeout )
+
+    # single packet answers
+
+    def start_session (self, timeout = None):
+        return self.call( self.device.start_session, timeout = timeout )
+
+    def get_device_capabilities (self, timeout = None):
+        return self.call( self.device.get_device_capabilities, timeout = timeout )
+
+    def get_time (self, timeout = None):
+        return self.call( self.device.get_time, timeout = timeout )
+
+    def get_fitness_profile (self, timeout = None):
+        return self.call( self.device.get_fitness_profile, timeout = timeout )
+
+    def get_course_limits (self, timeout = None):
+        return self.call( self.device.get_course_limits, timeout = timeout )
+
+    def turn_off (self, timeout = None):
+        return self.call( self.device.turn_off, timeout = timeout )
+
+    def close (self):
+        return self.call( self.device.close )
+
+    # record transfers
+
+    def get_almanac (self, timeout = None):
+        return self.records( TransferAlmanac, Packet.ALMANAC_DATA, timeout )
+
+    def get_laps (self, timeout = None):
+        return self.records( TransferLaps, Packet.LAP, timeout )
+
+    def get_courses (self, timeout = None):
+        return self.records( TransferCourses, Packet.COURSE, timeout )
+
+    def get_course_laps (self, timeout = None):
+        return self.records( TransferCourseLaps, Packet.COURSE_LAP, timeout )
+
+    def get_course_points (self, timeout = None):
+        return self.records( TransferCoursePoints, Packet.COURSE_POINT, timeout )
+
+    def get_workouts (self, timeout = None):
+        return self.transfers( timeout, self.record_transfer( TransferWorkouts, Packet.WORKOUT )
+            , self.record_transfer( TransferWorkoutOccurrences, Packet.WORKOUT_OCCURRENCE ) )
+
+    def get_track_log (self, columnar = False, timeout = None):
+        return self.transfer( *self.track_transfer( columnar ), timeout = timeout )
+
+    def get_course_tracks (self, columnar = False, timeout = None):
+        return self.transfer( *self.track_transfer( columnar, True ), timeout = timeout )
+
+    def get_runs (self, timeout = None):
+        return self.transfers( timeout, self.record_transfer( TransferRuns, Packet.RUN )
+            , self.record_transfer( TransferLaps, Packet.LAP ), self.track_transfer( False ) )
+
+    # streams
+
+    def iter_runs (self, timeout = None):
+        return self.stream( TransferRuns, lambda emit: self.device.record_reader( Packet.RUN, emit ), timeout = timeout )
+
+    def iter_laps (self, timeout = None):
+        return self.stream( TransferLaps, lambda emit: self.device.record_reader( Packet.LAP, emit ), timeout = timeout )
+
+    def iter_track_log (self, columnar = False, timeout = None):
+        dev = self.device
+        data_type = dev.track_data_type( columnar )
+        make_reader = lambda emit: dev.serial_array_reader( Packet.TRACK_HEADER, Packet.TRACK_DATA, data_type, emit )
+        return self.stream( TransferTrackLog, make_reader, dev.track_overrides( Packet.TRACK_DATA, columnar ), timeout )
+
+    def iter_course_tracks (self, columnar = False, timeout = None):
+        dev = self.device
+        data_type = dev.track_data_type( columnar )
+        make_reader = lambda emit: dev.course_track_reader( data_type, emit )
+        return self.stream( TransferCourseTracks, make_reader, dev.track_overrides( Packet.COURSE_TRACK_DATA, columnar ), timeout )
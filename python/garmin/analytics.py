@@ -0,0 +1,159 @@
+import logging
+from garmin.columnar import TrackColumns, GARMIN_EPOCH_OFFSET, INVALID_POSITION
+from garmin.utils    import Obj
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger('garmin.analytics')
+
+# Track analytics as array operations over TrackColumns, one numpy call per
+# quantity instead of a Python loop per point. Interval values ( distance,
+# speed, ... ) have one entry less than the points: entry i goes from point
+# i to point i + 1.
+
+EARTH_RADIUS = 6371008.8 # meters, mean radius
+
+SEMICIRCLE_RADIANS = numpy and numpy.pi / 2 ** 31
+
+# floats at or above this value mean the device had no measure
+INVALID_FLOAT = 1e24
+
+# intervals longer than this many seconds are pauses, they are left out of
+# the moving time, the speeds and the heart rate zones
+MAX_GAP = 30
+
+def require_numpy ():
+    if numpy is None:
+        raise ImportError, 'numpy is required for track analytics'
+
+def degrees (semicircles):
+    require_numpy()
+    return numpy.asarray( semicircles, dtype = numpy.float64 ) * ( 180.0 / 2 ** 31 )
+
+def datetimes (times):
+    # garmin epoch seconds to numpy datetime64, UTC
+    require_numpy()
+    return ( numpy.asarray( times, dtype = numpy.int64 ) + GARMIN_EPOCH_OFFSET ).astype('datetime64[s]')
+
+def haversine (latitude, longitude):
+    # great circle distances in meters between consecutive positions given
+    # in semicircles, nan where either end has no fix
+    require_numpy()
+    latitude = numpy.asarray( latitude, dtype = numpy.float64 )
+    longitude = numpy.asarray( longitude, dtype = numpy.float64 )
+    invalid = latitude == INVALID_POSITION
+    latitude = latitude * SEMICIRCLE_RADIANS
+    longitude = longitude * SEMICIRCLE_RADIANS
+    a = numpy.sin( numpy.diff(latitude) / 2 ) ** 2 \
+        + numpy.cos( latitude[:-1] ) * numpy.cos( latitude[1:] ) * numpy.sin( numpy.diff(longitude) / 2 ) ** 2
+    distances = 2 * EARTH_RADIUS * numpy.arcsin( numpy.sqrt( numpy.minimum( a, 1.0 ) ) )
+    distances[ invalid[:-1] | invalid[1:] ] = numpy.nan
+    return distances
+
+class TrackAnalysis:
+
+    def __init__ (self, points, max_gap = MAX_GAP):
+        require_numpy()
+        columns = TrackColumns.from_points( points )
+        self.time = columns.column('time').astype( numpy.int64 )
+        self.latitude = columns.column('latitude')
+        self.longitude = columns.column('longitude')
+        self.altitude = columns.column('altitude')
+        self.heart_rate = columns.column('heart_rate')
+        self.durations = numpy.diff( self.time )
+        self.moving = ( self.durations > 0 ) & ( self.durations <= max_gap )
+
+    def __len__ (self):
+        return len(self.time)
+
+    def positions (self):
+        # ( latitude, longitude ) in degrees, nan without a fix
+        invalid = self.latitude == INVALID_POSITION
+        latitude, longitude = degrees( self.latitude ), degrees( self.longitude )
+        latitude[invalid] = longitude[invalid] = numpy.nan
+        return latitude, longitude
+
+    def datetimes (self):
+        return datetimes( self.time )
+
+    def distances (self):
+        return haversine( self.latitude, self.longitude )
+
+    def distance (self):
+        return numpy.nansum( self.distances() )
+
+    def speeds (self):
+        # meters per second per interval, nan for pauses and missing fixes
+        speeds = numpy.full( len(self.durations), numpy.nan )
+        speeds[self.moving] = self.distances()[self.moving] / self.durations[self.moving]
+        return speeds
+
+    def paces (self):
+        # seconds per kilometer per interval
+        speeds = self.speeds()
+        paces = numpy.full( len(speeds), numpy.nan )
+        going = numpy.isfinite( speeds )
+        going[going] = speeds[going] > 0
+        paces[going] = 1000.0 / speeds[going]
+        return paces
+
+    def moving_time (self):
+        return int( self.durations[self.moving].sum() )
+
+    def elevation (self, smoothing = 5):
+        # altitudes with a moving average over smoothing points, the points
+        # without altitude are dropped
+        altitude = self.altitude[ self.altitude < INVALID_FLOAT ].astype( numpy.float64 )
+        if smoothing > 1 and len(altitude) >= smoothing:
+            altitude = numpy.convolve( altitude, numpy.ones(smoothing) / smoothing, 'valid' )
+        return altitude
+
+    def elevation_change (self, smoothing = 5):
+        # ( gain, loss ) in meters
+        steps = numpy.diff( self.elevation( smoothing ) )
+        return steps[ steps > 0 ].sum(), -steps[ steps < 0 ].sum()
+
+    def heart_rate_zones (self, zones):
+        # seconds spent in each zone, zones as HeartRateZone records from
+        # the fitness profile ( activities.running.heart_rate_zones ). An
+        # interval counts for the zone of its first point, the first
+        # matching zone wins where zones overlap.
+        lows = numpy.array( [ zone.low for zone in zones ] )
+        highs = numpy.array( [ zone.high for zone in zones ] )
+        heart_rate = self.heart_rate[:-1, numpy.newaxis]
+        inside = ( heart_rate >= lows ) & ( heart_rate <= highs )
+        counted = inside.any( axis = 1 ) & self.moving
+        zone = inside.argmax( axis = 1 )
+        return numpy.bincount( zone[counted], self.durations[counted], len(zones) )
+
+    def summary (self, zones = None):
+        if len(self) < 2:
+            return None
+        distances = self.distances()
+        distance = numpy.nansum( distances )
+        # averages cover the moving intervals only, not the pauses
+        moving_distance = numpy.nansum( distances[self.moving] )
+        moving_time = self.moving_time()
+        speeds = self.speeds()
+        speeds = speeds[ numpy.isfinite(speeds) ]
+        gain, loss = self.elevation_change()
+        heart_rate = self.heart_rate[ self.heart_rate > 0 ]
+        result = Obj(
+            start = self.datetimes()[0]
+            , duration = int( self.time[-1] - self.time[0] )
+            , moving_time = moving_time
+            , distance = distance
+            , average_speed = moving_time and moving_distance / moving_time or 0.0
+            , maximum_speed = len(speeds) and speeds.max() or 0.0
+            , average_pace = moving_distance and moving_time * 1000.0 / moving_distance or None
+            , elevation_gain = gain
+            , elevation_loss = loss
+            , average_heart_rate = len(heart_rate) and heart_rate.mean() or None
+            , maximum_heart_rate = len(heart_rate) and int( heart_rate.max() ) or None
+        )
+        if zones is not None:
+            result.heart_rate_zones = self.heart_rate_zones( zones )
+        return result
@@ -0,0 +1,203 @@
+import struct, array, zlib, json, mmap, bisect, logging
+from garmin.columnar import TrackColumns
+from garmin.layout   import D1011, from_time
+from garmin.utils    import Obj
+
+log = logging.getLogger('garmin.archive')
+
+# Archive file layout:
+#   MAGIC
+#   blocks:  a track segment is one zlib stream per TrackColumns column, a
+#            lap block one zlib stream of D1011 records
+#   index:   zlib compressed json, one entry per block with its offset,
+#            column sizes and time span
+#   TRAILER  ( index offset, index size, INDEX_MAGIC )
+# Times and positions are stored as zigzag varints of the difference with
+# the previous point, floats with their bytes regrouped by significance so
+# zlib finds the repeated exponents.
+
+MAGIC       = 'GRMNARC1'
+INDEX_MAGIC = 'GRMNAIX1'
+TRAILER     = struct.Struct('<Q L 8s')
+
+COMPRESSION = 6
+
+ENCODINGS = {
+    'latitude':     'delta'
+    , 'longitude':  'delta'
+    , 'time':       'delta'
+    , 'altitude':   'shuffle'
+    , 'distance':   'shuffle'
+}
+
+class ArchiveException (Exception): pass
+
+def encode_deltas (values):
+    # zigzag varints of the successive differences
+    result = bytearray()
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        if delta >= 0:
+            delta = delta << 1
+        else:
+            delta = ( -delta << 1 ) - 1
+        while delta >= 0x80:
+            result.append( ( delta & 0x7F ) | 0x80 )
+            delta >>= 7
+        result.append( delta )
+    return str(result)
+
+def decode_deltas (data, typecode):
+    result = array.array( typecode )
+    append = result.append
+    current = value = shift = 0
+    for byte in bytearray(data):
+        if byte < 0x80:
+            value |= byte << shift
+            current += ( value >> 1 ) ^ -( value & 1 )
+            append( current )
+            value = shift = 0
+        else:
+            value |= ( byte & 0x7F ) << shift
+            shift += 7
+    return result
+
+def shuffle (data, size):
+    return ''.join( [ data[i::size] for i in xrange(size) ] )
+
+def unshuffle (data, size):
+    result = bytearray( len(data) )
+    count = len(data) // size
+    for i in xrange(size):
+        result[i::size] = data[i * count:(i + 1) * count]
+    return str(result)
+
+def encode_column (values, encoding):
+    if encoding == 'delta':
+        data = encode_deltas( values )
+    elif encoding == 'shuffle':
+        data = shuffle( values.tostring(), values.itemsize )
+    else:
+        data = values.tostring()
+    return zlib.compress( data, COMPRESSION )
+
+def decode_column (data, typecode, encoding):
+    data = zlib.decompress( data )
+    if encoding == 'delta':
+        return decode_deltas( data, typecode )
+    values = array.array( typecode )
+    if encoding == 'shuffle':
+        data = unshuffle( data, values.itemsize )
+    values.fromstring( data )
+    return values
+
+def lap_values (lap):
+    # a decoded Lap back to the values of the D1011 struct
+    return ( lap.index, from_time(lap.start_time), lap.duration, lap.distance, lap.max_speed ) \
+        + tuple(lap.begin) + tuple(lap.end) + ( lap.calories, lap.average_heart_rate, lap.maximum_heart_rate
+        , lap.intensity, lap.average_cadence, lap.trigger_method )
+
+class ArchiveWriter:
+
+    def __init__ (self, path):
+        self.file = open( path, 'wb' )
+        self.file.write( MAGIC )
+        self.offset = len(MAGIC)
+        self.index = []
+
+    def write (self, data):
+        self.file.write( data )
+        self.offset += len(data)
+
+    def add_segment (self, segment, kind = 'track'):
+        # a segment from the track readers, points or TrackColumns
+        columns = TrackColumns.from_points( segment.data )
+        if not len(columns):
+            return
+        entry = dict( type = 'segment', kind = kind, header = segment.header, offset = self.offset
+            , count = len(columns), start = columns.time[0], end = columns.time[-1], sizes = [] )
+        for name, typecode in TrackColumns.COLUMNS:
+            data = encode_column( getattr(columns, name), ENCODINGS.get( name, None ) )
+            entry['sizes'].append( len(data) )
+            self.write( data )
+        self.index.append( entry )
+
+    def add_track_log (self, segments, kind = 'track'):
+        for segment in segments:
+            self.add_segment( segment, kind )
+
+    def add_laps (self, laps):
+        laps = list(laps)
+        data = ''.join( [ D1011.struct.pack( *lap_values(lap) ) for lap in laps ] )
+        if not data:
+            return
+        data = zlib.compress( data, COMPRESSION )
+        self.index.append( dict( type = 'laps', offset = self.offset, count = len(laps), sizes = [ len(data) ] ) )
+        self.write( data )
+
+    def close (self):
+        if self.file is None:
+            return
+        index = zlib.compress( json.dumps( self.index ), COMPRESSION )
+        index_offset = self.offset
+        self.write( index )
+        self.write( TRAILER.pack( index_offset, len(index), INDEX_MAGIC ) )
+        self.file.close()
+        self.file = None
+
+class ArchiveReader:
+    # maps the archive, only the index is read when opening, a segment is
+    # decompressed when asked for
+
+    def __init__ (self, path):
+        self.file = open( path, 'rb' )
+        self.data = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+        if self.data[:len(MAGIC)] != MAGIC or len(self.data) < len(MAGIC) + TRAILER.size:
+            raise ArchiveException, 'Not a track archive: %s' % path
+        offset, size, magic = TRAILER.unpack_from( self.data, len(self.data) - TRAILER.size )
+        if magic != INDEX_MAGIC:
+            raise ArchiveException, 'Archive was not closed: %s' % path
+        entries = json.loads( zlib.decompress( self.data[offset:offset+size] ) )
+        self.entries = [ Obj(entry) for entry in entries if entry['type'] == 'segment' ]
+        self.entries.sort( key = lambda entry: entry.start )
+        self.starts = [ entry.start for entry in self.entries ]
+        self.lap_blocks = [ Obj(entry) for entry in entries if entry['type'] == 'laps' ]
+
+    def __len__ (self):
+        return len(self.entries)
+
+    def segment (self, position):
+        # the segment at position in time order, as an Obj( header, data )
+        entry = self.entries[position]
+        columns = TrackColumns()
+        offset = entry.offset
+        for (name, typecode), size in zip( TrackColumns.COLUMNS, entry.sizes ):
+            setattr( columns, name, decode_column( self.data[offset:offset+size], typecode, ENCODINGS.get( name, None ) ) )
+            offset += size
+        return Obj( header = entry.header, data = columns )
+
+    def segments (self, start = None, end = None, kind = 'track'):
+        # segments of kind with points between the garmin seconds start and
+        # end, only those are decoded
+        first = 0
+        last = len(self.entries)
+        if end is not None:
+            last = bisect.bisect_left( self.starts, end )
+        for position in xrange( first, last ):
+            entry = self.entries[position]
+            if entry.kind != kind or ( start is not None and entry.end < start ):
+                continue
+            yield self.segment( position )
+
+    def laps (self):
+        result = []
+        for entry in self.lap_blocks:
+            data = zlib.decompress( self.data[entry.offset:entry.offset+entry.sizes[0]] )
+            result.extend( [ D1011.unpack( data, i * D1011.size ) for i in xrange(entry.count) ] )
+        return result
+
+    def close (self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,272 @@
+import multiprocessing, itertools, bisect, logging
+from garmin.packet  import Packet, PacketStream, HEADER
+from garmin.capture import CaptureReader, WRITE
+from garmin.device  import Forerunner
+from garmin.utils   import Obj
+
+log = logging.getLogger('garmin.batch')
+
+# Decodes packet captures again, on every core. The parent only walks the
+# packet headers of a capture: the device description is decoded there to
+# get the protocols, every transfer ( RECORDS ... TRANSFER_COMPLETE ) becomes
+# a task. A task names its bytes by capture path, the read records holding
+# the transfer and its offsets in them, the workers map the capture
+# themselves so only the decoded records cross the process boundary. Results come back in capture order and are merged
+# into one session per capture, ready for ActivityStore.ingest_sync or the
+# GPX and TCX writers.
+
+class BatchException (Exception): pass
+
+# the first data packet of a transfer names it
+TRANSFERS = {
+    Packet.RUN:                     'runs'
+    , Packet.LAP:                   'laps'
+    , Packet.TRACK_HEADER:          'track_log'
+    , Packet.COURSE:                'courses'
+    , Packet.COURSE_LAP:            'course_laps'
+    , Packet.COURSE_POINT:          'course_points'
+    , Packet.COURSE_TRACK_HEADER:   'course_tracks'
+    , Packet.ALMANAC_DATA:          'almanac'
+    , Packet.WORKOUT:               'workouts'
+    , Packet.WORKOUT_OCCURRENCE:    'workout_occurrences'
+}
+
+def responses (capture):
+    # ( first read, bytes, offset of each read in bytes ) of the reads
+    # following each command
+    first = None
+    reads = []
+    for i, (kind, offset, length) in enumerate(capture.index):
+        if kind == WRITE:
+            if reads:
+                yield first, ''.join(reads), read_offsets( reads )
+            first, reads = i + 1, []
+        else:
+            if first is None:
+                first = i
+            reads.append( capture.record(i)[1] )
+    if reads:
+        yield first, ''.join(reads), read_offsets( reads )
+
+def read_offsets (reads):
+    offsets = []
+    offset = 0
+    for data in reads:
+        offsets.append( offset )
+        offset += len(data)
+    return offsets
+
+def packet_headers (data):
+    # ( protocol, packet id, offset, end ) without building packets
+    offset = 0
+    size = len(data)
+    unpack_from = HEADER.unpack_from
+    while offset + HEADER.size <= size:
+        protocol, packet_id, length = unpack_from( data, offset )
+        end = offset + HEADER.size + length
+        if end > size:
+            log.warn('Truncated packet at %d', offset )
+            return
+        yield protocol, packet_id, offset, end
+        offset = end
+
+class CaptureSplitter:
+    # walks one capture, keeps the device description it holds and returns
+    # a task per transfer
+
+    def __init__ (self, path, columnar = True):
+        self.path = path
+        self.columnar = columnar
+        self.decoder = Forerunner()
+        self.device_id = None
+        self.product = None
+        self.protocols = None
+
+    def decode (self, data, offset, end):
+        return self.decoder.decode( Packet( data, offset, end ) )[1]
+
+    def tasks (self):
+        capture = CaptureReader( self.path )
+        try:
+            for first, data, offsets in responses( capture ):
+                for task in self.split( first, data, offsets ):
+                    yield task
+        finally:
+            capture.close()
+
+    def split (self, first, data, offsets):
+        start = None
+        data_packet_id = None
+        for protocol, packet_id, offset, end in packet_headers( data ):
+            if protocol == 0:
+                if packet_id == Packet.SESSION_STARTED:
+                    self.device_id = self.decode( data, offset, end )
+                continue
+            if packet_id == Packet.RECORDS:
+                start, data_packet_id = offset, None
+            elif start is not None:
+                if packet_id == Packet.TRANSFER_COMPLETE:
+                    if data_packet_id is not None:
+                        task = self.task( first, offsets, start, end, data_packet_id )
+                        if task is not None:
+                            yield task
+                    start = None
+                elif data_packet_id is None:
+                    data_packet_id = packet_id
+            elif packet_id == Packet.PRODUCT_DATA:
+                self.product = self.decode( data, offset, end )
+            elif packet_id == Packet.PROTOCOL_ARRAY:
+                self.protocols = self.decode( data, offset, end )
+
+    def task (self, first, offsets, start, end, data_packet_id):
+        if self.protocols is None:
+            log.warn('Transfer before the device description in %s, skipped', self.path )
+            return None
+        if data_packet_id not in TRANSFERS:
+            log.warn('Unknown transfer of packet [%04X] in %s, skipped', data_packet_id, self.path )
+            return None
+        # the reads holding data[start:end], and the offsets within them
+        low = bisect.bisect_right( offsets, start ) - 1
+        high = bisect.bisect_left( offsets, end )
+        return ( self.path, first + low, first + high, start - offsets[low], end - offsets[low]
+            , data_packet_id, self.protocols, self.columnar )
+
+# worker state: the capture being read and a decoding device per protocol
+# table, both kept across tasks
+
+_capture = None
+_capture_path = None
+_devices = {}
+
+def _open_capture (path):
+    global _capture, _capture_path
+    if _capture_path != path:
+        if _capture is not None:
+            _capture.close()
+        _capture = CaptureReader( path )
+        _capture_path = path
+    return _capture
+
+def _device (protocols):
+    key = tuple( sorted( protocols.protocols.items() ) )
+    dev = _devices.get( key, None )
+    if dev is None:
+        dev = _devices[key] = Forerunner()
+        dev.protocols = protocols
+        dev.plan_dispatch( protocols )
+    return dev
+
+def _reader (dev, data_packet_id, columnar):
+    # the reader and decoder overrides of a transfer
+    if data_packet_id == Packet.TRACK_HEADER:
+        return ( dev.serial_array_reader( Packet.TRACK_HEADER, Packet.TRACK_DATA, dev.track_data_type( columnar ) )
+            , dev.track_overrides( Packet.TRACK_DATA, columnar ) )
+    if data_packet_id == Packet.COURSE_TRACK_HEADER:
+        return ( dev.course_track_reader( dev.track_data_type( columnar ) )
+            , dev.track_overrides( Packet.COURSE_TRACK_DATA, columnar ) )
+    return dev.record_reader( data_packet_id ), None
+
+def _decode (task):
+    path, first, last, start, end, data_packet_id, protocols, columnar = task
+    capture = _open_capture( path )
+    data = ''.join( [ capture.record(i)[1] for i in xrange( first, last ) ] )
+    if start > 0 or end < len(data):
+        data = data[start:end]
+    dev = _device( protocols )
+    reader, overrides = _reader( dev, data_packet_id, columnar )
+    decoders = dev.dispatch_table( overrides )
+    stream = PacketStream()
+    stream.feed( data )
+    reader.next()
+    while True:
+        packet = stream.next_packet()
+        if packet is None:
+            raise BatchException, 'Transfer ended early in %s' % path
+        if packet.protocol == 0:
+            continue
+        result = reader.send( dev.decode( packet, decoders ) )
+        if result is not None:
+            return TRANSFERS[data_packet_id], result
+
+def session_tasks (paths, columnar = True):
+    # ( capture position, task, splitter ) of every transfer of every capture
+    for position, path in enumerate(paths):
+        splitter = CaptureSplitter( path, columnar )
+        for task in splitter.tasks():
+            yield position, task, splitter
+
+def _decode_positioned (item):
+    position, task = item
+    return position, _decode( task )
+
+class BatchDecoder:
+
+    def __init__ (self, processes = None, columnar = True, chunksize = 1):
+        # with processes = 0 everything is decoded in this process
+        self.processes = processes
+        self.columnar = columnar
+        self.chunksize = chunksize
+
+    def sessions (self, paths):
+        # an Obj per capture with transfers, in the order of paths: the
+        # device id, product and protocols, and a list per transfer kind
+        # ( runs, laps, track_log, ... ) joining the transfers of that kind
+        paths = list(paths)
+        splitters = {}
+        tasks = []
+        for position, task, splitter in session_tasks( paths, self.columnar ):
+            splitters[position] = splitter
+            tasks.append( ( position, task ) )
+
+        pool = None
+        if self.processes == 0:
+            results = itertools.imap( _decode_positioned, tasks )
+        else:
+            # the tasks are split up front: the pool hands them out from its
+            # task handler thread, which terminate() joins, a generator
+            # there could keep it from ever ending when the caller stops
+            # early
+            pool = multiprocessing.Pool( self.processes )
+            results = pool.imap( _decode_positioned, tasks, self.chunksize )
+        try:
+            current = None
+            for position, (kind, records) in results:
+                if current is not None and current.position != position:
+                    yield self.finish( current, splitters.pop( current.position ) )
+                    current = None
+                if current is None:
+                    current = self.session( paths[position], position )
+                current[kind].extend( records )
+            if current is not None:
+                yield self.finish( current, splitters.pop( current.position ) )
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def session (self, path, position):
+        session = Obj( path = path, position = position )
+        for kind in TRANSFERS.values():
+            session[kind] = []
+        return session
+
+    def finish (self, session, splitter):
+        session.device_id = splitter.device_id
+        session.product = splitter.product
+        session.protocols = splitter.protocols
+        log.info('Decoded %s: %d runs, %d laps, %d track segments'
+            , session.path, len(session.runs), len(session.laps), len(session.track_log) )
+        return session
+
+    def ingest (self, paths, store):
+        # decodes the captures into an ActivityStore, returns the rows added
+        added = 0
+        for session in self.sessions( paths ):
+            if session.device_id is None:
+                log.warn('No session start in %s, skipped', session.path )
+                continue
+            added += store.ingest_sync( session.device_id, session )
+            added += store.ingest_courses( session.device_id, session.courses, session.course_tracks )
+        return added
@@ -0,0 +1,92 @@
+import os, stat, errno, hashlib, threading, logging
+import cPickle as pickle
+from garmin.utils import write_atomically
+
+log = logging.getLogger('garmin.capabilities')
+
+# On disk cache of what a device model reports in GetDeviceDescription.
+# Entries are keyed by ( product id, software version ) and hold the parsed
+# protocols with the decoder plan built for them. The digest of the raw
+# protocol array is checked on every hit, so a unit reporting a different
+# protocol array under the same version is parsed and planned again.
+#
+# The cache is a pickle, loading it runs whatever it holds: a file owned by
+# another user or writable by others is ignored.
+
+VERSION = 2
+
+class CapabilityCache:
+
+    # sessions running on several threads can share one cache
+
+    def __init__ (self, path):
+        self.path = path
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def load (self):
+        if self.entries is not None:
+            return self.entries
+        self.entries = {}
+        try:
+            f = open( self.path, 'rb' )
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                log.warn('Cannot read capability cache %s: %s', self.path, ex )
+            return self.entries
+        try:
+            if not trusted( os.fstat( f.fileno() ) ):
+                log.warn('Ignoring capability cache %s, it is not owned by this user or writable by others', self.path )
+                return self.entries
+            data = f.read()
+        finally:
+            f.close()
+        try:
+            version, entries = pickle.loads( data )
+        except Exception, ex:
+            log.warn('Ignoring corrupt capability cache %s: %s', self.path, ex )
+            return self.entries
+        if version == VERSION:
+            self.entries = entries
+        return self.entries
+
+    def get (self, product_id, software_version, digest):
+        self.lock.acquire()
+        try:
+            entry = self.load().get( (product_id, software_version), None )
+        finally:
+            self.lock.release()
+        if entry is None:
+            return None
+        if entry['digest'] != digest:
+            log.info('Capabilities of product %d version %d changed', product_id, software_version )
+            return None
+        return entry
+
+    def put (self, product_id, software_version, digest, protocols, plan):
+        self.lock.acquire()
+        try:
+            self.load()[ (product_id, software_version) ] = dict( digest = digest, protocols = protocols, plan = plan )
+            log.info('Caching the capabilities of product %d version %d in %s', product_id, software_version, self.path )
+            self.save()
+        finally:
+            self.lock.release()
+
+    def save (self):
+        # a cache that cannot be written only costs the next session a parse
+        try:
+            write_atomically( self.path, pickle.dumps( (VERSION, self.entries), pickle.HIGHEST_PROTOCOL ) )
+        except (IOError, OSError), ex:
+            log.warn('Cannot write capability cache %s: %s', self.path, ex )
+
+def trusted (st):
+    return st.st_uid == os.getuid() and not st.st_mode & ( stat.S_IWGRP | stat.S_IWOTH )
+
+def fingerprint (decoders):
+    # computed once per decoder table, when the device class is defined
+    return hashlib.sha1( repr(sorted(decoders.items())) ).hexdigest()
+
+def digest (raw, decoders_fingerprint):
+    # the decoder table is part of the digest, a plan cached by another
+    # version of the decoders is not reused
+    return hashlib.sha1( decoders_fingerprint + raw ).hexdigest()
@@ -0,0 +1,211 @@
+import struct, array, mmap, logging
+from garmin.usbio import Transport, USBException
+from garmin.transports import TransportException
+
+log = logging.getLogger('garmin.capture')
+
+# Capture file layout:
+#   MAGIC
+#   records: RECORD header ( kind, length ) followed by the raw bytes
+#   index:   an INDEX record holding one INDEX_ENTRY ( kind, offset,
+#            length ) per record
+#   TRAILER  ( record count, index offset, INDEX_MAGIC )
+# A capture that was not closed has no index, it is rebuilt by scanning.
+
+MAGIC       = 'GRMNCAP1'
+INDEX_MAGIC = 'GRMNIDX1'
+RECORD      = struct.Struct('<B L')
+INDEX_ENTRY = struct.Struct('<B L L')
+TRAILER     = struct.Struct('<L L 8s')
+
+WRITE       = 0
+INTERRUPT   = 1
+BULK        = 2
+INDEX       = 3
+
+class CaptureException (Exception): pass
+
+class CaptureWriter:
+
+    def __init__ (self, path):
+        self.file = open( path, 'wb' )
+        self.file.write( MAGIC )
+        self.offset = len(MAGIC)
+        self.index = []
+
+    def write (self, kind, data):
+        if not isinstance(data, str):
+            data = array.array('B', data).tostring()
+        self.file.write( RECORD.pack( kind, len(data) ) )
+        self.file.write( data )
+        self.index.append( (kind, self.offset + RECORD.size, len(data)) )
+        self.offset += RECORD.size + len(data)
+
+    def close (self):
+        if self.file is None:
+            return
+        index = ''.join( [ INDEX_ENTRY.pack( *entry ) for entry in self.index ] )
+        self.file.write( RECORD.pack( INDEX, len(index) ) )
+        self.file.write( index )
+        self.file.write( TRAILER.pack( len(self.index), self.offset + RECORD.size, INDEX_MAGIC ) )
+        self.file.close()
+        self.file = None
+
+class CaptureReader:
+
+    def __init__ (self, path):
+        self.file = open( path, 'rb' )
+        self.data = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise CaptureException, 'Not a packet capture: %s' % path
+        self.index = self.read_index()
+
+    def read_index (self):
+        size = len(self.data)
+        if size >= len(MAGIC) + TRAILER.size:
+            count, index_offset, magic = TRAILER.unpack_from( self.data, size - TRAILER.size )
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.size == size - TRAILER.size:
+                return [ INDEX_ENTRY.unpack_from( self.data, index_offset + i * INDEX_ENTRY.size ) for i in xrange(count) ]
+        log.warn('Capture has no index, scanning records')
+        return self.scan()
+
+    def scan (self):
+        index = []
+        offset = len(MAGIC)
+        while offset + RECORD.size <= len(self.data):
+            kind, length = RECORD.unpack_from( self.data, offset )
+            offset += RECORD.size
+            if kind not in ( WRITE, INTERRUPT, BULK ) or offset + length > len(self.data):
+                break
+            index.append( (kind, offset, length) )
+            offset += length
+        return index
+
+    def record (self, i):
+        kind, offset, length = self.index[i]
+        return kind, self.data[offset:offset+length]
+
+    def records (self):
+        for i in xrange(len(self.index)):
+            yield self.record(i)
+
+    def __len__ (self):
+        return len(self.index)
+
+    def close (self):
+        self.data.close()
+        self.file.close()
+
+class RecordingTransport (Transport):
+    # forwards to another transport and captures every transfer
+
+    def __init__ (self, transport, path):
+        self.transport = transport
+        self.path = path
+        self.writer = None
+
+    @staticmethod
+    def from_options (options):
+        # there is no transport to wrap yet, callers wrap the one they opened
+        raise TransportException, 'The record transport wraps another one, use --record FILE'
+
+    def is_open (self):
+        return self.transport.is_open()
+
+    def open (self):
+        self.transport.open()
+        if self.writer is None:
+            self.writer = CaptureWriter( self.path )
+
+    def close (self):
+        self.transport.close()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def read_interrupt (self, size, timeout):
+        data = self.transport.read_interrupt( size, timeout )
+        self.writer.write( INTERRUPT, data )
+        return data
+
+    def read_bulk (self, size, timeout):
+        data = self.transport.read_bulk( size, timeout )
+        self.writer.write( BULK, data )
+        return data
+
+    def write_bulk (self, data, timeout):
+        self.writer.write( WRITE, data )
+        return self.transport.write_bulk( data, timeout )
+
+class ReplayTransport (Transport):
+    # serves the reads of a capture, the responses are looked up by the
+    # bytes of the command written. A command sent more than once gets its
+    # recorded responses in order, then the last one again.
+
+    def __init__ (self, path):
+        self.path = path
+        self.capture = None
+        self.responses = None
+        self.pending = []
+        self.position = 0
+
+    @staticmethod
+    def from_options (options):
+        if not options.replay:
+            raise TransportException, 'The replay transport needs a capture, use --replay FILE'
+        return ReplayTransport( options.replay )
+
+    def is_open (self):
+        return self.capture is not None
+
+    def open (self):
+        if self.is_open():
+            return
+        self.capture = CaptureReader( self.path )
+        self.responses = {}
+        current = []
+        command = None
+        for i, (kind, offset, length) in enumerate(self.capture.index):
+            if kind == WRITE:
+                self.responses.setdefault( command, [] ).append( current )
+                command = self.capture.record(i)[1]
+                current = []
+            else:
+                current.append( i )
+        self.responses.setdefault( command, [] ).append( current )
+        self.serve( self.responses.pop( None )[0] )
+
+    def serve (self, reads):
+        self.pending = reads
+        self.position = 0
+
+    def close (self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        self.responses = None
+        self.serve( [] )
+
+    def read (self):
+        if self.position >= len(self.pending):
+            raise USBException, 'Replay timeout: no more recorded responses'
+        self.position += 1
+        return self.capture.record( self.pending[self.position - 1] )[1]
+
+    def read_interrupt (self, size, timeout):
+        return self.read()
+
+    def read_bulk (self, size, timeout):
+        return self.read()
+
+    def write_bulk (self, data, timeout):
+        if not isinstance(data, str):
+            data = array.array('B', data).tostring()
+        groups = self.responses.get( data, None )
+        if not groups:
+            raise USBException, 'No recorded response for command %r' % data
+        if len(groups) > 1:
+            self.serve( groups.pop(0) )
+        else:
+            self.serve( groups[0] )
+        return len(data)
@@ -0,0 +1,124 @@
+import array, logging
+from garmin.layout import from_time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger('garmin.columnar')
+
+# seconds between the unix epoch and the garmin epoch
+GARMIN_EPOCH_OFFSET = 631065600
+
+# a latitude or longitude without a fix
+INVALID_POSITION = 0x7FFFFFFF
+
+class TrackColumns:
+    # column name, array typecode
+    # positions are in semicircles, time in seconds since GARMIN_EPOCH
+    COLUMNS = [
+        ( 'latitude',       'i' )
+        , ( 'longitude',    'i' )
+        , ( 'time',         'I' )
+        , ( 'altitude',     'f' )
+        , ( 'distance',     'f' )
+        , ( 'heart_rate',   'B' )
+        , ( 'cadence',      'B' )
+        , ( 'sensor',       'B' )
+    ]
+
+    def __init__ (self):
+        self.latitude = array.array('i')
+        self.longitude = array.array('i')
+        self.time = array.array('I')
+        self.altitude = array.array('f')
+        self.distance = array.array('f')
+        self.heart_rate = array.array('B')
+        self.cadence = array.array('B')
+        self.sensor = array.array('B')
+
+    def append (self, values):
+        # values as unpacked by the D304 layout
+        latitude, longitude, time, altitude, distance, heart_rate, cadence, sensor = values
+        self.latitude.append( latitude )
+        self.longitude.append( longitude )
+        self.time.append( time )
+        self.altitude.append( altitude )
+        self.distance.append( distance )
+        self.heart_rate.append( heart_rate )
+        self.cadence.append( cadence )
+        self.sensor.append( sensor )
+
+    def append_point (self, point):
+        # a decoded TrackPoint record
+        latitude, longitude = point.position
+        self.append( ( latitude, longitude, from_time(point.time), point.altitude, point.distance
+            , point.heart_rate, point.cadence, point.sensor ) )
+
+    @staticmethod
+    def from_points (points):
+        if isinstance(points, TrackColumns):
+            return points
+        columns = TrackColumns()
+        for point in points:
+            columns.append_point( point )
+        return columns
+
+    def tostring (self):
+        # the columns one after the other, in machine byte order
+        return ''.join( [ getattr(self, name).tostring() for name, typecode in self.COLUMNS ] )
+
+    @staticmethod
+    def fromstring (data):
+        columns = TrackColumns()
+        point_size = sum( [ getattr(columns, name).itemsize for name, typecode in TrackColumns.COLUMNS ] )
+        count = len(data) // point_size
+        offset = 0
+        for name, typecode in TrackColumns.COLUMNS:
+            values = getattr(columns, name)
+            size = count * values.itemsize
+            values.fromstring( data[offset:offset+size] )
+            offset += size
+        return columns
+
+    def slice (self, start, end):
+        columns = TrackColumns()
+        for name, typecode in self.COLUMNS:
+            setattr( columns, name, getattr(self, name)[start:end] )
+        return columns
+
+    def bounds (self):
+        # ( min latitude, max latitude, min longitude, max longitude ) of
+        # the points with a fix, None without any
+        valid = [ i for i in xrange(len(self)) if self.latitude[i] != INVALID_POSITION ]
+        if not valid:
+            return None
+        latitudes = [ self.latitude[i] for i in valid ]
+        longitudes = [ self.longitude[i] for i in valid ]
+        return min(latitudes), max(latitudes), min(longitudes), max(longitudes)
+
+    def columns (self):
+        return [ (name, getattr(self, name)) for name, typecode in self.COLUMNS ]
+
+    def column (self, name):
+        values = getattr(self, name)
+        if numpy is None:
+            return values
+        return numpy.frombuffer( values, dtype = values.typecode )
+
+    def numpy (self):
+        if numpy is None:
+            raise ImportError, 'numpy is required for numpy views'
+        return dict( (name, self.column(name)) for name, typecode in self.COLUMNS )
+
+    def epoch_seconds (self):
+        if numpy is not None:
+            return self.column('time').astype(numpy.int64) + GARMIN_EPOCH_OFFSET
+        return array.array('L', [ t + GARMIN_EPOCH_OFFSET for t in self.time ])
+
+    def __len__ (self):
+        return len(self.time)
+
+    def __repr__ (self):
+        return '<TrackColumns %d points>' % len(self)
@@ -2,6 +2,9 @@ import array, logging
 from garmin.protocol    import *
 from garmin.command     import *
 from garmin.utils       import *
+from garmin.columnar    import TrackColumns
+from garmin.resume      import ResumableTransfer
+from garmin             import capabilities
 
 log = logging.getLogger('garmin.device')
 
@@ -9,8 +12,14 @@ class Forerunner (USBPacketDevice):
     VENDOR_ID =  0x091E
     PRODUCT_ID = 0x0003
 
-    def __init__ (self):
-        USBPacketDevice.__init__(self, Forerunner.VENDOR_ID, Forerunner.PRODUCT_ID )
+    # with a CapabilityCache, known models skip parsing the protocol array
+    # and planning the decoders
+    capability_cache = None
+    # with retries, record transfers resume after a failed read
+    retries = 0
+
+    def __init__ (self, transport = None):
+        USBPacketDevice.__init__(self, Forerunner.VENDOR_ID, Forerunner.PRODUCT_ID, transport )
         self.product = None
         self.protocols = None
 
@@ -21,9 +30,18 @@ class Forerunner (USBPacketDevice):
         self.send_command( StartSession )
         self.device_id = self.get_single_record(Packet.SESSION_STARTED)
 
+    def set_capability_cache (self, cache):
+        self.capability_cache = cache
+
+    def set_retries (self, retries = ResumableTransfer.RETRIES):
+        self.retries = retries
+
     def get_device_capabilities (self):
         self.send_command( GetDeviceDescription )
-        return self.execute_reader( self.device_capabilities_reader() )
+        overrides = None
+        if self.capability_cache is not None:
+            overrides = { Packet.PROTOCOL_ARRAY : 'protocol_array_raw' }
+        return self.execute_reader( self.device_capabilities_reader(), overrides )
 
     def turn_off (self):
         self.send_command( PowerOff )
@@ -37,53 +55,77 @@ class Forerunner (USBPacketDevice):
         return self.get_single_record(Packet.DATE_TIME)
 
     def get_almanac (self):
-        self.send_command( TransferAlmanac )
-        return self.get_records(Packet.ALMANAC_DATA)
+        return self.transfer_records( TransferAlmanac, Packet.ALMANAC_DATA )
 
     def get_workouts (self):
-        self.send_command( TransferWorkouts )
-        workouts = self.get_records(Packet.WORKOUT)
+        workouts = self.transfer_records( TransferWorkouts, Packet.WORKOUT )
         workout_occurences = self.get_workout_occurences()
         return workouts, workout_occurences
 
     def get_workout_occurences (self):
-        self.send_command( TransferWorkoutOccurrences )
-        return self.get_records(Packet.WORKOUT_OCCURRENCE)
+        return self.transfer_records( TransferWorkoutOccurrences, Packet.WORKOUT_OCCURRENCE )
 
     def get_course_limits (self):
         self.send_command( TransferCourseLimits )
         return self.get_single_record(Packet.COURSE_LIMITS)
 
     def get_courses (self):
-        self.send_command( TransferCourses )
-        return self.get_records(Packet.COURSE)
+        return self.transfer_records( TransferCourses, Packet.COURSE )
 
     def get_course_points (self):
-        self.send_command( TransferCoursePoints )
-        return self.get_records(Packet.COURSE_POINT)
+        return self.transfer_records( TransferCoursePoints, Packet.COURSE_POINT )
 
     def get_course_laps (self):
-        self.send_command( TransferCourseLaps )
-        return self.get_records(Packet.COURSE_LAP)
+        return self.transfer_records( TransferCourseLaps, Packet.COURSE_LAP )
 
-    def get_course_tracks (self):
-        self.send_command( TransferCourseTracks )
-        return self.execute_reader( self.course_track_reader() )
+    def get_course_tracks (self, columnar = False):
+        data_type = self.track_data_type(columnar)
+        return self.execute_transfer( TransferCourseTracks, lambda: self.course_track_reader( data_type )
+            , ( Packet.COURSE_TRACK_HEADER, Packet.COURSE_TRACK_DATA ), self.track_overrides(Packet.COURSE_TRACK_DATA, columnar) )
 
     def get_runs (self):
-        self.send_command( TransferRuns )
-        runs = self.get_records( Packet.RUN )
+        runs = self.transfer_records( TransferRuns, Packet.RUN )
         laps = self.get_laps()
         track_log = self.get_track_log()
         return runs, laps, track_log
 
     def get_laps (self):
+        return self.transfer_records( TransferLaps, Packet.LAP )
+
+    def get_track_log (self, columnar = False):
+        data_type = self.track_data_type(columnar)
+        return self.execute_transfer( TransferTrackLog, lambda: self.serial_array_reader(Packet.TRACK_HEADER, Packet.TRACK_DATA, data_type )
+            , ( Packet.TRACK_HEADER, Packet.TRACK_DATA ), self.track_overrides(Packet.TRACK_DATA, columnar) )
+
+    def iter_runs (self):
+        self.send_command( TransferRuns )
+        return self.iter_records( Packet.RUN )
+
+    def iter_laps (self):
         self.send_command( TransferLaps )
-        return self.get_records( Packet.LAP )
+        return self.iter_records( Packet.LAP )
 
-    def get_track_log (self):
+    def iter_track_log (self, columnar = False):
         self.send_command( TransferTrackLog )
-        return self.execute_reader( self.serial_array_reader(Packet.TRACK_HEADER, Packet.TRACK_DATA) )
+        data_type = self.track_data_type(columnar)
+        reader = lambda emit: self.serial_array_reader(Packet.TRACK_HEADER, Packet.TRACK_DATA, data_type, emit)
+        return self.stream_reader( reader, self.track_overrides(Packet.TRACK_DATA, columnar) )
+
+    def iter_course_tracks (self, columnar = False):
+        self.send_command( TransferCourseTracks )
+        data_type = self.track_data_type(columnar)
+        reader = lambda emit: self.course_track_reader(data_type, emit)
+        return self.stream_reader( reader, self.track_overrides(Packet.COURSE_TRACK_DATA, columnar) )
+
+    def track_data_type (self, columnar):
+        if columnar:
+            return TrackColumns
+        return list
+
+    def track_overrides (self, data_packet_id, columnar):
+        if columnar:
+            return { data_packet_id : 'track_data_raw' }
+        return None
 
     def get_single_record (self, expected_packet_id):
         packet_id, response = self.read_response()
@@ -91,8 +133,20 @@ class Forerunner (USBPacketDevice):
             raise UnexpectedPacketException(packet_id)
         return response
 
-    def get_records (self, expected_packet_id):
-        return self.execute_reader( self.record_reader( expected_packet_id ) )
+    def transfer_records (self, command, expected_packet_id, decoders = None):
+        return self.execute_transfer( command, lambda: self.record_reader( expected_packet_id ), ( expected_packet_id, ), decoders = decoders )
+
+    # sends command and runs the reader make_reader() returns, resumed after
+    # a failure when retries are set. expected are the packet ids the reader
+    # accepts between RECORDS and TRANSFER_COMPLETE.
+    def execute_transfer (self, command, make_reader, expected, overrides = None, decoders = None):
+        if self.retries > 0:
+            return ResumableTransfer( self, command, make_reader, expected, overrides, decoders, self.retries ).run()
+        self.send_command( command )
+        return self.execute_reader( make_reader(), overrides, decoders )
+
+    def iter_records (self, expected_packet_id):
+        return self.stream_reader( lambda emit: self.record_reader( expected_packet_id, emit ) )
 
     def device_capabilities_reader (self):
         packet_id, product_info = yield
@@ -109,12 +163,34 @@ class Forerunner (USBPacketDevice):
 
         if packet_id!= Packet.PROTOCOL_ARRAY:
             raise UnexpectedPacketException(packet_id)
-        self.protocols = data
+        if self.capability_cache is None:
+            self.protocols = data
+            self.plan_dispatch( data )
+        else:
+            self.load_capabilities( data )
 
         yield True
 
-    def record_reader (self, expected_packet_id ):
+    def load_capabilities (self, raw):
+        product = self.product_info
+        digest = capabilities.digest( raw, self.DECODERS_FINGERPRINT )
+        entry = self.capability_cache.get( product.product_id, product.software_version, digest )
+        if entry is not None:
+            log.debug('Using cached capabilities of product %d', product.product_id )
+            self.protocols = entry['protocols']
+            self.plan_dispatch( self.protocols, entry['plan'] )
+            return
+        self.protocols = self.d_protocol_array( StructReader(raw, endianness='<'), None )
+        self.plan_dispatch( self.protocols )
+        self.capability_cache.put( product.product_id, product.software_version, digest, self.protocols, self.plan )
+
+    # readers hand each record to emit as soon as it is complete, without
+    # emit they collect the records and yield the whole list at the end.
+    # A record decoded as None was skipped by its decoder and is dropped.
+    def record_reader (self, expected_packet_id, emit = None ):
         records = []
+        if emit is None:
+            emit = records.append
         packet_id, record_count = yield
         if packet_id != Packet.RECORDS:
             raise UnexpectedPacketException(packet_id)
@@ -123,7 +199,8 @@ class Forerunner (USBPacketDevice):
             packet_id, record = yield
             if packet_id != expected_packet_id:
                 raise UnexpectedPacketException(packet_id)
-            records.append( record )
+            if record is not None:
+                emit( record )
 
         packet_id, ignored_value = yield
         if packet_id != Packet.TRANSFER_COMPLETE:
@@ -131,23 +208,28 @@ class Forerunner (USBPacketDevice):
 
         yield records
 
-    def serial_array_reader (self, header_packet_id, data_packet_id):
+    def serial_array_reader (self, header_packet_id, data_packet_id, data_type = list, emit = None):
         records = []
+        if emit is None:
+            emit = records.append
         packet_id, record_count = yield
         if packet_id != Packet.RECORDS:
             raise UnexpectedPacketException(packet_id)
 
-        last_array = Obj( header = None, data = [] )
+        last_array = Obj( header = None, data = data_type() )
         for i in xrange(record_count ):
             packet_id, data = yield
             if packet_id == header_packet_id:
                 if last_array.header is not None:
-                    records.append( last_array )
-                last_array = Obj( header = data, data = [] )
+                    emit( last_array )
+                last_array = Obj( header = data, data = data_type() )
             elif packet_id == data_packet_id:
-                last_array.data.append( data )
+                if data is not None:
+                    last_array.data.append( data )
             else:
                 raise UnexpectedPacketException(packet_id)
+        if last_array.header is not None:
+            emit( last_array )
 
         packet_id, ignored_value = yield
         if packet_id != Packet.TRANSFER_COMPLETE:
@@ -155,8 +237,6 @@ class Forerunner (USBPacketDevice):
 
         yield records
 
-    def course_track_reader ( self ):
-        if self.get_protocols().has_datatype('course.track.header'):
-            raise NotImplementd, 'course track is not implemeted'
-        return self.serial_array_reader(Packet.COURSE_TRACK_HEADER,Packet.COURSE_TRACK_DATA)
+    def course_track_reader ( self, data_type = list, emit = None ):
+        return self.serial_array_reader(Packet.COURSE_TRACK_HEADER,Packet.COURSE_TRACK_DATA, data_type, emit)
 
@@ -0,0 +1,246 @@
+import os, time, itertools, multiprocessing, logging
+from xml.sax.saxutils import escape
+from garmin.columnar import TrackColumns, GARMIN_EPOCH_OFFSET, INVALID_POSITION
+from garmin.store    import ActivityStore, to_seconds
+
+log = logging.getLogger('garmin.export')
+
+# GPX and TCX written as the records arrive: the XML is produced with plain
+# writes, points are formatted one at a time and never collected, so memory
+# stays flat whatever the size of the track.
+
+SEMICIRCLE = 180.0 / 2 ** 31
+
+# floats at or above this value mean the device had no measure
+INVALID_FLOAT = 1e24
+
+SPORTS = { 0: 'Running', 1: 'Biking' }
+
+TRIGGER_METHODS = { 0: 'Manual', 1: 'Distance', 2: 'Location', 3: 'Time', 4: 'HeartRate' }
+
+def degrees (semicircles):
+    return semicircles * SEMICIRCLE
+
+def iso_time (seconds):
+    # garmin epoch seconds
+    return time.strftime( '%Y-%m-%dT%H:%M:%SZ', time.gmtime( seconds + GARMIN_EPOCH_OFFSET ) )
+
+def point_rows (points):
+    # ( latitude, longitude, time, altitude, distance, heart_rate, cadence )
+    # for TrackColumns or a list of decoded TrackPoint records
+    if isinstance(points, TrackColumns):
+        return itertools.izip( points.latitude, points.longitude, points.time, points.altitude
+            , points.distance, points.heart_rate, points.cadence )
+    return ( ( point.position[0], point.position[1], to_seconds(point.time), point.altitude
+        , point.distance, point.heart_rate, point.cadence ) for point in points )
+
+def segment_rows (segments):
+    for segment in segments:
+        for row in point_rows( segment.data ):
+            yield row
+
+class GPXWriter:
+
+    def __init__ (self, out, creator = 'garmin'):
+        self.out = out
+        self.creator = creator
+
+    def begin (self, name = None):
+        self.out.write( '<?xml version="1.0" encoding="UTF-8"?>\n' )
+        self.out.write( '<gpx version="1.1" creator="%s" xmlns="http://www.topografix.com/GPX/1/1">\n' % escape(self.creator) )
+        self.out.write( '<trk>\n' )
+        if name is not None:
+            self.out.write( '<name>%s</name>\n' % escape(name) )
+
+    def segment (self, points):
+        write = self.out.write
+        write( '<trkseg>\n' )
+        for latitude, longitude, seconds, altitude, distance, heart_rate, cadence in point_rows( points ):
+            if latitude == INVALID_POSITION:
+                continue
+            write( '<trkpt lat="%.7f" lon="%.7f">' % ( degrees(latitude), degrees(longitude) ) )
+            if altitude < INVALID_FLOAT:
+                write( '<ele>%.2f</ele>' % altitude )
+            write( '<time>%s</time></trkpt>\n' % iso_time(seconds) )
+        write( '</trkseg>\n' )
+
+    def end (self):
+        self.out.write( '</trk>\n</gpx>\n' )
+
+def write_gpx (out, segments, name = None):
+    # segments as produced by the track readers or the store
+    writer = GPXWriter( out )
+    writer.begin( name )
+    for segment in segments:
+        writer.segment( segment.data )
+    writer.end()
+
+class Lookahead:
+    # an iterator that can give back the item it just returned
+
+    def __init__ (self, iterable):
+        self.iterator = iter(iterable)
+        self.pending = []
+
+    def next (self):
+        if self.pending:
+            return self.pending.pop()
+        return self.iterator.next()
+
+    def push (self, item):
+        self.pending.append( item )
+
+    def __iter__ (self):
+        return self
+
+class TCXWriter:
+
+    def __init__ (self, out):
+        self.out = out
+
+    def begin (self):
+        self.out.write( '<?xml version="1.0" encoding="UTF-8"?>\n' )
+        self.out.write( '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n' )
+        self.out.write( '<Activities>\n' )
+
+    def activity (self, sport, laps, points):
+        # laps in time order, points a Lookahead over the point rows in time
+        # order, the points before the first lap are dropped and the points
+        # after the last lap are left for the next activity
+        laps = list(laps)
+        if not laps:
+            return
+        write = self.out.write
+        write( '<Activity Sport="%s">\n' % SPORTS.get( sport, 'Other' ) )
+        write( '<Id>%s</Id>\n' % iso_time( to_seconds(laps[0].start_time) ) )
+        for i, lap in enumerate(laps):
+            start = to_seconds( lap.start_time )
+            if i + 1 < len(laps):
+                end = to_seconds( laps[i + 1].start_time )
+            else:
+                end = start + ( lap.duration + 99 ) // 100 + 1
+            self.lap( lap, start, end, points )
+        write( '</Activity>\n' )
+
+    def lap (self, lap, start, end, points):
+        write = self.out.write
+        write( '<Lap StartTime="%s">\n' % iso_time(start) )
+        write( '<TotalTimeSeconds>%.2f</TotalTimeSeconds>\n' % ( lap.duration / 100.0 ) )
+        write( '<DistanceMeters>%.2f</DistanceMeters>\n' % lap.distance )
+        write( '<MaximumSpeed>%.3f</MaximumSpeed>\n' % lap.max_speed )
+        write( '<Calories>%d</Calories>\n' % lap.calories )
+        if lap.average_heart_rate:
+            write( '<AverageHeartRateBpm><Value>%d</Value></AverageHeartRateBpm>\n' % lap.average_heart_rate )
+        if lap.maximum_heart_rate:
+            write( '<MaximumHeartRateBpm><Value>%d</Value></MaximumHeartRateBpm>\n' % lap.maximum_heart_rate )
+        write( '<Intensity>%s</Intensity>\n' % ( lap.intensity and 'Resting' or 'Active' ) )
+        if lap.average_cadence != 0xFF:
+            write( '<Cadence>%d</Cadence>\n' % lap.average_cadence )
+        write( '<TriggerMethod>%s</TriggerMethod>\n' % TRIGGER_METHODS.get( lap.trigger_method, 'Manual' ) )
+        write( '<Track>\n' )
+        for row in points:
+            if row[2] >= end:
+                points.push( row )
+                break
+            if row[2] >= start:
+                self.point( row )
+        write( '</Track>\n</Lap>\n' )
+
+    def point (self, row):
+        latitude, longitude, seconds, altitude, distance, heart_rate, cadence = row
+        write = self.out.write
+        write( '<Trackpoint><Time>%s</Time>' % iso_time(seconds) )
+        if latitude != INVALID_POSITION:
+            write( '<Position><LatitudeDegrees>%.7f</LatitudeDegrees><LongitudeDegrees>%.7f</LongitudeDegrees></Position>'
+                % ( degrees(latitude), degrees(longitude) ) )
+        if altitude < INVALID_FLOAT:
+            write( '<AltitudeMeters>%.2f</AltitudeMeters>' % altitude )
+        if distance < INVALID_FLOAT:
+            write( '<DistanceMeters>%.2f</DistanceMeters>' % distance )
+        if heart_rate:
+            write( '<HeartRateBpm><Value>%d</Value></HeartRateBpm>' % heart_rate )
+        if cadence != 0xFF:
+            write( '<Cadence>%d</Cadence>' % cadence )
+        write( '</Trackpoint>\n' )
+
+    def end (self):
+        self.out.write( '</Activities>\n</TrainingCenterDatabase>\n' )
+
+def write_tcx (out, runs, laps, segments):
+    # runs and laps as decoded from the device, segments as produced by the
+    # track readers, all in time order. Only the laps are held in memory.
+    laps = dict( [ ( lap.index, lap ) for lap in laps ] )
+    points = Lookahead( segment_rows(segments) )
+    writer = TCXWriter( out )
+    writer.begin()
+    for run in runs:
+        run_laps = [ laps[i] for i in xrange( run.first_lap_index, run.last_lap_index + 1 ) if i in laps ]
+        writer.activity( run.sport, run_laps, points )
+    writer.end()
+
+def export_track (store, track_id, path):
+    track = store.query( 'select kind, header from tracks where id = ?', ( track_id, ) )[0]
+    out = open( path, 'w' )
+    try:
+        writer = GPXWriter( out )
+        writer.begin( '%s %s' % ( track.kind, track.header ) )
+        writer.segment( store.points( track_id ) )
+        writer.end()
+    finally:
+        out.close()
+
+def export_run (store, run_id, path):
+    run = store.query( 'select * from runs where id = ?', ( run_id, ) )[0]
+    laps = store.run_laps( run )
+    devices = store.sources( 'run', run.hash )
+    def points ():
+        for track in store.tracks( run.start_time, run.end_time + 1, device = devices ):
+            for row in point_rows( store.points( track.id ) ):
+                yield row
+    out = open( path, 'w' )
+    try:
+        writer = TCXWriter( out )
+        writer.begin()
+        writer.activity( run.sport, laps, Lookahead( points() ) )
+        writer.end()
+    finally:
+        out.close()
+
+# bulk conversion of a store: every worker opens the store once and writes
+# whole files, only ids and paths cross the process boundary
+
+_store = None
+
+def _open_store (path):
+    global _store
+    _store = ActivityStore( path )
+
+def _export (job):
+    kind, identifier, path = job
+    if kind == 'gpx':
+        export_track( _store, identifier, path )
+    else:
+        export_run( _store, identifier, path )
+    return path
+
+def export_store (path, directory, processes = None, kinds = ( 'gpx', 'tcx' )):
+    # writes a GPX per track segment and a TCX per run, yields the paths as
+    # the files are done
+    store = ActivityStore( path )
+    jobs = []
+    if 'gpx' in kinds:
+        jobs.extend( [ ( 'gpx', track.id, os.path.join( directory, 'track-%d.gpx' % track.id ) ) for track in store.tracks() ] )
+    if 'tcx' in kinds:
+        jobs.extend( [ ( 'tcx', run.id, os.path.join( directory, 'run-%d.tcx' % run.id ) )
+            for run in store.runs() if run.start_time is not None ] )
+    store.close()
+    if not os.path.isdir( directory ):
+        os.makedirs( directory )
+    pool = multiprocessing.Pool( processes, _open_store, ( path, ) )
+    try:
+        for done in pool.imap_unordered( _export, jobs ):
+            yield done
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,372 @@
+import struct, datetime, logging
+from garmin.utils import GARMIN_EPOCH, ASCII_FILTER, Record, record_type
+
+log = logging.getLogger('garmin.layout')
+
+class LayoutException (Exception): pass
+
+def to_time (value):
+    return GARMIN_EPOCH + datetime.timedelta( seconds = value )
+
+def from_time (value):
+    delta = value - GARMIN_EPOCH
+    return delta.days * 86400 + delta.seconds
+
+def to_string (value):
+    return value.split('\0')[0].translate(ASCII_FILTER).strip()
+
+# A layout compiles the fields of a datatype into a single struct.Struct so a
+# record is decoded with one unpack_from call. Fields are ( name, format [,
+# converter] ) or ( name, layout [, count] ) for nested records, a field named
+# None is padding. The unpacked values are turned into a __slots__ record by a
+# builder function generated for the layout.
+#
+# Layouts without post processing also have a lazy record type: a view over
+# the packet payload that unpacks a field the first time it is read.
+class Layout:
+
+    def __init__ (self, name, fields, post = None, record = None, endianness = '<'):
+        self.name = name
+        self.fields = fields
+        self.post = post
+        self.endianness = endianness
+        self.format, self.plan, self.width = self.compile( fields )
+        self.struct = struct.Struct( endianness + self.format )
+        self.size = self.struct.size
+        self.record = record_type( record or name, [ entry[0] for entry in self.plan ], __name__ )
+        self.build = self.compile_builder()
+        self.lazy_record = None
+        if post is None:
+            self.lazy_record = self.compile_lazy_record()
+
+    def compile (self, fields):
+        formats = []
+        plan = []
+        total = 0
+        offset = 0
+        for field in fields:
+            name, format = field[0], field[1]
+            if isinstance(format, Layout):
+                count = len(field) > 2 and field[2] or None
+                formats.append( ' '.join( [format.format] * (count or 1) ) )
+                plan.append( (name, format, count, offset, format) )
+                total += format.width * (count or 1)
+                offset += format.size * (count or 1)
+                continue
+            converter = len(field) > 2 and field[2] or None
+            formats.append( format )
+            size = struct.calcsize( '<' + format )
+            width = len( struct.unpack( '<' + format, '\0' * size ) )
+            if name is None:
+                if width != 0:
+                    raise LayoutException, 'Padding field must not hold values: %s' % format
+            else:
+                plan.append( (name, width, converter, offset, format) )
+                total += width
+            offset += size
+        return ' '.join(formats), plan, total
+
+    def compile_builder (self):
+        namespace = { 'Record': self.record, 'post': self.post }
+        arguments = []
+        index = 0
+        for i, (name, width, extra, offset, format) in enumerate(self.plan):
+            if isinstance(width, Layout):
+                namespace['build%d' % i] = width.build
+                if extra is None:
+                    argument = 'build%d(v[%d:%d])' % ( i, index, index + width.width )
+                    index += width.width
+                else:
+                    end = index + width.width * extra
+                    argument = '[ build%d(v[j:j+%d]) for j in xrange(%d, %d, %d) ]' % ( i, width.width, index, end, width.width )
+                    index = end
+            else:
+                if width == 1:
+                    argument = 'v[%d]' % index
+                else:
+                    argument = 'v[%d:%d]' % ( index, index + width )
+                index += width
+                if extra is not None:
+                    namespace['convert%d' % i] = extra
+                    argument = 'convert%d(%s)' % ( i, argument )
+            arguments.append( argument )
+        expression = 'Record(%s)' % ', '.join(arguments)
+        if self.post is not None:
+            expression = 'post(%s)' % expression
+        exec 'def build (v):\n    return %s\n' % expression in namespace
+        return namespace['build']
+
+    def compile_lazy_record (self):
+        attributes = { '__module__': __name__, '_fields': self.record._fields, '_record': self.record }
+        for name, width, extra, offset, format in self.plan:
+            if isinstance(width, Layout):
+                attributes[name] = LazyLayoutField( name, width, extra, offset )
+            else:
+                compiled = struct.Struct( self.endianness + format )
+                attributes[name] = LazyField( name, compiled, width, extra, offset )
+        return type( 'Lazy' + self.record.__name__, (LazyRecord,), attributes )
+
+    def unpack (self, data, offset = 0):
+        return self.build( self.struct.unpack_from( data, offset ) )
+
+    def lazy (self, data, offset = 0):
+        if self.lazy_record is None:
+            return self.unpack( data, offset )
+        return self.lazy_record( data, offset )
+
+    def unpack_raw (self, data, offset = 0):
+        return self.struct.unpack_from( data, offset )
+
+    def peeker (self, name):
+        # returns peek(data, offset) reading the unconverted value of a
+        # single field, to look at a record without decoding it
+        for field, width, extra, field_offset, format in self.plan:
+            if field == name and not isinstance(width, Layout) and width == 1:
+                unpack_from = struct.Struct( self.endianness + format ).unpack_from
+                return lambda data, offset = 0: unpack_from( data, offset + field_offset )[0]
+        raise LayoutException, 'No scalar field %s in layout %s' % ( name, self.name )
+
+    def __repr__ (self):
+        return '<Layout %s: %s>' % ( self.name, self.format )
+
+class LazyRecord (Record):
+    # no __slots__: a decoded field is stored in the instance __dict__ where
+    # it shadows the LazyField, later reads are plain attribute lookups
+
+    def __init__ (self, data, offset):
+        self._data = data
+        self._offset = offset
+
+    def materialize (self):
+        return self._record( *self.values() )
+
+    def __reduce__ (self):
+        return self._record, tuple(self.values())
+
+class LazyField (object):
+
+    def __init__ (self, name, compiled, width, convert, offset):
+        self.name = name
+        self.unpack_from = compiled.unpack_from
+        self.width = width
+        self.convert = convert
+        self.offset = offset
+
+    def __get__ (self, record, owner):
+        if record is None:
+            return self
+        value = self.unpack_from( record._data, record._offset + self.offset )
+        if self.width == 1:
+            value = value[0]
+        if self.convert is not None:
+            value = self.convert(value)
+        record.__dict__[self.name] = value
+        return value
+
+class LazyLayoutField (object):
+
+    def __init__ (self, name, layout, count, offset):
+        self.name = name
+        self.layout = layout
+        self.count = count
+        self.offset = offset
+
+    def __get__ (self, record, owner):
+        if record is None:
+            return self
+        offset = record._offset + self.offset
+        if self.count is None:
+            value = self.layout.unpack( record._data, offset )
+        else:
+            value = [ self.layout.unpack( record._data, offset + i * self.layout.size ) for i in xrange(self.count) ]
+        record.__dict__[self.name] = value
+        return value
+
+POSITION = '2l'
+
+D304 = Layout( 'D304', record = 'TrackPoint', fields = [
+    ( 'position',           POSITION )
+    , ( 'time',             'L', to_time )
+    , ( 'altitude',         'f' )
+    , ( 'distance',         'f' )
+    , ( 'heart_rate',       'B' )
+    , ( 'cadence',          'B' )
+    , ( 'sensor',           'B' )
+])
+
+D501 = Layout( 'D501', record = 'AlmanacEntry', fields = [
+    ( 'week_number',        'H' )
+    , ( 'toc',              'f' )
+    , ( 'af0',              'f' )
+    , ( 'af1',              'f' )
+    , ( 'eccentricity',     'f' )
+    , ( 'sqrta',            'f' )
+    , ( 'm0',               'f' )
+    , ( 'w',                'f' )
+    , ( 'omg0',             'f' )
+    , ( 'odot',             'f' )
+    , ( 'inclination',      'f' )
+    , ( 'health',           'B' )
+])
+
+D1003 = Layout( 'D1003', record = 'WorkoutOccurrence', fields = [
+    ( 'workout_name',       '16s', to_string )
+    , ( 'day',              'L', to_time )
+])
+
+D1006 = Layout( 'D1006', record = 'Course', fields = [
+    ( 'index',              'H' )
+    , ( None,               '2x' )
+    , ( 'course_name',      '16s', to_string )
+])
+
+D1007 = Layout( 'D1007', record = 'CourseLap', fields = [
+    ( 'course_index',       'H' )
+    , ( 'lap_index',        'H' )
+    , ( 'total_time',       'L' )
+    , ( 'total_distance',   'f' )
+    , ( 'begin',            POSITION )
+    , ( 'end',              POSITION )
+    , ( 'average_heart_rate', 'B' )
+    , ( 'maximum_heart_rate', 'B' )
+    , ( 'intensity',        'B' )
+    , ( 'average_cadence',  'B' )
+])
+
+D1008_STEP = Layout( 'D1008.step', record = 'WorkoutStep', fields = [
+    ( 'custom_name',        '16s', to_string )
+    , ( 'target_custom_zone_low', 'f' )
+    , ( 'target_custom_zone_high', 'f' )
+    , ( 'duration_value',   'H' )
+    , ( 'intensity',        'B' )
+    , ( 'duration',         'B' )
+    , ( 'target',           'B' )
+    , ( 'target_value',     'B' )
+    , ( None,               '2x' )
+])
+
+D1008 = Layout( 'D1008', record = 'Workout', fields = [
+    ( 'valid_steps_count',  'L' )
+    , ( 'steps',            D1008_STEP, 20 )
+    , ( 'name',             '16s', to_string )
+    , ( 'sport',            'B' )
+], post = lambda r: ( r.name, r.sport, r.steps[:r.valid_steps_count] ) )
+
+QUICK_WORKOUT = Layout( 'quick_workout', record = 'QuickWorkout', fields = [
+    ( 'time',               'L' )
+    , ( 'distance',         'f' )
+])
+
+D1009 = Layout( 'D1009', record = 'Run', fields = [
+    ( 'track_index',        'H' )
+    , ( 'first_lap_index',  'H' )
+    , ( 'last_lap_index',   'H' )
+    , ( 'sport',            'B' )
+    , ( 'program',          'B' )
+    , ( 'multisport',       'B' )
+    , ( None,               '3x' )
+    , ( 'quick_wokrout',    QUICK_WORKOUT )
+    , ( 'workout',          D1008 )
+])
+
+# D1015 only appends undocumented bytes to D1011, unpack_from ignores them
+D1011 = Layout( 'D1011', record = 'Lap', fields = [
+    ( 'index',              'H' )
+    , ( None,               '2x' )
+    , ( 'start_time',       'L', to_time )
+    , ( 'duration',         'L' )
+    , ( 'distance',         'f' )
+    , ( 'max_speed',        'f' )
+    , ( 'begin',            POSITION )
+    , ( 'end',              POSITION )
+    , ( 'calories',         'H' )
+    , ( 'average_heart_rate', 'B' )
+    , ( 'maximum_heart_rate', 'B' )
+    , ( 'intensity',        'B' )
+    , ( 'average_cadence',  'B' )
+    , ( 'trigger_method',   'B' )
+])
+
+D1013 = Layout( 'D1013', record = 'CourseLimits', fields = [
+    ( 'max_courses',        'L' )
+    , ( 'max_course_laps',  'L' )
+    , ( 'max_course_points', 'L' )
+    , ( 'max_course_track_poins', 'L' )
+])
+
+HEART_RATE_ZONE = Layout( 'heart_rate_zone', record = 'HeartRateZone', fields = [
+    ( 'low',                'B' )
+    , ( 'high',             'B' )
+    , ( None,               '2x' )
+])
+
+SPEED_ZONE = Layout( 'speed_zone', record = 'SpeedZone', fields = [
+    ( 'low',                'f' )
+    , ( 'high',             'f' )
+    , ( 'name',             '16s', to_string )
+])
+
+ACTIVITY = Layout( 'activity', record = 'Activity', fields = [
+    ( 'heart_rate_zones',   HEART_RATE_ZONE, 5 )
+    , ( 'speed_zones',      SPEED_ZONE, 10 )
+    , ( 'gear_weight',      'f' )
+    , ( 'maximum_heart_rate', 'B' )
+    , ( None,               '3x' )
+])
+
+Activities = record_type( 'Activities', ( 'running', 'biking', 'other' ), __name__ )
+FitnessUserProfile = record_type( 'FitnessUserProfile', ( 'activities', 'weight', 'birthdate', 'gender' ), __name__ )
+
+def _fitness_profile (r):
+    activities = Activities( r.running, r.biking, r.other )
+    birthdate = datetime.date( r.birth_year, r.birth_month, r.birth_day )
+    return FitnessUserProfile( activities, r.weight, birthdate, r.gender )
+
+D1004 = Layout( 'D1004', record = 'RawFitnessProfile', fields = [
+    ( 'running',            ACTIVITY )
+    , ( 'biking',           ACTIVITY )
+    , ( 'other',            ACTIVITY )
+    , ( 'weight',           'f' )
+    , ( 'birth_year',       'H' )
+    , ( 'birth_month',      'B' )
+    , ( 'birth_day',        'B' )
+    , ( 'gender',           'B' )
+], post = _fitness_profile )
+
+# radians, the velocity is ( east, north, up ) in meters per second
+D800 = Layout( 'D800', record = 'PositionFix', fields = [
+    ( 'altitude',           'f' )
+    , ( 'epe',              'f' )
+    , ( 'eph',              'f' )
+    , ( 'epv',              'f' )
+    , ( 'fix',              'H' )
+    , ( 'time_of_week',     'd' )
+    , ( 'position',         '2d' )
+    , ( 'velocity',         '3f' )
+    , ( 'msl_height',       'f' )
+    , ( 'leap_seconds',     'h' )
+    , ( 'week_number_days', 'L' )
+])
+
+LAYOUTS = {
+    304:    D304
+    , 501:  D501
+    , 800:  D800
+    , 1003: D1003
+    , 1004: D1004
+    , 1006: D1006
+    , 1007: D1007
+    , 1008: D1008
+    , 1009: D1009
+    , 1011: D1011
+    , 1013: D1013
+    , 1015: D1011
+}
+
+# the record types are module attributes so that records can be pickled
+for _layout in LAYOUTS.values() + [ D1008_STEP, QUICK_WORKOUT, HEART_RATE_ZONE, SPEED_ZONE, ACTIVITY ]:
+    globals()[ _layout.record.__name__ ] = _layout.record
+del _layout
+
+def layout_for (datatype):
+    return LAYOUTS[datatype]
@@ -1,4 +1,9 @@
-import struct
+import struct, array
+from garmin.utils import StructReader, hexdump
+
+HEADER = struct.Struct('<B 3x H 2x L')
+
+class PacketException (Exception): pass
 
 class UnexpectedPacketException (Exception):
     def __init__(self, packet_id):
@@ -18,6 +23,7 @@ class Packet:
     DATE_TIME                   = 0x000E
     RECORDS                     = 0x001B
     ALMANAC_DATA                = 0x001F
+    PVT_DATA                    = 0x0033
     TRACK_DATA                  = 0x0022
     TRACK_HEADER                = 0x0063
     LAP                         = 0x0095
@@ -36,14 +42,27 @@ class Packet:
     COURSE_TRACK_DATA           = 0x0429
     COURSE_LIMITS               = 0x042A
 
-    def __init__ (self,data):
-        self.protocol, self.id, payload_length = struct.unpack_from('<B 3x H 2x L',data)
-        self.payload = data[12:]
-        if len(self.payload) != payload_length:
-            raise ProtocolException, 'Incorrect payload length'
+    # a packet is a view over a receive buffer, nothing is copied: the
+    # payload is a memoryview and readers unpack straight from the buffer
+    def __init__ (self, data, offset = 0, end = None):
+        if isinstance(data, array.array):
+            data = data.tostring()
+        self.protocol, self.id, payload_length = HEADER.unpack_from( data, offset )
+        self.data = data
+        self.offset = offset + HEADER.size
+        self.end = self.offset + payload_length
+        if self.end != (end is None and len(data) or end):
+            raise PacketException, 'Incorrect payload length'
+
+    @property
+    def payload (self):
+        return memoryview( self.data )[ self.offset:self.end ]
+
+    def reader (self, endianness = '<'):
+        return StructReader( self.data, endianness, self.offset, self.end )
 
     def __len__ (self):
-        return len(self.payload) + 12
+        return self.end - self.offset + HEADER.size
 
     def __str__ (self):
         if self.protocol == 0:
@@ -69,3 +88,34 @@ class Packet:
             message += payload
         return message
 
+class PacketStream:
+    # splits a byte stream into packets, a read may hold several packets and
+    # a packet may span several reads. The packets share the read buffer.
+
+    def __init__ (self):
+        self.data = ''
+        self.offset = 0
+
+    def feed (self, data):
+        if not isinstance(data, str):
+            data = array.array('B', data).tostring()
+        if self.offset == len(self.data):
+            self.data = data
+        else:
+            self.data = self.data[self.offset:] + data
+        self.offset = 0
+
+    def next_packet (self):
+        end = self.offset + HEADER.size
+        if end > len(self.data):
+            return None
+        protocol, packet_id, payload_length = HEADER.unpack_from( self.data, self.offset )
+        end += payload_length
+        if end > len(self.data):
+            return None
+        packet = Packet( self.data, self.offset, end )
+        self.offset = end
+        return packet
+
+    def pending (self):
+        return len(self.data) - self.offset
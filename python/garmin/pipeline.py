@@ -0,0 +1,63 @@
+import sys, threading, Queue, logging
+from garmin.packet import Packet
+
+log = logging.getLogger('garmin.pipeline')
+
+class PumpException (Exception): pass
+
+class PumpFailure:
+    def __init__ (self, info):
+        self.info = info
+
+class PacketPump (threading.Thread):
+    # Reads the packets of a transfer on its own thread into a bounded queue
+    # so the device keeps sending while the caller decodes. The pump ends
+    # after TRANSFER_COMPLETE; a read error is handed to the consumer.
+
+    POLL = 0.1
+
+    def __init__ (self, receive, size = 256):
+        threading.Thread.__init__( self, name = 'garmin-packet-pump' )
+        self.daemon = True
+        self.receive = receive
+        self.queue = Queue.Queue( size )
+        self.stopped = threading.Event()
+        self.finished = False
+
+    def run (self):
+        try:
+            while not self.stopped.is_set():
+                packet = self.receive()
+                self.put( packet )
+                if packet.id == Packet.TRANSFER_COMPLETE:
+                    break
+        except Exception:
+            self.put( PumpFailure( sys.exc_info() ) )
+
+    def put (self, item):
+        # blocks while the queue is full, unless the pump is stopped
+        while not self.stopped.is_set():
+            try:
+                self.queue.put( item, True, self.POLL )
+                return
+            except Queue.Full:
+                continue
+
+    def get (self):
+        while True:
+            try:
+                item = self.queue.get( True, self.POLL )
+                break
+            except Queue.Empty:
+                if not self.is_alive() and self.queue.empty():
+                    raise PumpException, 'Packet pump stopped'
+        if isinstance(item, PumpFailure):
+            self.finished = True
+            raise item.info[0], item.info[1], item.info[2]
+        if item.id == Packet.TRANSFER_COMPLETE:
+            self.finished = True
+        return item
+
+    def stop (self):
+        self.stopped.set()
+        self.join()
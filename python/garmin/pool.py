@@ -0,0 +1,212 @@
+import sys, time, threading, traceback, logging
+from garmin.usbio      import Transport, USBException, find_devices
+from garmin.device     import Forerunner
+from garmin.transports import make_transport
+from garmin.utils      import Obj
+
+log = logging.getLogger('garmin.pool')
+
+# Runs one Forerunner session per docked device on a thread pool. The time
+# goes into USB transfers, so the sessions overlap on threads; a failure or
+# a timeout only loses the session of its device.
+
+class SessionTransport (Transport):
+    # forwards to another transport and counts what was read. Once aborted
+    # every call fails, the device cannot be opened again: the session ends
+    # at its next transfer and closes the device from its own thread.
+
+    def __init__ (self, transport):
+        self.transport = transport
+        self.bytes = 0
+        self.reads = 0
+        self.aborted = False
+
+    def abort (self):
+        self.aborted = True
+
+    def check (self):
+        if self.aborted:
+            raise USBException, 'Session aborted'
+
+    def is_open (self):
+        return self.transport.is_open()
+
+    def open (self):
+        self.check()
+        self.transport.open()
+
+    def close (self):
+        self.transport.close()
+
+    def count (self, data):
+        self.bytes += len(data)
+        self.reads += 1
+        return data
+
+    def read_interrupt (self, size, timeout):
+        self.check()
+        return self.count( self.transport.read_interrupt( size, timeout ) )
+
+    def read_bulk (self, size, timeout):
+        self.check()
+        return self.count( self.transport.read_bulk( size, timeout ) )
+
+    def write_bulk (self, data, timeout):
+        self.check()
+        return self.transport.write_bulk( data, timeout )
+
+class DevicePool:
+
+    # seconds a whole session may take, from the moment it gets a worker
+    TIMEOUT = 600
+    # seconds an aborted session has to end, a transfer under way runs to
+    # its timeout first. Past that, the sessions waiting for its worker are
+    # cancelled and run() returns without it.
+    ABORT_GRACE = 5
+    POLL = 0.1
+
+    def __init__ (self, transports, workers = None, timeout = TIMEOUT, capability_cache = None, pipeline = 0,
+                  retries = 0):
+        # transports is a list of ( name, transport )
+        self.transports = transports
+        self.workers = workers or max( 1, len(transports) )
+        self.timeout = timeout
+        self.capability_cache = capability_cache
+        self.pipeline = pipeline
+        self.retries = retries
+
+    @staticmethod
+    def discover (vendor_id = Forerunner.VENDOR_ID, product_id = Forerunner.PRODUCT_ID, **kwargs):
+        # enumerates the buses once, one transport per matching device
+        transports = []
+        for bus, device in find_devices( vendor_id, product_id ):
+            name = '%s/%s' % ( bus, device.filename )
+            transports.append( ( name, make_transport( 'pyusb', vendor_id, product_id, device, name ) ) )
+        log.info('Found %d devices', len(transports) )
+        return DevicePool( transports, **kwargs )
+
+    def session (self, name, transport, task):
+        # runs on a worker, never raises: the outcome goes in the result
+        result = Obj( name = name, ok = False, result = None, error = None, device_id = None
+            , seconds = 0.0, bytes = 0, reads = 0 )
+        started = time.time()
+        dev = Forerunner( transport )
+        dev.set_pipeline( self.pipeline )
+        dev.set_retries( self.retries )
+        if self.capability_cache is not None:
+            dev.set_capability_cache( self.capability_cache )
+        try:
+            try:
+                dev.start_session()
+                dev.get_device_capabilities()
+                result.device_id = dev.device_id
+                result.result = task( dev )
+                result.ok = True
+            except Exception, ex:
+                log.error('Session on %s failed: %s', name, ex )
+                result.error = ''.join( traceback.format_exception( *sys.exc_info() ) )
+        finally:
+            try:
+                dev.close()
+            except Exception, ex:
+                log.warn('Closing %s failed: %s', name, ex )
+        result.seconds = time.time() - started
+        result.bytes = transport.bytes
+        result.reads = transport.reads
+        return result
+
+    def run (self, task):
+        # task( device ) runs after the session is started and the device
+        # capabilities are known, its return value is kept in the result.
+        # A session has TIMEOUT seconds from the moment it gets a worker,
+        # the time spent queued does not count.
+        started = time.time()
+        transports = dict( [ ( name, SessionTransport( transport ) ) for name, transport in self.transports ] )
+        results = {}
+        began = {}
+        lock = threading.Lock()
+        cancelled = threading.Event()
+        slots = threading.Semaphore( self.workers )
+        def work (name):
+            slots.acquire()
+            try:
+                lock.acquire()
+                try:
+                    if cancelled.is_set():
+                        return
+                    began[name] = time.time()
+                finally:
+                    lock.release()
+                result = self.session( name, transports[name], task )
+                lock.acquire()
+                try:
+                    # a session reported as timed out keeps that result
+                    results.setdefault( name, result )
+                finally:
+                    lock.release()
+            finally:
+                slots.release()
+        threads = []
+        for name, transport in self.transports:
+            thread = threading.Thread( target = work, args = ( name, ), name = 'garmin-session-%s' % name )
+            thread.daemon = True
+            thread.start()
+            threads.append( ( name, thread ) )
+
+        aborted = {}
+        while True:
+            lock.acquire()
+            try:
+                now = time.time()
+                for name, thread in threads:
+                    if name in began and name not in results and now - began[name] > self.timeout:
+                        # the worker may be blocked in a transfer, the
+                        # aborted transport fails the next one
+                        log.error('Session on %s timed out', name )
+                        transports[name].abort()
+                        aborted[name] = now
+                        results[name] = self.failure( name, 'timeout', now - began[name] )
+                # every worker is held by an aborted session that does not
+                # let go, the queued sessions would wait for ever
+                stuck = [ name for name, thread in threads if name in aborted and thread.is_alive()
+                    and now - aborted[name] > self.ABORT_GRACE ]
+                if len(stuck) >= self.workers:
+                    cancelled.set()
+                # once cancelled, the sessions still queued never start.
+                # Aborted sessions are waited for until they end or are stuck.
+                pending = [ name for name, thread in threads if thread.is_alive() and name not in stuck
+                    and ( name in aborted or ( name not in results and ( name in began or not cancelled.is_set() ) ) ) ]
+                if not pending:
+                    cancelled.set()
+                    break
+            finally:
+                lock.release()
+            time.sleep( self.POLL )
+
+        for name, thread in threads:
+            if thread.is_alive() and name in aborted:
+                log.error('Session on %s did not end after it was aborted', name )
+            if name not in results:
+                log.error('Session on %s cancelled, no worker was free', name )
+                results[name] = self.failure( name, 'cancelled', 0.0 )
+        return self.report( [ results[name] for name, thread in threads ], time.time() - started )
+
+    def failure (self, name, error, seconds):
+        return Obj( name = name, ok = False, result = None, error = error
+            , device_id = None, seconds = seconds, bytes = 0, reads = 0 )
+
+    def report (self, results, seconds):
+        transferred = sum( [ result.bytes for result in results ] )
+        report = Obj(
+            results = results
+            , succeeded = len( [ result for result in results if result.ok ] )
+            , failed = len( [ result for result in results if not result.ok ] )
+            , seconds = seconds
+            , bytes = transferred
+            , bytes_per_second = seconds and transferred / seconds or 0.0
+            # the time the sessions would have taken one after the other
+            , sequential_seconds = sum( [ result.seconds for result in results ] )
+        )
+        log.info('%d devices synced, %d failed in %.1fs, %.0f bytes/s (%.1fs one after the other)'
+            , report.succeeded, report.failed, seconds, report.bytes_per_second, report.sequential_seconds )
+        return report
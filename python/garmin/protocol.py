@@ -1,7 +1,9 @@
-import struct, logging, datetime
+import struct, logging, datetime, functools
 from garmin.usbio   import GarminUSB
 from garmin.packet  import *
 from garmin.utils   import objectify, Obj, UTC
+from garmin.layout  import layout_for
+from garmin         import capabilities
 import garmin.command
 log = logging.getLogger('garmin.protocol')
 
@@ -18,6 +20,48 @@ class UnsupportedDatatypeExecption (ProtocolException):
 
 class USBPacketDevice( GarminUSB ):
 
+    # packet id : decoder, datatype names, implemented datatypes
+    # decoders without datatype are usable before the protocols are known,
+    # the first datatype name the device reports is used.
+    DECODERS = {
+        Packet.SESSION_STARTED          : ( 'ulong', None, None )
+        , Packet.TRANSFER_COMPLETE      : ( 'ushort', None, None )
+        , Packet.RECORDS                : ( 'ushort', None, None )
+        , Packet.PROTOCOL_ARRAY         : ( 'protocol_array', None, None )
+        , Packet.PRODUCT_DATA           : ( 'product_data', None, None )
+        , Packet.EXTENDED_PRODUCT_DATA  : ( 'extended_product_data', None, None )
+        , Packet.DATE_TIME              : ( 'date_time', ('date_time',), (600,) )
+        , Packet.ALMANAC_DATA           : ( 'layout', ('almanac',), (501,) )
+        , Packet.PVT_DATA               : ( 'layout', ('pvt',), (800,) )
+        , Packet.FITNESS_USER_PROFILE   : ( 'layout', ('fitness',), (1004,) )
+        , Packet.RUN                    : ( 'layout', ('run',), (1009,) )
+        , Packet.LAP                    : ( 'layout', ('lap',), (1011, 1015) )
+        , Packet.WORKOUT                : ( 'layout', ('workout',), (1008,) )
+        , Packet.WORKOUT_OCCURRENCE     : ( 'layout', ('workout.occurrence',), (1003,) )
+        , Packet.TRACK_HEADER           : ( 'track_header', ('track.header',), (310, 311, 312) )
+        , Packet.TRACK_DATA             : ( 'layout', ('track.data',), (304,) )
+        , Packet.COURSE                 : ( 'layout', ('course',), (1006,) )
+        , Packet.COURSE_LAP             : ( 'layout', ('course.lap',), (1007,) )
+        , Packet.COURSE_POINT           : ( 'layout', ('course.point',), () )
+        , Packet.COURSE_TRACK_HEADER    : ( 'track_header', ('course.track.header', 'track.header'), (310, 311, 312) )
+        , Packet.COURSE_TRACK_DATA      : ( 'layout', ('course.track.data', 'track.data'), (304,) )
+        , Packet.COURSE_LIMITS          : ( 'layout', ('course.limits',), (1013,) )
+    }
+    # a subclass changing DECODERS computes its own
+    DECODERS_FINGERPRINT = capabilities.fingerprint( DECODERS )
+
+    # lazy decoding returns views over the packet payload for the layout
+    # datatypes, fields are unpacked when they are first read
+    lazy = False
+
+    def __init__ (self, vendor_id, product_id, transport = None):
+        GarminUSB.__init__(self, vendor_id, product_id, transport)
+        self.plan_dispatch( None )
+
+    def set_lazy (self, lazy):
+        self.lazy = lazy
+        self.plan_dispatch( self.get_protocols() )
+
     def get_protocols (self):
         raise Exception, 'Please override me and by a method that returns a ProtocolManager'
 
@@ -28,13 +72,106 @@ class USBPacketDevice( GarminUSB ):
                 raise UnsupportedDatatypeExecption(value)
         return value
 
-    def execute_reader( self, reader ):
+    def plan_dispatch (self, protocols, plan = None):
+        # a plan maps packet ids to ( decoder name, datatype ), unsupported
+        # datatypes get the 'unsupported' decoder that rejects them. Plans
+        # hold no bound methods so they can be cached across sessions.
+        if plan is None:
+            plan = self.plan_decoders( protocols )
+        self.plan = plan
+        self.decoders = self.bind_plan( plan )
+        self.specialized_decoders = {}
+
+    def plan_decoders (self, protocols, overrides = None):
+        plan = {}
+        for packet_id, (name, datatype_names, implemented) in self.DECODERS.items():
+            name = (overrides or {}).get( packet_id, name )
+            if datatype_names is None:
+                plan[packet_id] = ( name, None )
+                continue
+            if protocols is None:
+                continue
+            datatype = None
+            for datatype_name in datatype_names:
+                if protocols.has_datatype( datatype_name ):
+                    datatype = protocols.datatype( datatype_name )
+                    break
+            if datatype is None:
+                continue
+            if datatype not in implemented:
+                log.debug('Packet [%04X] uses unsupported datatype %d', packet_id, datatype )
+                plan[packet_id] = ( 'unsupported', datatype )
+                continue
+            plan[packet_id] = ( name, datatype )
+        return plan
+
+    def bind_plan (self, plan):
+        table = {}
+        for packet_id, (name, datatype) in plan.items():
+            table[packet_id] = self.bind_decoder( name, datatype )
+        return table
+
+    def build_dispatch_table (self, protocols, overrides = None):
+        return self.bind_plan( self.plan_decoders( protocols, overrides ) )
+
+    def bind_decoder (self, name, datatype):
+        if name == 'layout' and self.lazy:
+            name = 'layout_lazy'
+        if name in self.LAYOUT_DECODERS:
+            return self.bind_layout( name, datatype )
+        return functools.partial( getattr(self, 'd_%s' % name), datatype = datatype )
+
+    # the layout decoders unpack straight from the reader, the hottest path
+    LAYOUT_DECODERS = {
+        'layout':           'unpack'
+        , 'layout_lazy':    'lazy'
+        , 'track_data_raw': 'unpack_raw'
+    }
+
+    def bind_layout (self, name, datatype):
+        layout = layout_for(datatype)
+        unpack = getattr( layout, self.LAYOUT_DECODERS[name] )
+        size = layout.size
+        def decode (sr):
+            result = unpack( sr.data, sr.index )
+            sr.index += size
+            return result
+        return decode
+
+    def dispatch_table (self, overrides = None):
+        # overrides map packet ids to another decoder for one transfer
+        if overrides is None:
+            return self.decoders
+        key = tuple(sorted(overrides.items()))
+        table = self.specialized_decoders.get( key, None )
+        if table is None:
+            table = self.specialized_decoders[key] = self.build_dispatch_table( self.get_protocols(), overrides )
+        return table
+
+    # decoders replaces the dispatch table for one transfer
+    def execute_reader( self, reader, overrides = None, decoders = None ):
+        decoders = decoders or self.dispatch_table( overrides )
         reader.next()
         while True:
-            result = reader.send( self.read_response() )
+            result = reader.send( self.read_response(decoders) )
             if result is not None:
                 return result
 
+    # drives a reader like execute_reader but yields every record the reader
+    # emits as soon as the packet completing it has been decoded
+    def stream_reader (self, make_reader, overrides = None, decoders = None):
+        decoders = decoders or self.dispatch_table( overrides )
+        pending = []
+        reader = make_reader( pending.append )
+        reader.next()
+        while True:
+            result = reader.send( self.read_response(decoders) )
+            for item in pending:
+                yield item
+            del pending[:]
+            if result is not None:
+                return
+
     def send_command (self, command):
         if not isinstance(command,garmin.command.Base):
             # intanciate the class
@@ -43,118 +180,31 @@ class USBPacketDevice( GarminUSB ):
         packet = command.encode_for_device( self.get_protocols() )
         self.write_packet( packet )
 
-    def read_response (self):
+    def read_response (self, decoders = None):
         packet = self.read_packet()
         if packet.payload is None:
             log.debug('done')
             return packet.id, None
-        return self.decode( packet )
-
-    def decode (self, packet):
-        # log.debug('decoding: %04X (%d) length: %d %s', packet.id, packet.id, len(packet.payload), hexdump(packet.payload) )
-        decoder = {
-            0 : None
-            , Packet.SESSION_STARTED        : 'ulong'
-            , Packet.DATE_TIME              : 'date_time'
-            , Packet.PROTOCOL_ARRAY         : 'protocol_array'
-            , Packet.ALMANAC_DATA           : 'almanac_data'
-            , Packet.TRANSFER_COMPLETE      : 'ushort'
-            , Packet.PRODUCT_DATA           : 'product_data'
-            , Packet.EXTENDED_PRODUCT_DATA  : 'extended_product_data'
-            , Packet.FITNESS_USER_PROFILE   : 'fitness_user_profile'
-            , Packet.RECORDS                : 'ushort'
-            , Packet.RUN                    : 'run'
-            , Packet.LAP                    : 'lap'
-            , Packet.WORKOUT                : 'workout'
-            , Packet.WORKOUT_OCCURRENCE     : 'workout_occurrence'
-            , Packet.TRACK_HEADER           : 'track_header'
-            , Packet.TRACK_DATA             : 'track_data'
-            , Packet.COURSE                 : 'course'
-            , Packet.COURSE_LAP             : 'course_lap'
-            , Packet.COURSE_POINT           : 'course_point'
-            , Packet.COURSE_TRACK_HEADER    : 'course_track_header'
-            , Packet.COURSE_TRACK_DATA      : 'course_track_data'
-            , Packet.COURSE_LIMITS          : 'course_limits'
-        }.get( packet.id, None )
+        return self.decode( packet, decoders )
+
+    def decode (self, packet, decoders = None):
+        decoder = (decoders or self.decoders).get( packet.id, None )
         if decoder is None:
             log.warn('Skipping unknown packet with id [%04X] (%d)', packet.id, packet.id )
             return 0, None
-        if decoder is '':
-            return packet.id, None
-        return packet.id, getattr(self,'d_%s' % decoder)( StructReader(packet.payload, endianness ='<') )
+        return packet.id, decoder( packet.reader() )
 
-    def d_ulong (self, sr):
+    def d_ulong (self, sr, datatype):
         return sr.read('L')
 
-    def d_ushort (self, sr):
+    def d_ushort (self, sr, datatype):
         return sr.read('H')
 
-    def d_date_time (self, sr):
-        datatype = self.datatype_for('date_time', 600)
+    def d_date_time (self, sr, datatype):
         month, day, year, hour, minute, second = sr.read('2B 2H 2B')
         return datetime.datetime( year, month, day, hour, minute, second, 0, UTC() )
 
-    def d_fitness_user_profile (self, sr):
-        datatype = self.datatype_for('fitness', 1004)
-        activities =  Obj()
-        for activity in [ 'running', 'biking', 'other' ]:
-            heart_rate_zones = []
-            for i in xrange(5):
-                low, high = sr.read('2B 2x')
-                heart_rate_zones.append( Obj(low = low, high = high) )
-            speed_zones = []
-            for i in xrange(10):
-                low, high = sr.read('2f')
-                name = sr.read_fixed_string(16)
-                speed_zones.append( Obj( name = name, low = low, high = high) )
-            gear_weight, maximum_heart_rate = sr.read('f B 3x')
-            keys = ( 'heart_rate_zones', 'speed_zones', 'gear_weight','maximum_heart_rate' )
-            values = ( heart_rate_zones, speed_zones, gear_weight, maximum_heart_rate )
-            activities[ activity ] = objectify(keys,values)
-
-        weight, birth_year, birth_month, birth_day, gender = sr.read('f H 3B')
-        birthdate = datetime.date( birth_year, birth_month, birth_day)
-
-        keys = ( 'activities', 'weight', 'birthdate', 'gender' )
-        values = ( activities, weight, birthdate, gender )
-        return objectify(keys,values)
-
-    def d_run (self, sr):
-        datatype = self.datatype_for('run', 1009)
-        track_index, first_lap_index, last_lap_index = sr.read('3H')
-        sport, program, multisport = sr.read('3B 3x')
-        quick_wokrout = objectify( ( 'time', 'distance' ), sr.read('L f') )
-        workout = self.d_workout(sr, forced_datatype = 1008)
-        keys = ( 'track_index', 'first_lap_index', 'last_lap_index', 'sport', 'program', 'multisport', 'quick_wokrout', 'workout')
-        values = ( track_index, first_lap_index, last_lap_index, sport, program, multisport, quick_wokrout, workout )
-        return objectify(keys,values)
-
-    def d_lap (self, sr):
-        datatype = self.datatype_for('lap', 1011, 1015)
-        keys = ( 'index', 'start_time', 'duration', 'distance', 'max_speed', 'begin', 'end', 'calories', 'average_heart_rate', 'maximum_heart_rate', 'intensity', 'average_cadence', 'trigger_method' )
-        values = ( sr.read('H 2x') , sr.read_time() ) +  sr.read('L 2f') + ( sr.read_position(), sr.read_position() ) + sr.read('H 5B')
-        return objectify(keys,values)
-
-    def d_workout (self, sr, forced_datatype= None):
-        datatype = forced_datatype or self.datatype_for('workout', 1008)
-        valid_steps_counts = sr.read('L')
-        steps = []
-        for i in xrange(20):
-            keys = ( 'custom_name', 'target_custom_zone_low', 'target_custom_zone_high', 'duration_value', 'intensity', 'duration', 'target', 'target_value')
-            values = ( sr.read_fixed_string(16), ) + sr.read('2f H 4B 2x')
-            steps.append( objectify(keys,values) )
-        name = sr.read_fixed_string(16)
-        sport = sr.read('B')
-        return name, sport, steps[:valid_steps_counts]
-
-    def d_workout_occurrence(self, sr):
-        datatype = self.datatype_for('workout.occurrence', 1003)
-        workout_name = sr.read_fixed_string(16)
-        day = sr.read_time()
-        return Obj( workout_name = workout_name, day = day )
-
-    def d_track_header (self, sr):
-        datatype = self.datatype_for('track.header', 310, 311, 312)
+    def d_track_header (self, sr, datatype):
         if datatype == 311:
             return sr.read('H')
         elif datatype in [ 310, 312 ]:
@@ -162,51 +212,10 @@ class USBPacketDevice( GarminUSB ):
             values = sr.read('2B') + ( sr.read_string(), )
             return objectify(keys,values)
 
-    def d_track_data (self,sr):
-        datatype = self.datatype_for('track.data', 304)
-        keys = ( 'position', 'time', 'altitude', 'distance', 'heart_rate', 'cadence', 'sensor' )
-        values = ( sr.read_position(), sr.read_time() ) + sr.read('2f 3B')
-        result  = objectify(keys,values)
-        log.debug("time %s", result.time)
-        return result
-
-    def d_almanac_data (self, sr):
-        datatype = self.datatype_for('almanac', 501)
-        keys = ( 'week_number', 'af0', 'af1', 'eccentricity', 'sqrta', 'm0', 'w', 'omg0', 'odot', 'inclination', 'health' )
-        return objectify(keys,sr.read('H 10f B'))
-
-    def d_course (self, sr):
-        datatype = self.datatype_for('course', 1006)
-        result = Obj()
-        result.index = sr.read('H 2x')
-        result.course_name = sr.read_fixed_string(16)
-        return result
-
-    def d_course_point (self, sr):
-        datatype = self.datatype_for('course.point',0)
-
-    def d_course_lap (self, sr):
-        datatype = self.datatype_for('course.lap', 1007)
-        keys = ( 'course_index', 'lap_index', 'total_time', 'total_distance', 'begin', 'end', 'average_heart_rate', 'maximum_heart_rate', 'intensity', 'average_cadence' )
-        values = sr.read('2H L f') + (sr.read_position(), sr.read_position()) + sr.read('4B')
-        return objectify(keys,values)
-
-    def d_course_track_header (self, sr):
-        if self.get_protocols().has_datatype('course.track.header'):
-            raise NotImplementd, 'course track header is not implemeted'
-        return self.d_track_header(sr)
-
-    def d_course_track_data (self, sr):
-        if self.get_protocols().has_datatype('course.track.data'):
-            raise NotImplementd, 'course track data is not implemeted'
-        return self.d_track_data(sr)
-
-    def d_course_limits (self, sr):
-        dataype = self.datatype_for('course.limits', 1013)
-        keys = ( 'max_courses', 'max_course_laps', 'max_course_points', 'max_course_track_poins' )
-        return objectify(keys,sr.read('4L'))
-
-    def d_protocol_array (self, sr):
+    def d_unsupported (self, sr, datatype):
+        raise UnsupportedDatatypeExecption(datatype)
+
+    def d_protocol_array (self, sr, datatype):
         physical = None
         link = None
         protocols = {}
@@ -227,14 +236,17 @@ class USBPacketDevice( GarminUSB ):
                 protocols[last_protocol].append( data )
         return ProtocolManager( physical, link, protocols )
 
-    def d_product_data (self, sr):
+    def d_protocol_array_raw (self, sr, datatype):
+        return sr.read_raw()
+
+    def d_product_data (self, sr, datatype):
         p = Obj()
         p.product_id, p.software_version = sr.read('H h')
         p.description = sr.read_string()
         p.extra =  sr.read_strings()
         return p
 
-    def d_extended_product_data (self, sr):
+    def d_extended_product_data (self, sr, datatype):
         return sr.read_strings()
 
 class ProtocolManager:
@@ -278,6 +290,8 @@ class ProtocolManager:
                 self.protocols['datatype.%s' % value_name] = proto_values[ index ]
 
     def __getattr__(self,name):
+        if name.startswith('__'):
+            raise AttributeError, name
         if name.startswith('has_'):
             return self.supports( name[4:] )
         elif name.startswith('supports_'):
@@ -286,7 +300,7 @@ class ProtocolManager:
             value = self.protocols.get('protocol.%s'%name,None)
             if value is not None:
                 return value
-        return super(object,self).__getattr__(name)
+        raise AttributeError, name
 
     def supports (self, name):
         return self.protocols.get('protocol.%s' % name, None) is not None
@@ -0,0 +1,218 @@
+import sys, time, array, threading, logging
+from garmin.packet  import Packet
+from garmin.command import StartPVTDownload, StopPVTDownload
+from garmin.layout  import D800
+from garmin.usbio   import USBException
+
+log = logging.getLogger('garmin.pvt')
+
+# Live position: after StartPVTDownload the device sends a PVT_DATA packet
+# per fix, about one a second, until StopPVTDownload. A reader thread copies
+# each D800 payload into a ring allocated up front, fixes are only decoded
+# when a subscriber reads them. There is a single writer and readers take
+# no lock: a write counter, odd while a slot is being copied, tells a
+# reader that its fix changed under it ( a seqlock ). A reader that fell
+# a whole ring behind skips to the oldest fix still held. When the reader
+# thread ends the ring is ended: waiting subscribers get the fixes left,
+# then the error that stopped the thread, if any.
+
+class FixRing:
+
+    def __init__ (self, capacity = 256):
+        self.capacity = capacity
+        self.size = D800.size
+        self.data = bytearray( capacity * self.size )
+        self.received = array.array( 'd', [ 0.0 ] * capacity )
+        # sequence number of the next fix, the fixes held are
+        # [ max(0, head - capacity), head )
+        self.head = 0
+        # incremented before and after every copy into a slot
+        self.writes = 0
+        self.arrived = threading.Condition( threading.Lock() )
+        self.ended = False
+        # exc_info of the failure that ended the ring
+        self.error = None
+
+    def put (self, data, offset = 0):
+        slot = self.head % self.capacity
+        start = slot * self.size
+        self.writes += 1
+        self.data[start:start+self.size] = data[offset:offset+self.size]
+        self.received[slot] = time.time()
+        self.head += 1
+        self.writes += 1
+        self.arrived.acquire()
+        self.arrived.notify_all()
+        self.arrived.release()
+
+    def begin (self):
+        self.ended = False
+        self.error = None
+
+    def end (self, error = None):
+        self.arrived.acquire()
+        try:
+            self.ended = True
+            self.error = error
+            self.arrived.notify_all()
+        finally:
+            self.arrived.release()
+
+    def oldest (self):
+        return max( 0, self.head - self.capacity )
+
+    def fix (self, sequence):
+        # the decoded fix, None once it was overwritten. Read again when a
+        # write ran meanwhile, the bytes may belong to the next fix.
+        while True:
+            writes = self.writes
+            if writes & 1:
+                # a copy is under way
+                time.sleep( 0 )
+                continue
+            if sequence < self.oldest() or sequence >= self.head:
+                return None
+            fix = D800.unpack( self.data, ( sequence % self.capacity ) * self.size )
+            if self.writes == writes:
+                return fix
+
+    def latest (self):
+        if self.head == 0:
+            return None
+        return self.fix( self.head - 1 )
+
+    def latency (self, sequence):
+        # seconds since the fix arrived
+        return time.time() - self.received[ sequence % self.capacity ]
+
+    def wait (self, sequence, timeout = None):
+        # until the fix with sequence number arrived, False on timeout or
+        # when the ring ended before
+        if self.head > sequence:
+            return True
+        deadline = timeout is not None and time.time() + timeout or None
+        self.arrived.acquire()
+        try:
+            while self.head <= sequence and not self.ended:
+                if deadline is None:
+                    self.arrived.wait()
+                elif not self.wait_until( deadline ):
+                    break
+        finally:
+            self.arrived.release()
+        return self.head > sequence
+
+    def wait_until (self, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        self.arrived.wait( remaining )
+        return True
+
+class Subscription:
+    # iterates the fixes from the one after the last received, a reader
+    # that falls behind loses the oldest fixes, counted in dropped
+
+    def __init__ (self, ring, timeout = None):
+        self.ring = ring
+        self.timeout = timeout
+        self.sequence = ring.head
+        self.dropped = 0
+        self.closed = False
+
+    def next (self):
+        while not self.closed:
+            if not self.ring.wait( self.sequence, self.timeout ):
+                error = self.ring.error
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                raise StopIteration
+            oldest = self.ring.oldest()
+            if self.sequence < oldest:
+                self.dropped += oldest - self.sequence
+                self.sequence = oldest
+            fix = self.ring.fix( self.sequence )
+            self.sequence += 1
+            if fix is not None:
+                return fix
+            self.dropped += 1
+        raise StopIteration
+
+    def __iter__ (self):
+        return self
+
+    def close (self):
+        self.closed = True
+
+class PVTStream:
+    # the reader thread only copies bytes into the ring, a fix is decoded
+    # for the callbacks and again for each subscription reading it
+
+    def __init__ (self, device, capacity = 256):
+        self.device = device
+        self.ring = FixRing( capacity )
+        self.callbacks = []
+        self.thread = None
+        self.running = threading.Event()
+
+    def subscribe (self, callback):
+        # callback( fix ) runs on the reader thread as soon as a fix arrived
+        self.callbacks.append( callback )
+
+    def unsubscribe (self, callback):
+        self.callbacks.remove( callback )
+
+    def fixes (self, timeout = None):
+        return Subscription( self.ring, timeout )
+
+    def start (self):
+        if self.thread is not None:
+            return
+        self.device.send_command( StartPVTDownload )
+        self.ring.begin()
+        self.running.set()
+        self.thread = threading.Thread( target = self.run, name = 'garmin-pvt' )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run (self):
+        try:
+            self.read_fixes()
+        except Exception:
+            log.exception('PVT reader failed')
+            self.ring.end( sys.exc_info() )
+        else:
+            self.ring.end()
+
+    def read_fixes (self):
+        receive = self.device.receive_packet
+        ring = self.ring
+        while self.running.is_set():
+            try:
+                packet = receive()
+            except ( USBException, IOError ), ex:
+                # a timeout while no fix came ( pyusb raises an IOError ),
+                # the stream goes on
+                log.debug('No fix: %s', ex )
+                continue
+            if packet.id != Packet.PVT_DATA:
+                continue
+            ring.put( packet.data, packet.offset )
+            if self.callbacks:
+                self.notify( ring.head - 1 )
+
+    def notify (self, sequence):
+        fix = self.ring.fix( sequence )
+        for callback in list(self.callbacks):
+            try:
+                callback( fix )
+            except Exception:
+                log.exception('PVT subscriber failed')
+
+    def stop (self):
+        if self.thread is None:
+            return
+        self.running.clear()
+        self.device.send_command( StopPVTDownload )
+        self.thread.join()
+        self.thread = None
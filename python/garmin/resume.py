@@ -0,0 +1,123 @@
+import logging
+from garmin.packet   import Packet, UnexpectedPacketException
+from garmin.usbio    import USBException
+from garmin.pipeline import PumpException
+
+log = logging.getLogger('garmin.resume')
+
+# A transfer that survives a flaky dock. The reader generator is the
+# checkpoint: it holds what was received so far and waits for the next
+# packet. After a failure the device is reset, the session started again and
+# the command sent again; the device then repeats the transfer from its
+# start, the packets already handed to the reader are read and skipped
+# without being decoded. When the RECORDS count differs the data on the
+# device changed and the transfer starts over with a new reader.
+
+# transport errors and timeouts, pyusb reports timeouts as usb.USBError, an
+# IOError, and packets out of place: after a stall the stream can lose its
+# place in the transfer, reconnecting drops what is buffered and the device
+# sends it again from the start. A packet that cannot be decoded is a bug,
+# sending the command again would not help.
+RETRYABLE = ( USBException, IOError, PumpException, UnexpectedPacketException )
+
+class ResumableTransfer:
+
+    RETRIES = 3
+    # timeouts are multiplied by BACKOFF after every failure, up to
+    # MAX_TIMEOUT milliseconds, and restored once the transfer is over
+    BACKOFF = 2
+    MAX_TIMEOUT = 30000
+
+    def __init__ (self, device, command, make_reader, expected, overrides = None, decoders = None, retries = RETRIES):
+        # make_reader() returns a new collecting reader, expected are the
+        # packet ids it accepts between RECORDS and TRANSFER_COMPLETE
+        self.device = device
+        self.command = command
+        self.make_reader = make_reader
+        self.expected = frozenset( expected )
+        self.decoders = decoders or device.dispatch_table( overrides )
+        self.retries = retries
+        self.reader = None
+        self.count = None
+        self.received = 0
+        self.skipped = 0
+        self.attempts = 0
+
+    def run (self):
+        dev = self.device
+        timeouts = ( dev.bulk_timeout, dev.intr_timeout )
+        try:
+            while True:
+                try:
+                    if self.attempts > 0:
+                        self.reconnect()
+                    self.attempts += 1
+                    return self.attempt()
+                except RETRYABLE, ex:
+                    if self.attempts > self.retries:
+                        raise
+                    if self.reader is not None and self.reader.gi_frame is None:
+                        # the reader raised, it cannot take the rest
+                        log.warn('Reader failed, starting the transfer over')
+                        self.reader = None
+                    log.warn('Transfer failed after %d of %s records ( %s ), retrying'
+                        , self.received, self.count, ex )
+        finally:
+            dev.set_timeouts( *timeouts )
+            if self.attempts > 1:
+                log.info('Transfer took %d attempts, %d packets skipped', self.attempts, self.skipped )
+
+    def reconnect (self):
+        dev = self.device
+        dev.set_timeouts( min( dev.bulk_timeout * self.BACKOFF, self.MAX_TIMEOUT )
+            , min( dev.intr_timeout * self.BACKOFF, self.MAX_TIMEOUT ) )
+        # closing drops the buffered bytes and the read ahead packets
+        try:
+            dev.close()
+        except Exception, ex:
+            log.debug('Closing the device failed: %s', ex )
+        dev.start_session()
+
+    def attempt (self):
+        dev = self.device
+        dev.send_command( self.command )
+        packet_id, count = dev.decode( dev.read_packet(), self.decoders )
+        if packet_id != Packet.RECORDS:
+            raise UnexpectedPacketException(packet_id)
+        if self.reader is not None and count != self.count:
+            log.warn('Record count changed from %d to %d, starting over', self.count, count )
+            self.reader = None
+        if self.reader is None:
+            self.start( count )
+        else:
+            self.skip()
+
+        expected = self.expected
+        while True:
+            packet_id, value = dev.read_response( self.decoders )
+            # checked before the reader sees it, a reader that raised starts over
+            if self.received < count:
+                if packet_id not in expected:
+                    raise UnexpectedPacketException(packet_id)
+            elif packet_id != Packet.TRANSFER_COMPLETE:
+                raise UnexpectedPacketException(packet_id)
+            result = self.reader.send( ( packet_id, value ) )
+            self.received += 1
+            if result is not None:
+                return result
+
+    def start (self, count):
+        self.count = count
+        self.received = 0
+        self.reader = self.make_reader()
+        self.reader.next()
+        self.reader.send( ( Packet.RECORDS, count ) )
+
+    def skip (self):
+        read_packet = self.device.read_packet
+        expected = self.expected
+        for i in xrange( self.received ):
+            packet = read_packet()
+            if packet.id not in expected:
+                raise UnexpectedPacketException(packet.id)
+        self.skipped += self.received
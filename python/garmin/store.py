@@ -0,0 +1,234 @@
+import sqlite3, hashlib, itertools, logging
+from garmin.columnar import TrackColumns
+from garmin.layout   import from_time
+from garmin.utils    import Obj
+
+log = logging.getLogger('garmin.store')
+
+# Local store of the activities read from the devices. Times are garmin
+# epoch seconds, positions semicircles. Every row has a content hash: the
+# same activity synced from several devices is stored once, the sources
+# table records which devices had it. Track points are stored per segment
+# as a blob of TrackColumns.
+
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    '''create table if not exists laps (
+        id integer primary key, hash text unique not null, device integer not null
+        , lap_index integer, start_time integer not null, duration integer, distance real, max_speed real
+        , begin_latitude integer, begin_longitude integer, end_latitude integer, end_longitude integer
+        , calories integer, average_heart_rate integer, maximum_heart_rate integer
+        , intensity integer, average_cadence integer, trigger_method integer )'''
+    , '''create table if not exists runs (
+        id integer primary key, hash text unique not null, device integer not null
+        , track_index integer, first_lap_index integer, last_lap_index integer
+        , sport integer, program integer, multisport integer
+        , start_time integer, end_time integer, lap_hashes text )'''
+    , '''create table if not exists tracks (
+        id integer primary key, hash text unique not null, device integer not null
+        , kind text not null, header text, start_time integer, end_time integer, points integer
+        , min_latitude integer, max_latitude integer, min_longitude integer, max_longitude integer
+        , data blob )'''
+    , '''create table if not exists courses (
+        id integer primary key, hash text unique not null, device integer not null
+        , course_index integer, name text )'''
+    , '''create table if not exists sources (
+        kind text not null, hash text not null, device integer not null
+        , primary key ( kind, hash, device ) )'''
+    , 'create index if not exists laps_start on laps ( start_time )'
+    , 'create index if not exists runs_start on runs ( start_time )'
+    , 'create index if not exists tracks_start on tracks ( kind, start_time )'
+    # the bounds of every track with points, kept by the triggers
+    , '''create virtual table if not exists track_bounds using rtree_i32 (
+        id, min_latitude, max_latitude, min_longitude, max_longitude )'''
+    , '''create trigger if not exists track_bounds_insert after insert on tracks
+        when new.min_latitude is not null begin
+        insert into track_bounds values ( new.id, new.min_latitude, new.max_latitude, new.min_longitude, new.max_longitude );
+        end'''
+    , '''create trigger if not exists track_bounds_delete after delete on tracks begin
+        delete from track_bounds where id = old.id;
+        end'''
+    , 'create index if not exists sources_device on sources ( device, kind )'
+]
+
+LAP_COLUMNS = ( 'hash', 'device', 'lap_index', 'start_time', 'duration', 'distance', 'max_speed'
+    , 'begin_latitude', 'begin_longitude', 'end_latitude', 'end_longitude', 'calories'
+    , 'average_heart_rate', 'maximum_heart_rate', 'intensity', 'average_cadence', 'trigger_method' )
+
+RUN_COLUMNS = ( 'hash', 'device', 'track_index', 'first_lap_index', 'last_lap_index', 'sport', 'program'
+    , 'multisport', 'start_time', 'end_time', 'lap_hashes' )
+
+TRACK_COLUMNS = ( 'hash', 'device', 'kind', 'header', 'start_time', 'end_time', 'points'
+    , 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude', 'data' )
+
+COURSE_COLUMNS = ( 'hash', 'device', 'course_index', 'name' )
+
+def content_hash (*values):
+    return hashlib.sha1( repr(values) ).hexdigest()
+
+def to_seconds (value):
+    if value is None or isinstance(value, (int, long)):
+        return value
+    return from_time( value )
+
+class ActivityStore:
+
+    # rows written per transaction
+    BATCH = 2000
+
+    def __init__ (self, path = ':memory:'):
+        self.path = path
+        self.db = sqlite3.connect( path )
+        self.db.execute('pragma journal_mode = wal')
+        self.db.execute('pragma synchronous = normal')
+        for statement in SCHEMA:
+            self.db.execute( statement )
+        self.db.execute( 'pragma user_version = %d' % SCHEMA_VERSION )
+        self.db.commit()
+
+    def close (self):
+        self.db.close()
+
+    def insert (self, table, kind, columns, rows):
+        # rows is any iterable, consumed BATCH rows at a time. Returns the
+        # number of new rows, duplicates only add a source.
+        statement = 'insert or ignore into %s ( %s ) values ( %s )' % ( table, ', '.join(columns), ', '.join( '?' * len(columns) ) )
+        rows = iter(rows)
+        inserted = 0
+        while True:
+            batch = list( itertools.islice( rows, self.BATCH ) )
+            if not batch:
+                break
+            # rowcount leaves out the rows written by the triggers
+            inserted += self.db.executemany( statement, batch ).rowcount
+            self.db.executemany( 'insert or ignore into sources ( kind, hash, device ) values ( ?, ?, ? )'
+                , [ ( kind, row[0], row[1] ) for row in batch ] )
+            self.db.commit()
+        log.debug('Stored %d new %s', inserted, table )
+        return inserted
+
+    def lap_row (self, device, lap):
+        start_time = to_seconds( lap.start_time )
+        begin, end = tuple(lap.begin), tuple(lap.end)
+        digest = content_hash( 'lap', start_time, lap.duration, lap.distance, begin, end, lap.calories )
+        return ( digest, device, lap.index, start_time, lap.duration, lap.distance, lap.max_speed
+            , begin[0], begin[1], end[0], end[1], lap.calories, lap.average_heart_rate
+            , lap.maximum_heart_rate, lap.intensity, lap.average_cadence, lap.trigger_method )
+
+    def ingest_laps (self, device, laps):
+        return self.insert( 'laps', 'lap', LAP_COLUMNS, ( self.lap_row( device, lap ) for lap in laps ) )
+
+    def run_row (self, device, run, laps):
+        # lap indexes differ between devices, a run is identified by its laps
+        run_laps = [ laps[i] for i in xrange( run.first_lap_index, run.last_lap_index + 1 ) if i in laps ]
+        lap_hashes = ' '.join( [ self.lap_row( device, lap )[0] for lap in run_laps ] )
+        start_time = end_time = None
+        if run_laps:
+            start_time = to_seconds( run_laps[0].start_time )
+            end_time = to_seconds( run_laps[-1].start_time ) + run_laps[-1].duration // 100
+        digest = content_hash( 'run', run.sport, run.program, run.multisport, lap_hashes or ( device, run.track_index ) )
+        return ( digest, device, run.track_index, run.first_lap_index, run.last_lap_index, run.sport
+            , run.program, run.multisport, start_time, end_time, lap_hashes )
+
+    def ingest_runs (self, device, runs, laps):
+        laps = dict( [ (lap.index, lap) for lap in laps ] )
+        return self.insert( 'runs', 'run', RUN_COLUMNS, ( self.run_row( device, run, laps ) for run in runs ) )
+
+    def track_row (self, device, segment, kind):
+        columns = TrackColumns.from_points( segment.data )
+        if not len(columns):
+            return None
+        data = columns.tostring()
+        bounds = columns.bounds() or ( None, None, None, None )
+        return ( hashlib.sha1( kind + data ).hexdigest(), device, kind, repr(segment.header)
+            , columns.time[0], columns.time[-1], len(columns) ) + bounds + ( sqlite3.Binary(data), )
+
+    def ingest_track_log (self, device, segments, kind = 'track'):
+        # segments as produced by the track readers, lists of points or
+        # TrackColumns, typically straight from iter_track_log
+        rows = ( self.track_row( device, segment, kind ) for segment in segments )
+        return self.insert( 'tracks', kind, TRACK_COLUMNS, ( row for row in rows if row is not None ) )
+
+    def ingest_courses (self, device, courses, course_tracks = ()):
+        # a course is identified by its name and the points of its track: the
+        # track whose header is the course index ( D311 ) or name ( D310, D312 )
+        tracks = [ ( segment.header, self.track_row( device, segment, 'course' ) ) for segment in course_tracks ]
+        tracks = [ ( header, row ) for header, row in tracks if row is not None ]
+        track_hashes = {}
+        for header, row in tracks:
+            if not isinstance(header, (int, long)):
+                header = header.identifier
+            track_hashes[header] = row[0]
+        added = self.insert( 'tracks', 'course', TRACK_COLUMNS, [ row for header, row in tracks ] )
+        rows = [ ( content_hash( 'course', course.course_name
+            , track_hashes.get( course.index, track_hashes.get( course.course_name, None ) ) )
+            , device, course.index, course.course_name ) for course in courses ]
+        return self.insert( 'courses', 'course', COURSE_COLUMNS, rows ) + added
+
+    def ingest_sync (self, device, result):
+        # the result of IncrementalSync.sync
+        return ( self.ingest_laps( device, result.laps ) + self.ingest_runs( device, result.runs, result.laps )
+            + self.ingest_track_log( device, result.track_log ) )
+
+    def query (self, statement, parameters = ()):
+        cursor = self.db.execute( statement, parameters )
+        names = [ description[0] for description in cursor.description ]
+        return [ Obj( zip( names, row ) ) for row in cursor ]
+
+    def device_filter (self, kind, device):
+        # device is a unit id or a list of them
+        if device is None:
+            return '', ()
+        if not isinstance(device, (list, tuple)):
+            device = ( device, )
+        return ( ' and hash in ( select hash from sources where kind = ? and device in ( %s ) )' % ', '.join( '?' * len(device) )
+            , ( kind, ) + tuple(device) )
+
+    def sources (self, kind, digest):
+        # the devices a row was synced from
+        return [ row[0] for row in self.db.execute( 'select device from sources where kind = ? and hash = ? order by device'
+            , ( kind, digest ) ) ]
+
+    def runs (self, start = None, end = None, device = None):
+        where, parameters = self.device_filter( 'run', device )
+        return self.query( 'select * from runs where start_time >= ? and start_time < ?%s order by start_time' % where
+            , ( to_seconds(start) or 0, to_seconds(end) or 0xFFFFFFFF ) + parameters )
+
+    def laps (self, start = None, end = None, device = None):
+        where, parameters = self.device_filter( 'lap', device )
+        return self.query( 'select * from laps where start_time >= ? and start_time < ?%s order by start_time' % where
+            , ( to_seconds(start) or 0, to_seconds(end) or 0xFFFFFFFF ) + parameters )
+
+    def tracks (self, start = None, end = None, area = None, kind = 'track', device = None):
+        # area is ( min latitude, max latitude, min longitude, max longitude )
+        # in semicircles, tracks whose bounds intersect it are returned. The
+        # point data is left out, see points().
+        columns = ', '.join( [ name for name in ( 'id', ) + TRACK_COLUMNS if name != 'data' ] )
+        statement = 'select %s from tracks where kind = ? and end_time >= ? and start_time < ?' % columns
+        parameters = ( kind, to_seconds(start) or 0, to_seconds(end) or 0xFFFFFFFF )
+        if area is not None:
+            min_latitude, max_latitude, min_longitude, max_longitude = area
+            statement += ( ' and id in ( select id from track_bounds where min_latitude <= ? and max_latitude >= ?'
+                ' and min_longitude <= ? and max_longitude >= ? )' )
+            parameters += ( max_latitude, min_latitude, max_longitude, min_longitude )
+        where, device_parameters = self.device_filter( kind, device )
+        return self.query( statement + where + ' order by start_time', parameters + device_parameters )
+
+    def run_laps (self, run):
+        # the laps of a run row, by hash: laps of other devices at the same
+        # time are not the run's
+        hashes = ( run.lap_hashes or '' ).split()
+        if not hashes:
+            return []
+        return self.query( 'select * from laps where hash in ( %s ) order by start_time' % ', '.join( '?' * len(hashes) ), hashes )
+
+    def points (self, track_id):
+        row = self.db.execute( 'select data from tracks where id = ?', ( track_id, ) ).fetchone()
+        if row is None:
+            return None
+        return TrackColumns.fromstring( str(row[0]) )
+
+    def courses (self, device = None):
+        where, parameters = self.device_filter( 'course', device )
+        return self.query( 'select * from courses where 1%s order by course_index' % where, parameters )
@@ -0,0 +1,102 @@
+import json, errno, threading, logging
+from garmin.packet  import Packet
+from garmin.command import TransferLaps, TransferRuns, TransferTrackLog
+from garmin.layout  import layout_for
+from garmin.utils   import Obj, write_atomically
+
+log = logging.getLogger('garmin.sync')
+
+# Incremental sync: the device has no request for records newer than a date,
+# every transfer still sends everything. What is already known is skipped by
+# peeking at the raw time of each record before it is decoded, and the
+# watermarks ( newest lap start and track point, as garmin epoch seconds )
+# are only moved once the whole sync succeeded.
+
+class SyncState:
+    # watermarks per device unit id, kept in a json file. Sessions running
+    # on several threads can share one state.
+
+    def __init__ (self, path):
+        self.path = path
+        self.devices = None
+        self.lock = threading.Lock()
+
+    def load (self):
+        if self.devices is not None:
+            return self.devices
+        self.devices = {}
+        try:
+            with open( self.path ) as f:
+                self.devices = json.load( f )
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        except ValueError, ex:
+            # without watermarks the next sync is a full one and rewrites it
+            log.warn('Ignoring corrupt sync state %s: %s', self.path, ex )
+        return self.devices
+
+    def get (self, device_id):
+        return dict( self.load().get( str(device_id), {} ) )
+
+    def update (self, device_id, watermarks):
+        self.lock.acquire()
+        try:
+            self.load()[ str(device_id) ] = watermarks
+            write_atomically( self.path, json.dumps( self.devices, indent = 2, sort_keys = True ) )
+        finally:
+            self.lock.release()
+
+class IncrementalSync:
+
+    def __init__ (self, device, state):
+        self.device = device
+        self.state = state
+
+    def sync (self, columnar = False):
+        dev = self.device
+        watermarks = self.state.get( dev.device_id )
+        latest = dict( watermarks )
+
+        decoders = self.skipping_decoders( Packet.LAP, 'start_time', watermarks.get('lap'), latest, 'lap' )
+        laps = dev.transfer_records( TransferLaps, Packet.LAP, decoders )
+
+        # runs point at their laps, without new laps there is no new run
+        runs = []
+        if laps:
+            first_lap = min( [ lap.index for lap in laps ] )
+            decoders = self.skipping_decoders( Packet.RUN, 'last_lap_index', first_lap - 1 )
+            runs = dev.transfer_records( TransferRuns, Packet.RUN, decoders )
+
+        decoders = self.skipping_decoders( Packet.TRACK_DATA, 'time', watermarks.get('track'), latest, 'track',
+            dev.track_overrides( Packet.TRACK_DATA, columnar ) )
+        data_type = dev.track_data_type(columnar)
+        make_reader = lambda: dev.serial_array_reader( Packet.TRACK_HEADER, Packet.TRACK_DATA, data_type )
+        track_log = dev.execute_transfer( TransferTrackLog, make_reader, ( Packet.TRACK_HEADER, Packet.TRACK_DATA ), decoders = decoders )
+        track_log = [ segment for segment in track_log if len(segment.data) ]
+
+        log.info('Synced %d runs, %d laps, %d track segments', len(runs), len(laps), len(track_log) )
+        self.state.update( dev.device_id, latest )
+        return Obj( runs = runs, laps = laps, track_log = track_log )
+
+    def skipping_decoders (self, packet_id, field, threshold, latest = None, key = None, overrides = None):
+        # a dispatch table where records whose field is at or below threshold
+        # decode to None, the readers drop them. The largest value seen is
+        # kept in latest[key].
+        decoders = dict( self.device.dispatch_table( overrides ) )
+        name, datatype = self.device.plan.get( packet_id, (None, None) )
+        if name in ( None, 'unsupported' ):
+            return decoders
+        peek = layout_for( datatype ).peeker( field )
+        decode = decoders[packet_id]
+        if threshold is None:
+            threshold = -1
+        def skip_known (sr):
+            value = peek( sr.data, sr.index )
+            if value <= threshold:
+                return None
+            if latest is not None and value > latest.get( key, -1 ):
+                latest[key] = value
+            return decode( sr )
+        decoders[packet_id] = skip_known
+        return decoders
@@ -0,0 +1,243 @@
+import struct, random, logging
+from garmin.packet  import Packet
+from garmin.usbio   import Transport, USBException
+from garmin.layout  import D304, D501, D800, D1004, D1007, D1009, D1011, D1013
+
+log = logging.getLogger('garmin.synth')
+
+# Builds realistic packet streams of a Forerunner 305 without a device, for
+# benchmarks and tests. Streams are generated lazily so a million point track
+# log is never held in memory.
+
+MAX_RECORDS = 0xFFFF
+
+PROTOCOLS = [
+    ( 'P', 0 ), ( 'L', 1 ), ( 'A', 10 ), ( 'A', 100 ), ( 'D', 110 )
+    , ( 'A', 201 ), ( 'D', 202 ), ( 'D', 110 ), ( 'D', 210 )
+    , ( 'A', 301 ), ( 'D', 311 ), ( 'D', 304 )
+    , ( 'A', 500 ), ( 'D', 501 ), ( 'A', 600 ), ( 'D', 600 ), ( 'A', 601 )
+    , ( 'A', 800 ), ( 'D', 800 ), ( 'A', 801 ), ( 'A', 902 ), ( 'A', 903 ), ( 'A', 906 ), ( 'D', 1015 )
+    , ( 'A', 1000 ), ( 'D', 1009 ), ( 'A', 1002 ), ( 'D', 1008 )
+    , ( 'A', 1003 ), ( 'D', 1003 ), ( 'A', 1004 ), ( 'D', 1004 )
+    , ( 'A', 1005 ), ( 'D', 1005 ), ( 'A', 1006 ), ( 'D', 1006 )
+    , ( 'A', 1007 ), ( 'D', 1007 ), ( 'A', 1008 ), ( 'D', 1012 )
+    , ( 'A', 1009 ), ( 'D', 1013 )
+]
+
+START_TIME = 600000000 # garmin epoch seconds, 2009-01-04
+
+def packet (packet_id, payload = ''):
+    return Packet.encode( packet_id, payload )
+
+def records (packets, count):
+    yield packet( Packet.RECORDS, struct.pack('<H', count) )
+    for p in packets:
+        yield p
+    yield packet( Packet.TRANSFER_COMPLETE, struct.pack('<H', 0) )
+
+def single (packet_id, payload):
+    return iter([ packet( packet_id, payload ) ])
+
+def product_data (product_id = 484, software_version = 250):
+    payload = struct.pack('<H h', product_id, software_version) + 'Forerunner305 Software Version 2.50\0'
+    return packet( Packet.PRODUCT_DATA, payload )
+
+def protocol_array (protocols = PROTOCOLS):
+    return packet( Packet.PROTOCOL_ARRAY, ''.join( [ struct.pack('<c H', tag, value) for tag, value in protocols ] ) )
+
+def device_description (product_id = 484, software_version = 250, protocols = PROTOCOLS):
+    yield product_data( product_id, software_version )
+    yield packet( Packet.EXTENDED_PRODUCT_DATA, 'SQA_TAG 1\0' )
+    yield protocol_array( protocols )
+
+def track_points (count, start = 0, seed = 0):
+    # random walk at a running pace with one point per second
+    rnd = random.Random( seed + start )
+    latitude, longitude = 545000000, -12000000
+    altitude, distance = 100.0, 0.0
+    heart_rate = 140
+    for i in xrange(count):
+        latitude += rnd.randint(-40, 120)
+        longitude += rnd.randint(-40, 120)
+        altitude += rnd.uniform(-0.5, 0.5)
+        distance += rnd.uniform(2.5, 3.5)
+        heart_rate = max( 90, min( 190, heart_rate + rnd.randint(-2, 2) ) )
+        yield D304.struct.pack( latitude, longitude, START_TIME + start + i, altitude, distance, heart_rate, 88, 0 )
+
+def track_log (points, segment_points = 3600, header_packet_id = Packet.TRACK_HEADER,
+               data_packet_id = Packet.TRACK_DATA, start = 0):
+    segments = (points + segment_points - 1) // segment_points
+    def generate ():
+        for segment in xrange(segments):
+            yield packet( header_packet_id, struct.pack('<H', segment) )
+            size = min( segment_points, points - segment * segment_points )
+            for payload in track_points( size, start + segment * segment_points ):
+                yield packet( data_packet_id, payload )
+    return records( generate(), points + segments )
+
+def laps (count, lap_seconds = 600):
+    def generate ():
+        for i in xrange(count):
+            payload = D1011.struct.pack( i, START_TIME + i * lap_seconds, lap_seconds * 100, 1609.3, 4.2
+                , 545000000, -12000000, 545010000, -11990000, 110, 150, 172, 0, 88, 0 )
+            yield packet( Packet.LAP, payload + '\0' * 4 )
+    return records( generate(), count )
+
+def runs (count, laps_per_run = 5):
+    empty_step = ( '', 0.0, 0.0, 0, 0, 0, 0, 0 )
+    workout = ( 0, ) + empty_step * 20 + ( '', 0 )
+    def generate ():
+        for i in xrange(count):
+            values = ( i, i * laps_per_run, (i + 1) * laps_per_run - 1, 0, 0, 0, 0, 0.0 ) + workout
+            yield packet( Packet.RUN, D1009.struct.pack( *values ) )
+    return records( generate(), count )
+
+def course_laps (count):
+    def generate ():
+        for i in xrange(count):
+            payload = D1007.struct.pack( i // 4, i, 60000, 1000.0, 545000000, -12000000, 545010000, -11990000, 150, 172, 0, 88 )
+            yield packet( Packet.COURSE_LAP, payload )
+    return records( generate(), count )
+
+def almanac (count = 32):
+    def generate ():
+        for i in xrange(count):
+            yield packet( Packet.ALMANAC_DATA, D501.struct.pack( 1500, 61440.0, 1e-5, 1e-11, 0.01, 5153.6, 1.2, 0.9, -2.1, -8e-9, 0.95, 0 ) )
+    return records( generate(), count )
+
+def date_time ():
+    # month, day, year, hour, minute, second
+    return single( Packet.DATE_TIME, struct.pack('<2B 2H 2B', 1, 4, 2009, 12, 0, 0) )
+
+def fitness_profile ():
+    # no zones, only the weight and birthdate after the three activities
+    size = D1004.struct.size - 9
+    return single( Packet.FITNESS_USER_PROFILE, '\0' * size + struct.pack('<f H 3B', 70.0, 1980, 6, 15, 1) )
+
+def course_limits ():
+    return single( Packet.COURSE_LIMITS, D1013.struct.pack( 100, 1000, 100, 10000 ) )
+
+def position_fixes (seed = 0):
+    # fixes without end, as sent after StartPVTDownload until StopPVTDownload
+    rnd = random.Random( seed )
+    latitude, longitude = 0.9512, -0.2094
+    time_of_week = 345600.0
+    while True:
+        latitude += rnd.uniform(-1e-7, 3e-7)
+        longitude += rnd.uniform(-1e-7, 3e-7)
+        time_of_week += 1.0
+        payload = D800.struct.pack( 48.5 + rnd.uniform(-0.5, 0.5), 4.2, 3.1, 2.9, 3, time_of_week
+            , latitude, longitude, 2.1, 2.4, 0.0, -47.6, 15, 7300 )
+        yield packet( Packet.PVT_DATA, payload )
+
+def points_per_transfer (segment_points = 3600):
+    return MAX_RECORDS - MAX_RECORDS // segment_points - 1
+
+def track_log_transfers (points, segment_points = 3600, **kwargs):
+    # a transfer holds at most MAX_RECORDS records, bigger logs are split
+    per_transfer = points_per_transfer( segment_points )
+    start = 0
+    while start < points:
+        size = min( per_transfer, points - start )
+        yield track_log( size, segment_points, start = start, **kwargs )
+        start += size
+
+class SyntheticTransport (Transport):
+    # answers the commands of a Forerunner session with synthetic streams
+
+    # commands of the GarminUSB.py session without synthetic data get empty
+    # transfers
+    COMMANDS = {
+        1:      lambda self: almanac( self.almanac )
+        , 5:    lambda self: date_time()
+        , 6:    lambda self: self.next_track_log()
+        , 117:  lambda self: laps( self.laps )
+        , 450:  lambda self: runs( self.runs )
+        , 451:  lambda self: records( iter([]), 0 )
+        , 452:  lambda self: records( iter([]), 0 )
+        , 453:  lambda self: fitness_profile()
+        , 561:  lambda self: records( iter([]), 0 )
+        , 562:  lambda self: course_laps( self.course_laps )
+        , 563:  lambda self: records( iter([]), 0 )
+        , 564:  lambda self: track_log( self.course_points, self.segment_points, Packet.COURSE_TRACK_HEADER, Packet.COURSE_TRACK_DATA )
+        , 565:  lambda self: course_limits()
+        , 49:   lambda self: position_fixes()
+        , 50:   lambda self: iter([])
+    }
+
+    def __init__ (self, track_points = 10000, segment_points = 3600, laps = 100, runs = 20,
+                  course_laps = 40, course_points = 2000, almanac = 32, unit_id = 3456789012, bulk = False):
+        self.track_points = track_points
+        self.track_transfers = iter([])
+        self.segment_points = segment_points
+        self.laps = laps
+        self.runs = runs
+        self.course_laps = course_laps
+        self.course_points = course_points
+        self.almanac = almanac
+        self.unit_id = unit_id
+        self.pending = iter([])
+        self.opened = False
+        # with bulk, answers are announced by DATA_AVAILABLE and read from
+        # bulk in as one byte stream
+        self.bulk = bulk
+        self.announce = False
+        self.chunk = ''
+
+    @staticmethod
+    def from_options (options):
+        # the defaults, a device to try the command line without one
+        return SyntheticTransport()
+
+    def next_track_log (self):
+        # a log too big for one transfer is served over successive commands
+        try:
+            return self.track_transfers.next()
+        except StopIteration:
+            self.track_transfers = track_log_transfers( self.track_points, self.segment_points )
+            return self.track_transfers.next()
+
+    def is_open (self):
+        return self.opened
+
+    def open (self):
+        self.opened = True
+
+    def close (self):
+        self.opened = False
+
+    def read_interrupt (self, size, timeout):
+        if self.announce:
+            self.announce = False
+            return Packet.encode_usb( Packet.DATA_AVAILABLE )
+        try:
+            return self.pending.next()
+        except StopIteration:
+            raise USBException, 'Synthetic timeout: no pending response'
+
+    def read_bulk (self, size, timeout):
+        if not self.bulk:
+            return self.read_interrupt( size, timeout )
+        chunk = self.chunk
+        while len(chunk) < size:
+            try:
+                chunk += self.pending.next()
+            except StopIteration:
+                break
+        self.chunk = chunk[size:]
+        return chunk[:size]
+
+    def write_bulk (self, data, timeout):
+        protocol, packet_id = struct.unpack_from('<B 3x H', data)
+        if protocol == 0 and packet_id == Packet.START_SESSION:
+            self.pending = iter([ Packet.encode_usb( Packet.SESSION_STARTED, struct.pack('<L', self.unit_id) ) ])
+        elif packet_id == 254:
+            self.pending = device_description()
+            self.announce = self.bulk
+        else:
+            command = struct.unpack_from('<H', data, 12)[0]
+            if command not in self.COMMANDS:
+                raise USBException, 'Synthetic device does not answer command %d' % command
+            self.pending = self.COMMANDS[command](self)
+            self.announce = self.bulk
+        return len(data)
@@ -0,0 +1,234 @@
+import os, time, json, thread, threading, logging
+from garmin.packet import Packet
+from garmin.utils  import Obj, write_atomically
+
+log = logging.getLogger('garmin.trace')
+
+# Opt-in instrumentation of a device session. attach() shadows the packet
+# methods of one device ( and the reads of its transport ) with timing
+# wrappers set on the instance, detach() removes them: a device that was
+# never attached runs the plain class methods and pays nothing.
+#
+# Every call becomes an event ( name, category, start, duration, thread,
+# args ) that write_chrome_trace() saves in the Chrome trace event format,
+# for chrome://tracing or Perfetto. Categories:
+#   usb       transport reads and writes, on the pump thread when pipelined
+#   read      read_packet straight from the transport
+#   queue     read_packet waiting on the packet pump
+#   decode    decoding a packet, per packet name and datatype
+#   transfer  execute_reader, stream_reader and resumed transfers, named
+#             after the last command sent
+#
+# With a packet pump the transport is read on the pump thread while the
+# caller reads packets, the counters and events are updated under a lock.
+
+PACKET_NAMES = dict( [ ( value, name ) for name, value in vars(Packet).items()
+    if name.isupper() and isinstance(value, int) ] )
+
+def packet_name (packet_id):
+    return PACKET_NAMES.get( packet_id, '%04X' % packet_id )
+
+class Tracer:
+
+    def __init__ (self, events = True):
+        # without events only the counters are kept
+        self.keep_events = events
+        self.events = []
+        self.threads = {}
+        self.attached = []
+        self.started = None
+        self.command = None
+        self.lock = threading.Lock()
+        self.counters = dict(
+            packets_read = 0
+            , bytes_read = 0
+            , packets_written = 0
+            , bytes_written = 0
+            , usb_reads = 0
+            , usb_bytes = 0
+        )
+        self.seconds = dict( usb = 0.0, read = 0.0, queue = 0.0, decode = 0.0, transfer = 0.0 )
+        # name.datatype : [ packets, seconds ]
+        self.decoding = {}
+
+    def count (self, **amounts):
+        with self.lock:
+            counters = self.counters
+            for name, amount in amounts.items():
+                counters[name] += amount
+
+    def event (self, name, category, start, end, args = None):
+        tid = thread.get_ident()
+        with self.lock:
+            self.seconds[category] += end - start
+            if not self.keep_events:
+                return
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            self.events.append( ( name, category, start, end - start, tid, args ) )
+
+    def transfer (self, start, packets):
+        # packets is packets_read when the transfer started
+        self.event( self.command or 'transfer', 'transfer', start, time.time()
+            , { 'packets': self.counters['packets_read'] - packets } )
+
+    def wrap (self, target, name, wrapper):
+        setattr( target, name, wrapper( getattr(target, name) ) )
+        self.attached.append( ( target, name ) )
+
+    def attach (self, device):
+        if self.started is None:
+            self.started = time.time()
+        clock = time.time
+
+        def send_command (send):
+            def traced (command):
+                # a command class or an instance of one
+                self.command = getattr( command, '__name__', None ) or command.__class__.__name__
+                return send( command )
+            return traced
+
+        def write_packet (write):
+            def traced (packet):
+                start = clock()
+                result = write( packet )
+                self.count( packets_written = 1, bytes_written = len(packet) )
+                self.event( 'write_packet', 'usb', start, clock(), { 'bytes': len(packet) } )
+                return result
+            return traced
+
+        def read_packet (read):
+            def traced ():
+                queued = device.pump is not None
+                start = clock()
+                packet = read()
+                self.count( packets_read = 1, bytes_read = len(packet) )
+                self.event( packet_name( packet.id ), queued and 'queue' or 'read', start, clock(), { 'bytes': len(packet) } )
+                return packet
+            return traced
+
+        def decode (decode):
+            def traced (packet, decoders = None):
+                start = clock()
+                result = decode( packet, decoders )
+                end = clock()
+                datatype = device.plan.get( packet.id, ( None, None ) )[1]
+                key = datatype is None and packet_name( packet.id ) or '%s.%s' % ( packet_name( packet.id ), datatype )
+                with self.lock:
+                    stats = self.decoding.get( key, None )
+                    if stats is None:
+                        stats = self.decoding[key] = [ 0, 0.0 ]
+                    stats[0] += 1
+                    stats[1] += end - start
+                self.event( key, 'decode', start, end )
+                return result
+            return traced
+
+        def execute_reader (execute):
+            def traced (reader, overrides = None, decoders = None):
+                start = clock()
+                packets = self.counters['packets_read']
+                try:
+                    return execute( reader, overrides, decoders )
+                finally:
+                    self.transfer( start, packets )
+            return traced
+
+        def stream_reader (stream):
+            def traced (make_reader, overrides = None, decoders = None):
+                items = stream( make_reader, overrides, decoders )
+                def generate ():
+                    # from the first record asked for until the stream ends
+                    # or is closed
+                    start = clock()
+                    packets = self.counters['packets_read']
+                    try:
+                        for item in items:
+                            yield item
+                    finally:
+                        self.transfer( start, packets )
+                return generate()
+            return traced
+
+        def execute_transfer (execute):
+            def traced (command, make_reader, expected, overrides = None, decoders = None):
+                # without retries the transfer runs execute_reader, traced above
+                if device.retries <= 0:
+                    return execute( command, make_reader, expected, overrides, decoders )
+                start = clock()
+                packets = self.counters['packets_read']
+                try:
+                    return execute( command, make_reader, expected, overrides, decoders )
+                finally:
+                    self.transfer( start, packets )
+            return traced
+
+        def usb_read (name):
+            def wrapper (read):
+                def traced (size, timeout):
+                    start = clock()
+                    data = read( size, timeout )
+                    self.count( usb_reads = 1, usb_bytes = len(data) )
+                    self.event( name, 'usb', start, clock(), { 'bytes': len(data) } )
+                    return data
+                return traced
+            return wrapper
+
+        self.wrap( device, 'send_command', send_command )
+        self.wrap( device, 'write_packet', write_packet )
+        self.wrap( device, 'read_packet', read_packet )
+        self.wrap( device, 'decode', decode )
+        self.wrap( device, 'execute_reader', execute_reader )
+        self.wrap( device, 'stream_reader', stream_reader )
+        self.wrap( device, 'execute_transfer', execute_transfer )
+        self.wrap( device.transport, 'read_interrupt', usb_read('read_interrupt') )
+        self.wrap( device.transport, 'read_bulk', usb_read('read_bulk') )
+        return device
+
+    def detach (self):
+        for target, name in reversed(self.attached):
+            try:
+                delattr( target, name )
+            except AttributeError:
+                pass
+        self.attached = []
+
+    def summary (self):
+        seconds = self.started is not None and time.time() - self.started or 0.0
+        counters = self.counters
+        result = Obj( counters )
+        result.seconds = seconds
+        result.packets_per_second = seconds and counters['packets_read'] / seconds or 0.0
+        result.bytes_per_second = seconds and counters['bytes_read'] / seconds or 0.0
+        for category, spent in self.seconds.items():
+            result['%s_seconds' % category] = spent
+        # microseconds per decoded packet
+        result.decode_us = dict( [ ( key, packets and spent * 1e6 / packets or 0.0 )
+            for key, (packets, spent) in self.decoding.items() ] )
+        return result
+
+    def log_summary (self):
+        s = self.summary()
+        log.info('%d packets, %d bytes in %.2fs: %.0f packets/s, %.0f bytes/s'
+            , s.packets_read, s.bytes_read, s.seconds, s.packets_per_second, s.bytes_per_second )
+        log.info('usb %.3fs, waiting on the pump %.3fs, reading %.3fs, decoding %.3fs'
+            , s.usb_seconds, s.queue_seconds, s.read_seconds, s.decode_seconds )
+        for key, micros in sorted( s.decode_us.items() ):
+            log.info('  decode %-24s %8.2f us x %d', key, micros, self.decoding[key][0] )
+
+    def chrome_trace (self):
+        pid = os.getpid()
+        events = []
+        for tid, name in self.threads.items():
+            events.append( dict( name = 'thread_name', ph = 'M', pid = pid, tid = tid, args = dict( name = name ) ) )
+        for name, category, start, duration, tid, args in self.events:
+            event = dict( name = name, cat = category, ph = 'X', pid = pid, tid = tid
+                , ts = ( start - self.started ) * 1e6, dur = duration * 1e6 )
+            if args is not None:
+                event['args'] = args
+            events.append( event )
+        return dict( traceEvents = events, displayTimeUnit = 'ms', otherData = dict( self.summary() ) )
+
+    def write_chrome_trace (self, path):
+        write_atomically( path, json.dumps( self.chrome_trace() ) )
+        log.info('Wrote %d trace events to %s', len(self.events), path )
@@ -0,0 +1,68 @@
+import logging
+
+log = logging.getLogger('garmin.transports')
+
+# Transports by name, their module is only imported when one is asked for:
+# an offline worker decoding captures never loads pyusb. Other packages add
+# transports under the GROUP entry point group, e.g. in their setup.py
+#   entry_points = { 'garmin.transports': [ 'serial = garmin_serial:SerialTransport' ] }
+#
+# Constructors differ from one transport to the next, make_transport() passes
+# its arguments through. open_transport() opens one by name from the command
+# line options instead: it calls from_options( options ) on what was loaded,
+# a transport without it cannot be given by name. The options a transport can
+# use are vendor_id, product_id, replay and record ( capture paths or None ).
+
+GROUP = 'garmin.transports'
+
+BUILTIN = {
+    'pyusb':        'garmin.usbio:PyUSBTransport'
+    , 'replay':     'garmin.capture:ReplayTransport'
+    , 'record':     'garmin.capture:RecordingTransport'
+    , 'synthetic':  'garmin.synth:SyntheticTransport'
+}
+
+class TransportException (Exception): pass
+
+loaded = {}
+
+def import_object (spec):
+    module_name, name = spec.split(':')
+    module = __import__( module_name, {}, {}, [ name ] )
+    return getattr( module, name )
+
+def entry_points ():
+    # pkg_resources is slow to import, it is only looked at for names that
+    # are not builtin
+    try:
+        import pkg_resources
+    except ImportError:
+        return {}
+    return dict( [ ( entry_point.name, entry_point ) for entry_point in pkg_resources.iter_entry_points( GROUP ) ] )
+
+def load_transport (name):
+    transport = loaded.get( name, None )
+    if transport is not None:
+        return transport
+    if name in BUILTIN:
+        transport = import_object( BUILTIN[name] )
+    else:
+        entry_point = entry_points().get( name, None )
+        if entry_point is None:
+            raise TransportException, 'Unknown transport %s, known are: %s' % ( name, ', '.join( transport_names() ) )
+        log.debug('Loading transport %s from %s', name, entry_point )
+        transport = entry_point.load()
+    loaded[name] = transport
+    return transport
+
+def make_transport (name, *args, **kwargs):
+    return load_transport( name )( *args, **kwargs )
+
+def open_transport (name, options):
+    factory = getattr( load_transport( name ), 'from_options', None )
+    if factory is None:
+        raise TransportException, 'Transport %s has no from_options( options ), it cannot be opened by name' % name
+    return factory( options )
+
+def transport_names ():
+    return sorted( set( BUILTIN.keys() + entry_points().keys() ) )
@@ -1,38 +1,78 @@
-import usb, array
+import array, logging
 
 from garmin.packet import *
+from garmin.pipeline import PacketPump
+
+log = logging.getLogger('garmin.usbio')
 
 class USBException(Exception): pass
 
-class GarminUSB:
-    MAX_PACKET_SIZE = 1024
-    BULK_TIMEOUT    = 3000
-    INTR_TIMEOUT    = 3000
+class Transport:
+    # moves raw bytes between the host and a device, GarminUSB frames them
+    # into packets
+
+    def is_open (self):
+        raise NotImplementedError
+
+    def open (self):
+        raise NotImplementedError
+
+    def close (self):
+        raise NotImplementedError
 
-    def __init__ (self, vendor_id, product_id ):
+    def read_interrupt (self, size, timeout):
+        raise NotImplementedError
+
+    def read_bulk (self, size, timeout):
+        raise NotImplementedError
+
+    def write_bulk (self, data, timeout):
+        raise NotImplementedError
+
+def find_devices (vendor_id, product_id):
+    # every matching device on every bus
+    import usb
+    devices = []
+    for bus in usb.busses():
+        for device in bus.devices:
+            if device.idVendor == vendor_id and device.idProduct == product_id:
+                devices.append( ( bus.dirname, device ) )
+    return devices
+
+class PyUSBTransport (Transport):
+    # pyusb is imported when a device is looked for or opened, decoding and
+    # replaying captures work without it
+
+    # without a device, the first one matching vendor_id and product_id is
+    # opened
+    def __init__ (self, vendor_id, product_id, device = None, name = None ):
         self.vendor_id = vendor_id
         self.product_id = product_id
-        self.device = None
+        self.device = device
+        self.bound = device is not None
+        self.name = name
         self.handle = None
         self.bulk_in = None
         self.bulk_out = None
         self.interrupt_in = None
 
+    @staticmethod
+    def from_options (options):
+        return PyUSBTransport( options.vendor_id, options.product_id )
+
     def is_open (self):
         return self.handle is not None
 
     def open (self):
         if self.is_open():
             return
-        for bus in usb.busses():
-            for device in bus.devices:
-                if device.idVendor == self.vendor_id and device.idProduct == self.product_id:
-                    self.device = device
-                    break
-
         if self.device is None:
-            raise USBException, 'Device not found'
+            devices = find_devices( self.vendor_id, self.product_id )
+            if not devices:
+                raise USBException, 'Device not found'
+            self.device = devices[0][1]
 
+        import usb
         interface = self.device.configurations[0].interfaces[0][0]
         for endpoint in interface.endpoints:
             address = endpoint.address & usb.ENDPOINT_ADDRESS_MASK
@@ -54,15 +94,120 @@ class GarminUSB:
             self.handle.reset()
             del self.handle
             self.handle = None
-        if self.device is not None:
+        if self.device is not None and not self.bound:
             del self.device
             self.device = None
 
+    def read_interrupt (self, size, timeout):
+        return self.handle.interruptRead( self.interrupt_in, size, timeout )
+
+    def read_bulk (self, size, timeout):
+        return self.handle.bulkRead( self.bulk_in, size, timeout )
+
+    def write_bulk (self, data, timeout):
+        return self.handle.bulkWrite( self.bulk_out, data, timeout )
+
+class GarminUSB:
+    MAX_PACKET_SIZE = 1024
+    BULK_READ_SIZE  = 16384
+    BULK_TIMEOUT    = 3000
+    INTR_TIMEOUT    = 3000
+
+    def __init__ (self, vendor_id, product_id, transport = None ):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.transport = transport or PyUSBTransport( vendor_id, product_id )
+        self.pipeline_size = 0
+        self.pump = None
+        self.stream = PacketStream()
+        self.bulk = False
+        self.bulk_timeout = GarminUSB.BULK_TIMEOUT
+        self.intr_timeout = GarminUSB.INTR_TIMEOUT
+
+    def set_timeouts (self, bulk_timeout, intr_timeout):
+        # milliseconds, a slow dock needs more than the defaults
+        self.bulk_timeout = bulk_timeout
+        self.intr_timeout = intr_timeout
+
+    def set_pipeline (self, size = 256):
+        # with a pipeline, the packets following RECORDS are read ahead on a
+        # background thread, at most size packets ahead of the caller
+        self.pipeline_size = size
+
+    def is_open (self):
+        return self.transport.is_open()
+
+    def open (self):
+        self.transport.open()
+
+    def close (self):
+        self.stop_pump()
+        self.transport.close()
+        self.reset_stream()
+
+    def reset_stream (self):
+        # drops what is left of a transfer: buffered bytes and the bulk state
+        if self.stream.pending() > 0:
+            log.debug('Discarding %d buffered bytes', self.stream.pending() )
+        self.stream = PacketStream()
+        self.bulk = False
+
+    def abandon_transfer (self):
+        # the rest of an abandoned bulk transfer is still queued on the
+        # device, it is read and dropped up to the zero length read ending it
+        if self.bulk:
+            try:
+                while len( self.transport.read_bulk( GarminUSB.BULK_READ_SIZE, self.bulk_timeout ) ) > 0:
+                    pass
+            except ( USBException, IOError ), ex:
+                log.debug('Draining the bulk pipe failed: %s', ex )
+        self.reset_stream()
+
     def read_packet (self):
+        if self.pump is not None:
+            try:
+                return self.pump.get()
+            finally:
+                if self.pump.finished:
+                    self.stop_pump()
+        packet = self.receive_packet()
+        if packet.id == Packet.RECORDS and self.pipeline_size > 0:
+            self.pump = PacketPump( self.receive_packet, self.pipeline_size )
+            self.pump.start()
+        return packet
+
+    def receive_packet (self):
+        # the device announces queued data with DATA_AVAILABLE on the
+        # interrupt pipe, it is then read from bulk in until a zero length read
         self.open()
-        bytes = self.handle.interruptRead( self.interrupt_in, GarminUSB.MAX_PACKET_SIZE, GarminUSB.INTR_TIMEOUT )
-        return Packet( array.array('B', bytes) )
+        while True:
+            packet = self.stream.next_packet()
+            if packet is not None:
+                if packet.protocol == 0 and packet.id == Packet.DATA_AVAILABLE:
+                    self.bulk = True
+                    continue
+                return packet
+            if self.bulk:
+                bytes = self.transport.read_bulk( GarminUSB.BULK_READ_SIZE, self.bulk_timeout )
+                if len(bytes) == 0:
+                    self.bulk = False
+                    continue
+            else:
+                bytes = self.transport.read_interrupt( GarminUSB.MAX_PACKET_SIZE, self.intr_timeout )
+            self.stream.feed( bytes )
+
+    def stop_pump (self):
+        if self.pump is not None:
+            self.pump.stop()
+            self.pump = None
 
     def write_packet (self,packet):
         self.open()
-        return self.handle.bulkWrite( self.bulk_out, packet, GarminUSB.BULK_TIMEOUT )
+        # a transfer abandoned by the caller must not read ahead any longer,
+        # nor leave its bytes to the response of this packet. After a
+        # complete transfer bulk stays set, the zero length read ending it
+        # is still to come.
+        if self.pump is not None or self.stream.pending() > 0:
+            self.stop_pump()
+            self.abandon_transfer()
+        return self.transport.write_bulk( packet, self.bulk_timeout )
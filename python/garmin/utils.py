@@ -1,4 +1,4 @@
-import struct, logging, datetime, string
+import os, struct, logging, datetime, string
 log = logging.getLogger('garmin.utils')
 
 class UTC (datetime.tzinfo):
@@ -16,34 +16,67 @@ ASCII_FILTER = ''.join( [ chr(i) in ( '[]()/+-. ' + string.digits + string.ascii
 class StructReaderException (Exception): pass
 
 class StructReader:
+    STRUCTS = {}
 
-    def __init__ (self, data, endianness='='):
+    # reads data[offset:end] in place, indexes are absolute in data
+    def __init__ (self, data, endianness='=', offset = 0, end = None):
         self.data = data
-        self.index = 0
+        self.index = offset
+        self.start = offset
+        self.end = end is None and len(data) or end
         self.endianness = endianness
 
-    def read (self, format):
+    def compiled (self, format):
         if format[0] not in '=<>@':
             format = self.endianness + format
-        size = struct.calcsize( format )
-        result = struct.unpack_from( format, self.data, self.index )
-        self.index += size
+        compiled = StructReader.STRUCTS.get( format, None )
+        if compiled is None:
+            compiled = StructReader.STRUCTS[format] = struct.Struct( format )
+        return compiled
+
+    def read (self, format):
+        compiled = self.compiled( format )
+        result = compiled.unpack_from( self.data, self.index )
+        self.index += compiled.size
         if len(result) == 1:
             return result[0]
         else:
             return result
 
+    def find_zero (self):
+        if isinstance(self.data, (str, bytearray)):
+            end = self.data.find( '\0', self.index, self.end )
+            if end < 0:
+                return self.end
+            return end
+        data = bytearray( self.data[self.index:self.end] )
+        end = data.find( '\0' )
+        if end < 0:
+            return self.end
+        return self.index + end
+
+    def substring (self, start, end):
+        # data[start:end] as a str, copied once
+        data = self.data
+        if isinstance(data, str):
+            return data[start:end]
+        if isinstance(data, bytearray):
+            return str( buffer( data, start, end - start ) )
+        if isinstance(data, memoryview):
+            return data[start:end].tobytes()
+        return str( bytearray( data[start:end] ) )
+
     def read_string (self):
-        end = self.index
-        for i in xrange( len(self.data) - self.index ):
-            if 0 == self.data[end]:
-                break
-            else:
-                end += 1
-        result = self.data[self.index:end].tostring()
+        end = self.find_zero()
+        result = self.substring( self.index, end )
         self.index = end + 1 # skip the final zero
         return result.translate(ASCII_FILTER).strip()
 
+    def read_raw (self):
+        result = self.substring( self.index, self.end )
+        self.index = self.end
+        return result
+
     def read_fixed_string (self,length):
         return self.read('%ds'%length).split('\0')[0].translate(ASCII_FILTER).strip()
 
@@ -60,16 +93,19 @@ class StructReader:
         return self.read('2l')
 
     def eof(self):
-        return self.index >= len(self.data)
+        return self.index >= self.end
 
     def size (self):
-        return len(self.data) - self.index
+        return self.end - self.index
 
     def __len__(self):
-        return len(self.data)
+        return self.end - self.start
 
 class Obj (dict):
     def __getattr__(self, attribute_name ):
+        # special names are looked up by pickle and copy, they are not keys
+        if attribute_name.startswith('__'):
+            raise AttributeError, attribute_name
         return self.__getitem__(attribute_name)
     def __setattr__(self, attribute_name, value ):
         return self.__setitem__(attribute_name,value)
@@ -77,14 +113,92 @@ class Obj (dict):
 def objectify (keys,values):
     return Obj(zip(keys,values))
 
+class Record (object):
+    # base of the fixed field records built by record_type, reads like an Obj
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__ (self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError, name
+
+    def __setitem__ (self, name, value):
+        setattr(self, name, value)
+
+    def __contains__ (self, name):
+        return name in self._fields
+
+    def __iter__ (self):
+        return iter(self._fields)
+
+    def __len__ (self):
+        return len(self._fields)
+
+    def get (self, name, default = None):
+        return getattr(self, name, default)
+
+    def keys (self):
+        return list(self._fields)
+
+    def values (self):
+        return [ getattr(self, name) for name in self._fields ]
+
+    def items (self):
+        return [ (name, getattr(self, name)) for name in self._fields ]
+
+    def __eq__ (self, other):
+        if not isinstance(other, Record):
+            return False
+        return self._fields == other._fields and self.values() == other.values()
+
+    def __ne__ (self, other):
+        return not self == other
+
+    def __reduce__ (self):
+        return self.__class__, tuple(self.values())
+
+    def __repr__ (self):
+        fields = ', '.join( [ '%s=%r' % item for item in self.items() ] )
+        return '%s(%s)' % ( self.__class__.__name__, fields )
+
+def record_type (name, fields, module = None):
+    # the generated __init__ assigns every slot without a loop
+    body = ''.join( [ '    self.%s = %s\n' % (field, field) for field in fields ] ) or '    pass\n'
+    source = 'def __init__ (self, %s):\n%s' % ( ', '.join(fields), body )
+    namespace = {}
+    exec source in namespace
+    attributes = { '__slots__': tuple(fields), '_fields': tuple(fields), '__init__': namespace['__init__'], '__module__': module or __name__ }
+    return type( name, (Record,), attributes )
+
 FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
 
 def hexdump (data,length=16):
     result = []
+    data = bytearray(data)
     for i in xrange(0, len(data), length):
         chunck = data[i:i+length]
         padding = length - len(chunck)
         hexa =  ' '.join( map( lambda x: '%02X' % x, chunck ) ) + '   ' * padding
-        ascii = chunck.tostring().translate(FILTER)+ ' ' * padding
+        ascii = str(chunck).translate(FILTER)+ ' ' * padding
         result.append('%04X: %s |%s|' % (i, hexa, ascii) )
     return '\n'+'\n'.join(result)
+
+def write_atomically (path, data):
+    # written aside then renamed, readers never see half a file. tempfile
+    # pulls in random, decoding workers that never write do not need it
+    import tempfile
+    directory = os.path.dirname( os.path.abspath(path) )
+    if not os.path.isdir( directory ):
+        os.makedirs( directory )
+    fd, temporary = tempfile.mkstemp( dir = directory, prefix = '.' + os.path.basename(path) + '-' )
+    f = os.fdopen( fd, 'wb' )
+    try:
+        f.write( data )
+        f.close()
+        os.rename( temporary, path )
+    except:
+        f.close()
+        os.unlink( temporary )
+        raise
@@ -0,0 +1,4 @@
+import logging
+
+# the library logs warnings the tests provoke on purpose
+logging.getLogger('garmin').addHandler( logging.NullHandler() )
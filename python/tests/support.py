@@ -0,0 +1,43 @@
+import shutil, tempfile, unittest
+from garmin.device import Forerunner
+from garmin.synth  import SyntheticTransport
+from garmin.usbio  import USBException
+
+# helpers shared by the test modules: a started session over any transport,
+# a synthetic device timing out on chosen interrupt reads and a scratch directory
+
+def session (transport):
+    dev = Forerunner( transport )
+    dev.start_session()
+    dev.get_device_capabilities()
+    return dev
+
+def points (track_log):
+    return [ ( segment.header, list(segment.data) ) for segment in track_log ]
+
+class FlakyTransport (SyntheticTransport):
+    # read n counts from the last reset(), the session setup is not counted
+
+    def __init__ (self, fail_at = (), **kwargs):
+        SyntheticTransport.__init__( self, **kwargs )
+        self.fail_at = list(fail_at)
+        self.reads = 0
+
+    def reset (self, fail_at):
+        self.fail_at = list(fail_at)
+        self.reads = 0
+
+    def read_interrupt (self, size, timeout):
+        self.reads += 1
+        if self.fail_at and self.reads == self.fail_at[0]:
+            self.fail_at.pop(0)
+            raise USBException, 'Synthetic timeout on read %d' % self.reads
+        return SyntheticTransport.read_interrupt( self, size, timeout )
+
+class TemporaryDirectoryTest (unittest.TestCase):
+
+    def setUp (self):
+        self.directory = tempfile.mkdtemp( prefix = 'garmin-test-' )
+
+    def tearDown (self):
+        shutil.rmtree( self.directory )
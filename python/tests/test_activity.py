@@ -0,0 +1,68 @@
+import unittest
+from garmin.activity import ActivityIndex, lap_end
+from garmin.store    import to_seconds
+from garmin.synth    import SyntheticTransport, START_TIME
+from tests.support   import session
+
+class ActivityIndexTest (unittest.TestCase):
+
+    # 20 runs of 5 laps of 600 seconds, 10000 points a second apart in
+    # segments 0, 1 and 2 of 3600 points: runs 0 to 2 have their segment by
+    # index, the others are found by time
+
+    def setUp (self):
+        dev = session( SyntheticTransport( track_points = 10000 ) )
+        self.runs, self.laps, self.track_log = dev.get_runs()
+        self.index = ActivityIndex( self.runs, self.laps, self.track_log )
+
+    def expected_lap_points (self, activity, position):
+        # the points of the activity segments during the lap, point by point
+        lap = activity.laps[position]
+        start = to_seconds( lap.start_time )
+        if position + 1 < len(activity.laps):
+            end = to_seconds( activity.laps[position + 1].start_time )
+        else:
+            end = lap_end( lap ) + 1
+        result = []
+        for segment in activity.segments:
+            points = [ point for point in segment.data if start <= to_seconds( point.time ) < end ]
+            if points:
+                result.append( points )
+        return result
+
+    def test_activities (self):
+        self.assertEqual( len(self.index), 20 )
+        for position, activity in enumerate( self.index ):
+            self.assertTrue( activity.run is self.runs[position] )
+            self.assertEqual( [ lap.index for lap in activity.laps ], range( position * 5, position * 5 + 5 ) )
+        self.assertTrue( self.index[3] is self.index.activity(3) )
+
+    def test_segments (self):
+        self.assertEqual( [ [ segment.header for segment in self.index[i].segments ] for i in range(5) ]
+            , [ [ 0 ], [ 1 ], [ 2 ], [ 2 ], [] ] )
+        between = lambda start, end: [ segment.header for segment in self.index.segments_between( START_TIME + start, START_TIME + end ) ]
+        self.assertEqual( between( 7000, 7500 ), [ 1, 2 ] )
+        self.assertEqual( between( 0, 10000 ), [ 0, 1, 2 ] )
+        self.assertEqual( between( 10000, 20000 ), [] )
+
+    def test_lap_points (self):
+        for activity in self.index:
+            for position in range( len(activity.laps) ):
+                self.assertEqual( activity.lap_points( position ), self.expected_lap_points( activity, position ) )
+
+    def test_columnar (self):
+        dev = session( SyntheticTransport( track_points = 10000 ) )
+        index = ActivityIndex( self.runs, self.laps, dev.get_track_log( True ) )
+        for activity, columnar in zip( self.index, index ):
+            for position in range( len(activity.laps) ):
+                self.assertEqual( [ len(points) for points in columnar.lap_points( position ) ]
+                    , [ len(points) for points in activity.lap_points( position ) ] )
+
+    def test_lap_at (self):
+        self.assertEqual( self.index.lap_at( START_TIME + 650 ).index, 1 )
+        self.assertEqual( self.index.lap_at( self.laps[7].start_time ).index, 7 )
+        self.assertEqual( self.index.lap_at( START_TIME - 1 ), None )
+        self.assertEqual( self.index.lap_at( START_TIME + 100 * 600 + 10 ), None )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import time, unittest
+from garmin.aio    import AsyncForerunner, CallTimeout, CallCancelled, loop_future
+from garmin.synth  import SyntheticTransport
+from garmin.usbio  import USBException
+from tests.support import session, points
+
+class StallingTransport (SyntheticTransport):
+    # while stalled, reads wait for their timeout and fail like a device
+    # that does not answer
+
+    def __init__ (self, **kwargs):
+        SyntheticTransport.__init__( self, **kwargs )
+        self.stall_after = None
+        self.reads = 0
+
+    def read_interrupt (self, size, timeout):
+        self.reads += 1
+        if self.stall_after is not None and self.reads > self.stall_after:
+            time.sleep( timeout / 1000.0 )
+            raise USBException, 'Synthetic timeout after %d ms' % timeout
+        return SyntheticTransport.read_interrupt( self, size, timeout )
+
+    def stall (self, reads = 0):
+        self.stall_after = self.reads + reads
+
+class Future:
+    # what loop_future needs of an asyncio future
+
+    def __init__ (self):
+        self.callbacks = []
+        self.value = self.error = None
+
+    def cancelled (self):
+        return False
+
+    def set_result (self, value):
+        self.value = value
+
+    def set_exception (self, error):
+        self.error = error
+
+    def add_done_callback (self, callback):
+        self.callbacks.append( callback )
+
+class Loop:
+
+    def __init__ (self):
+        self.ready = []
+
+    def create_future (self):
+        return Future()
+
+    def call_soon_threadsafe (self, callback, *args):
+        self.ready.append( ( callback, args ) )
+
+    def run_ready (self):
+        for callback, args in self.ready:
+            callback( *args )
+
+class AsyncForerunnerTest (unittest.TestCase):
+
+    def setUp (self):
+        self.transport = StallingTransport( track_points = 8000, laps = 30 )
+        self.dev = AsyncForerunner( self.transport )
+        self.dev.start_session( timeout = 5 ).result()
+        self.dev.get_device_capabilities( timeout = 5 ).result()
+        self.expected = session( SyntheticTransport( track_points = 8000, laps = 30 ) )
+
+    def tearDown (self):
+        self.dev.close().result()
+        self.dev.shutdown()
+
+    def test_calls (self):
+        self.assertEqual( self.dev.get_laps( timeout = 5 ).result(), self.expected.get_laps() )
+        self.assertEqual( points( self.dev.get_track_log().result() ), points( self.expected.get_track_log() ) )
+        runs, laps, track_log = self.dev.get_runs( timeout = 5 ).result()
+        self.assertEqual( len(laps), 30 )
+
+    def test_iteration (self):
+        self.assertEqual( list( self.dev.iter_laps( timeout = 5 ) ), self.expected.get_laps() )
+        self.assertEqual( points( self.dev.iter_track_log() ), points( self.expected.get_track_log() ) )
+        self.assertEqual( len( self.dev.iter_laps().all().result() ), 30 )
+
+    def test_stream_holds_the_device (self):
+        track_log = self.dev.iter_track_log()
+        first = track_log.next()
+        laps = self.dev.get_laps()
+        time.sleep( 0.1 )
+        self.assertFalse( laps.done() )
+        self.assertEqual( points( [ first ] + list(track_log) ), points( self.expected.get_track_log() ) )
+        self.assertEqual( len( laps.result( 5 ) ), 30 )
+
+    def test_single_packet_timeout (self):
+        self.transport.stall()
+        started = time.time()
+        self.assertRaises( CallTimeout, self.dev.start_session( timeout = 0.2 ).result, 5 )
+        self.assertTrue( time.time() - started < 2 )
+        self.assertFalse( self.transport.is_open() )
+        self.transport.stall_after = None
+        self.dev.start_session().result( 5 )
+        self.dev.get_device_capabilities().result( 5 )
+        self.assertEqual( len( self.dev.get_laps().result( 5 ) ), 30 )
+
+    def test_transfer_timeout (self):
+        self.transport.stall( 10 )
+        self.assertRaises( CallTimeout, self.dev.get_laps( timeout = 0.2 ).result, 5 )
+
+    def test_stream_timeout (self):
+        # the first segment is read whole, the second one stalls
+        track_log = self.dev.iter_track_log( timeout = 0.2 )
+        track_log.next()
+        self.transport.stall()
+        self.assertRaises( CallTimeout, list, track_log )
+        self.transport.stall_after = None
+        self.dev.start_session().result( 5 )
+        self.assertEqual( len( self.dev.get_laps().result( 5 ) ), 30 )
+
+    def test_cancel (self):
+        self.transport.stall()
+        call = self.dev.get_track_log()
+        pending = self.dev.get_laps()
+        self.assertTrue( pending.cancel() )
+        self.assertRaises( CallCancelled, pending.result, 5 )
+        self.assertTrue( pending.cancelled() )
+        call.cancel()
+
+    def test_loop_future (self):
+        loop = Loop()
+        future = loop_future( self.dev.get_laps( timeout = 5 ), loop )
+        laps = loop_future( self.dev.iter_laps().next_call(), loop )
+        self.dev.call( lambda: None ).result( 5 )
+        loop.run_ready()
+        self.assertEqual( len(future.value), 30 )
+        self.assertEqual( laps.value.index, 0 )
+
+if __name__ == '__main__':
+    unittest.main()
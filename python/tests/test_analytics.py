@@ -0,0 +1,88 @@
+import math, unittest
+from garmin.columnar import TrackColumns, INVALID_POSITION
+from garmin.layout   import HEART_RATE_ZONE
+from garmin.synth    import SyntheticTransport
+from tests.support   import session
+from garmin          import analytics
+
+# one degree of latitude in semicircles
+DEGREE = 2 ** 31 // 180
+
+def columns (rows):
+    # ( latitude, longitude, time, altitude, heart_rate )
+    result = TrackColumns()
+    for latitude, longitude, time, altitude, heart_rate in rows:
+        result.append( ( latitude, longitude, time, altitude, 0.0, heart_rate, 0, 0 ) )
+    return result
+
+def haversine (a, b):
+    scale = math.pi / 2 ** 31
+    latitude1, longitude1, latitude2, longitude2 = [ value * scale for value in a + b ]
+    h = math.sin( ( latitude2 - latitude1 ) / 2 ) ** 2 \
+        + math.cos( latitude1 ) * math.cos( latitude2 ) * math.sin( ( longitude2 - longitude1 ) / 2 ) ** 2
+    return 2 * analytics.EARTH_RADIUS * math.asin( math.sqrt( h ) )
+
+@unittest.skipIf( analytics.numpy is None, 'numpy is not installed' )
+class TrackAnalysisTest (unittest.TestCase):
+
+    def setUp (self):
+        # 4 moving seconds, a 98 seconds pause and a point without a fix
+        self.track = analytics.TrackAnalysis( columns( [
+            ( 0, 0, 1000, 100.0, 120 )
+            , ( 100, 0, 1001, 101.0, 130 )
+            , ( 200, 0, 1002, 103.0, 150 )
+            , ( 300, 0, 1100, 102.0, 160 )
+            , ( 400, 0, 1101, 100.0, 170 )
+            , ( INVALID_POSITION, INVALID_POSITION, 1102, 100.0, 0 )
+        ] ) )
+
+    def test_degrees (self):
+        self.assertEqual( list( analytics.degrees( [ 0, 2 ** 30, -2 ** 31 ] ) ), [ 0.0, 90.0, -180.0 ] )
+
+    def test_haversine (self):
+        distances = analytics.haversine( [ 0, DEGREE, INVALID_POSITION ], [ 0, 0, INVALID_POSITION ] )
+        self.assertAlmostEqual( distances[0], haversine( ( 0, 0 ), ( DEGREE, 0 ) ), 6 )
+        self.assertAlmostEqual( distances[0], 111195, -1 )
+        self.assertTrue( math.isnan( distances[1] ) )
+
+    def test_moving (self):
+        self.assertEqual( len(self.track), 6 )
+        self.assertEqual( self.track.moving_time(), 4 )
+        speeds = self.track.speeds()
+        step = haversine( ( 0, 0 ), ( 100, 0 ) )
+        self.assertAlmostEqual( speeds[0], step )
+        self.assertTrue( math.isnan( speeds[2] ) )
+        self.assertTrue( math.isnan( speeds[4] ) )
+        self.assertAlmostEqual( self.track.paces()[0], 1000.0 / step )
+
+    def test_summary (self):
+        summary = self.track.summary()
+        step = haversine( ( 0, 0 ), ( 100, 0 ) )
+        self.assertEqual( summary.duration, 102 )
+        self.assertEqual( summary.moving_time, 4 )
+        self.assertAlmostEqual( summary.distance, 4 * step )
+        # the pause covers a step that is not in the average speed
+        self.assertAlmostEqual( summary.average_speed, 3 * step / 4 )
+        self.assertEqual( summary.maximum_heart_rate, 170 )
+        self.assertAlmostEqual( summary.average_heart_rate, 146 )
+
+    def test_elevation (self):
+        gain, loss = self.track.elevation_change( 1 )
+        self.assertEqual( ( gain, loss ), ( 3.0, 3.0 ) )
+        self.assertEqual( len( self.track.elevation( 3 ) ), 4 )
+
+    def test_heart_rate_zones (self):
+        zones = [ HEART_RATE_ZONE.record( 100, 139 ), HEART_RATE_ZONE.record( 140, 200 ) ]
+        self.assertEqual( list( self.track.heart_rate_zones( zones ) ), [ 2, 2 ] )
+
+    def test_track_log (self):
+        dev = session( SyntheticTransport( track_points = 500 ) )
+        data = dev.get_track_log()[0].data
+        track = analytics.TrackAnalysis( data )
+        positions = [ point.position for point in data ]
+        expected = sum( [ haversine( a, b ) for a, b in zip( positions, positions[1:] ) ] )
+        self.assertAlmostEqual( track.distance(), expected, 3 )
+        self.assertEqual( track.summary().duration, 499 )
+
+if __name__ == '__main__':
+    unittest.main()
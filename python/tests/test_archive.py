@@ -0,0 +1,75 @@
+import array, os, random, unittest
+from garmin.archive  import encode_deltas, decode_deltas, encode_column, decode_column, shuffle, unshuffle, \
+    ArchiveWriter, ArchiveReader
+from garmin.columnar import TrackColumns
+from garmin.synth    import SyntheticTransport, START_TIME
+from garmin.utils    import Obj
+from tests.support   import session, TemporaryDirectoryTest
+
+class CodecTest (unittest.TestCase):
+
+    def round_trip (self, values, typecode = 'l'):
+        self.assertEqual( decode_deltas( encode_deltas( values ), typecode ), array.array( typecode, values ) )
+
+    def test_zigzag (self):
+        # a delta d is stored as 2d, -d as 2d - 1
+        self.assertEqual( encode_deltas( [ 0 ] ), '\x00' )
+        self.assertEqual( encode_deltas( [ -1 ] ), '\x01' )
+        self.assertEqual( encode_deltas( [ 1 ] ), '\x02' )
+        self.assertEqual( encode_deltas( [ 63 ] ), '\x7e' )
+        self.assertEqual( encode_deltas( [ -64 ] ), '\x7f' )
+        self.assertEqual( encode_deltas( [ 64 ] ), '\x80\x01' )
+        self.assertEqual( encode_deltas( [ 5, 5, 4 ] ), '\x0a\x00\x01' )
+
+    def test_round_trip (self):
+        self.round_trip( [] )
+        self.round_trip( [ 0, 63, 64, -64, -65, 0 ] )
+        self.round_trip( [ 2 ** 31 - 1, -2 ** 31, 0 ] )
+        self.round_trip( [ START_TIME + i for i in xrange(1000) ], 'L' )
+
+    def test_random_walk (self):
+        rnd = random.Random( 305 )
+        values = []
+        value = 545000000
+        for i in xrange(5000):
+            value += rnd.randint( -100000, 100000 )
+            values.append( value )
+        self.round_trip( values )
+
+    def test_shuffle (self):
+        values = array.array( 'f', [ i * 0.5 for i in xrange(100) ] )
+        data = values.tostring()
+        self.assertEqual( unshuffle( shuffle( data, values.itemsize ), values.itemsize ), data )
+
+    def test_columns (self):
+        values = array.array( 'l', [ 545000000 + i * 17 for i in xrange(100) ] )
+        for encoding in ( 'delta', 'shuffle', None ):
+            self.assertEqual( decode_column( encode_column( values, encoding ), 'l', encoding ), values )
+
+class ArchiveTest (TemporaryDirectoryTest):
+
+    def test_round_trip (self):
+        dev = session( SyntheticTransport( track_points = 8000, laps = 12 ) )
+        track_log = dev.get_track_log()
+        laps = dev.get_laps()
+        path = os.path.join( self.directory, 'track.archive' )
+        writer = ArchiveWriter( path )
+        writer.add_track_log( track_log )
+        writer.add_segment( Obj( header = 9, data = [] ) )
+        writer.add_laps( laps )
+        writer.close()
+
+        reader = ArchiveReader( path )
+        try:
+            self.assertEqual( len(reader), len(track_log) )
+            for i, segment in enumerate(track_log):
+                self.assertEqual( reader.segment(i).header, segment.header )
+                self.assertEqual( reader.segment(i).data.tostring(), TrackColumns.from_points( segment.data ).tostring() )
+            self.assertEqual( reader.laps(), laps )
+            last = reader.segment( len(reader) - 1 ).data
+            self.assertEqual( [ s.header for s in reader.segments( start = last.time[0] ) ], [ track_log[-1].header ] )
+        finally:
+            reader.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os, unittest
+from garmin.batch    import BatchDecoder
+from garmin.capture  import RecordingTransport
+from garmin.columnar import TrackColumns
+from garmin.synth    import SyntheticTransport
+from tests.support   import session, points, TemporaryDirectoryTest
+
+def columns (track_log):
+    return [ ( segment.header, TrackColumns.from_points( segment.data ).tostring() ) for segment in track_log ]
+
+class BatchTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.paths = []
+        self.expected = []
+        for i, track_points in enumerate( ( 8000, 3000 ) ):
+            path = os.path.join( self.directory, 'session-%d.cap' % i )
+            transport = SyntheticTransport( track_points = track_points, laps = 30 + i, runs = 6, unit_id = 1000 + i )
+            dev = session( RecordingTransport( transport, path ) )
+            runs, laps, track_log = dev.get_runs()
+            course_tracks = dev.get_course_tracks()
+            dev.close()
+            self.paths.append( path )
+            self.expected.append( ( dev.device_id, runs, laps, track_log, course_tracks ) )
+
+    def check (self, sessions, columnar):
+        self.assertEqual( [ session.path for session in sessions ], self.paths )
+        for session, ( device_id, runs, laps, track_log, course_tracks ) in zip( sessions, self.expected ):
+            self.assertEqual( session.device_id, device_id )
+            self.assertEqual( session.runs, runs )
+            self.assertEqual( session.laps, laps )
+            if columnar:
+                self.assertEqual( columns( session.track_log ), columns( track_log ) )
+                self.assertEqual( columns( session.course_tracks ), columns( course_tracks ) )
+            else:
+                self.assertEqual( points( session.track_log ), points( track_log ) )
+                self.assertEqual( points( session.course_tracks ), points( course_tracks ) )
+
+    def test_in_process (self):
+        self.check( list( BatchDecoder( 0, columnar = False ).sessions( self.paths ) ), False )
+        self.check( list( BatchDecoder( 0 ).sessions( self.paths ) ), True )
+
+    def test_pool (self):
+        self.check( list( BatchDecoder( 2, columnar = False ).sessions( self.paths ) ), False )
+        self.check( list( BatchDecoder( 1, chunksize = 3 ).sessions( self.paths ) ), True )
+
+    def test_early_stop (self):
+        sessions = BatchDecoder( 2 ).sessions( self.paths )
+        self.assertEqual( sessions.next().path, self.paths[0] )
+        sessions.close()
+
+if __name__ == '__main__':
+    unittest.main()
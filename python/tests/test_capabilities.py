@@ -0,0 +1,68 @@
+import os, unittest
+from garmin              import capabilities
+from garmin.capabilities import CapabilityCache
+from garmin.device       import Forerunner
+from garmin.packet       import Packet
+from garmin.synth        import SyntheticTransport
+from tests.support       import TemporaryDirectoryTest
+
+class CapabilityCacheTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.path = os.path.join( self.directory, 'capabilities' )
+
+    def session (self, cache = None):
+        dev = Forerunner( SyntheticTransport() )
+        dev.set_capability_cache( cache )
+        dev.start_session()
+        dev.get_device_capabilities()
+        return dev
+
+    def test_round_trip (self):
+        expected = self.session()
+        dev = self.session( CapabilityCache( self.path ) )
+        self.assertEqual( dev.plan, expected.plan )
+        entry = CapabilityCache( self.path ).load()[ (484, 250) ]
+        self.assertEqual( entry['plan'], expected.plan )
+        self.assertEqual( dev.get_laps(), expected.get_laps() )
+
+    def test_cached_plan_is_used (self):
+        self.session( CapabilityCache( self.path ) )
+        cache = CapabilityCache( self.path )
+        entry = cache.load()[ (484, 250) ]
+        plan = dict( entry['plan'] )
+        del plan[Packet.LAP]
+        cache.put( 484, 250, entry['digest'], entry['protocols'], plan )
+        dev = self.session( CapabilityCache( self.path ) )
+        self.assertFalse( Packet.LAP in dev.plan )
+
+    def test_changed_capabilities (self):
+        self.session( CapabilityCache( self.path ) )
+        cache = CapabilityCache( self.path )
+        entry = cache.load()[ (484, 250) ]
+        cache.put( 484, 250, 'other digest', entry['protocols'], {} )
+        dev = self.session( CapabilityCache( self.path ) )
+        self.assertTrue( Packet.LAP in dev.plan )
+        self.assertEqual( CapabilityCache( self.path ).load()[ (484, 250) ]['digest'], entry['digest'] )
+
+    def test_digest (self):
+        self.assertNotEqual( capabilities.digest( 'raw', capabilities.fingerprint( { 1: 'a' } ) )
+            , capabilities.digest( 'raw', capabilities.fingerprint( { 1: 'b' } ) ) )
+
+    def test_corrupt (self):
+        open( self.path, 'wb' ).write( 'not a pickle' )
+        self.assertEqual( CapabilityCache( self.path ).load(), {} )
+        self.assertEqual( self.session( CapabilityCache( self.path ) ).get_laps()[0].index, 0 )
+
+    def test_writable_by_others (self):
+        self.session( CapabilityCache( self.path ) )
+        os.chmod( self.path, 0666 )
+        self.assertEqual( CapabilityCache( self.path ).load(), {} )
+
+    def test_private_file (self):
+        self.session( CapabilityCache( self.path ) )
+        self.assertEqual( os.stat( self.path ).st_mode & 0077, 0 )
+
+if __name__ == '__main__':
+    unittest.main()
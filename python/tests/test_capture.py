@@ -0,0 +1,38 @@
+import os, unittest
+from garmin.capture import RecordingTransport, ReplayTransport, CaptureReader, WRITE
+from garmin.synth   import SyntheticTransport
+from garmin.usbio   import USBException
+from tests.support  import session, points, TemporaryDirectoryTest
+
+class CaptureTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.path = os.path.join( self.directory, 'session.cap' )
+        dev = session( RecordingTransport( SyntheticTransport( track_points = 5000, laps = 12 ), self.path ) )
+        self.laps = dev.get_laps()
+        self.track_log = dev.get_track_log()
+        dev.close()
+        self.device_id = dev.device_id
+
+    def test_index (self):
+        capture = CaptureReader( self.path )
+        try:
+            self.assertEqual( len(capture), len(capture.index) )
+            # start session, description, laps and track log
+            self.assertEqual( len( [ kind for kind, offset, length in capture.index if kind == WRITE ] ), 4 )
+        finally:
+            capture.close()
+
+    def test_replay (self):
+        dev = session( ReplayTransport( self.path ) )
+        self.assertEqual( dev.device_id, self.device_id )
+        self.assertEqual( points( dev.get_track_log() ), points( self.track_log ) )
+        self.assertEqual( dev.get_laps(), self.laps )
+
+    def test_unrecorded_command (self):
+        dev = session( ReplayTransport( self.path ) )
+        self.assertRaises( USBException, dev.get_almanac )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import calendar, unittest
+from garmin.columnar import TrackColumns, INVALID_POSITION
+from garmin.synth    import SyntheticTransport
+from tests.support   import session
+
+class TrackColumnsTest (unittest.TestCase):
+
+    def setUp (self):
+        self.dev = session( SyntheticTransport( track_points = 5000 ) )
+        self.track_log = self.dev.get_track_log()
+
+    def test_session (self):
+        columnar = self.dev.get_track_log( True )
+        self.assertEqual( [ segment.header for segment in columnar ], [ segment.header for segment in self.track_log ] )
+        for segment, expected in zip( columnar, self.track_log ):
+            self.assertTrue( isinstance( segment.data, TrackColumns ) )
+            self.assertEqual( len(segment.data), len(expected.data) )
+            self.assertEqual( segment.data.tostring(), TrackColumns.from_points( expected.data ).tostring() )
+
+    def test_columns (self):
+        points = self.track_log[0].data
+        columns = TrackColumns.from_points( points )
+        self.assertTrue( TrackColumns.from_points( columns ) is columns )
+        self.assertEqual( list(columns.latitude), [ point.position[0] for point in points ] )
+        self.assertEqual( list(columns.heart_rate), [ point.heart_rate for point in points ] )
+        self.assertEqual( [ name for name, values in columns.columns() ], [ name for name, typecode in TrackColumns.COLUMNS ] )
+
+    def test_fromstring (self):
+        columns = TrackColumns.from_points( self.track_log[0].data )
+        copy = TrackColumns.fromstring( columns.tostring() )
+        self.assertEqual( len(copy), len(columns) )
+        self.assertEqual( copy.columns(), columns.columns() )
+
+    def test_slice (self):
+        points = self.track_log[0].data
+        columns = TrackColumns.from_points( points ).slice( 100, 250 )
+        self.assertEqual( columns.tostring(), TrackColumns.from_points( points[100:250] ).tostring() )
+
+    def test_bounds (self):
+        points = self.track_log[0].data
+        columns = TrackColumns.from_points( points )
+        latitudes = [ point.position[0] for point in points ]
+        longitudes = [ point.position[1] for point in points ]
+        expected = min(latitudes), max(latitudes), min(longitudes), max(longitudes)
+        self.assertEqual( columns.bounds(), expected )
+        columns.append( ( INVALID_POSITION, INVALID_POSITION, 0, 0.0, 0.0, 0, 0, 0 ) )
+        self.assertEqual( columns.bounds(), expected )
+        self.assertEqual( TrackColumns().bounds(), None )
+
+    def test_epoch_seconds (self):
+        points = self.track_log[0].data[:10]
+        self.assertEqual( list( TrackColumns.from_points( points ).epoch_seconds() )
+            , [ calendar.timegm( point.time.utctimetuple() ) for point in points ] )
+
+if __name__ == '__main__':
+    unittest.main()
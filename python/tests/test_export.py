@@ -0,0 +1,87 @@
+import os, unittest
+from StringIO        import StringIO
+from xml.dom         import minidom
+from garmin.columnar import TrackColumns
+from garmin.export   import write_gpx, write_tcx, export_run, export_track, export_store
+from garmin.store    import ActivityStore
+from garmin.synth    import SyntheticTransport
+from garmin.utils    import Obj
+from tests.support   import session, TemporaryDirectoryTest
+
+def elements (xml, name):
+    return minidom.parseString( xml ).getElementsByTagName( name )
+
+class ExportTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.dev = session( SyntheticTransport( track_points = 8000, laps = 20, runs = 4 ) )
+        self.runs, self.laps, self.track_log = self.dev.get_runs()
+        self.path = os.path.join( self.directory, 'activities.db' )
+        store = ActivityStore( self.path )
+        store.ingest_laps( 1, self.laps )
+        store.ingest_runs( 1, self.runs, self.laps )
+        store.ingest_track_log( 1, self.track_log )
+        store.close()
+
+    def tcx (self, runs):
+        out = StringIO()
+        write_tcx( out, runs, self.laps, self.track_log )
+        return out.getvalue()
+
+    def test_gpx (self):
+        for columnar in ( False, True ):
+            out = StringIO()
+            write_gpx( out, self.dev.get_track_log( columnar ), 'log' )
+            self.assertEqual( len( elements( out.getvalue(), 'trkseg' ) ), len(self.track_log) )
+            self.assertEqual( len( elements( out.getvalue(), 'trkpt' ) ), 8000 )
+
+    def test_tcx (self):
+        xml = self.tcx( self.runs )
+        self.assertEqual( len( elements( xml, 'Activity' ) ), 4 )
+        self.assertEqual( len( elements( xml, 'Lap' ) ), 20 )
+        # the laps cover the whole track log
+        self.assertEqual( len( elements( xml, 'Trackpoint' ) ), 8000 )
+
+    def test_export_run (self):
+        store = ActivityStore( self.path )
+        try:
+            run = store.runs()[1]
+            path = os.path.join( self.directory, 'run.tcx' )
+            export_run( store, run.id, path )
+            self.assertEqual( open( path ).read(), self.tcx( self.runs[1:2] ) )
+        finally:
+            store.close()
+
+    def test_export_run_only_its_sources (self):
+        # another device's track at the same time is not the run's
+        store = ActivityStore( self.path )
+        try:
+            other = TrackColumns.from_points( self.track_log[0].data )
+            other.altitude = type(other.altitude)( other.altitude.typecode, [ 0.0 ] * len(other) )
+            store.ingest_track_log( 2, [ Obj( header = 0, data = other ) ] )
+            run = store.runs()[0]
+            path = os.path.join( self.directory, 'run.tcx' )
+            export_run( store, run.id, path )
+            self.assertEqual( open( path ).read(), self.tcx( self.runs[0:1] ) )
+        finally:
+            store.close()
+
+    def test_export_track (self):
+        store = ActivityStore( self.path )
+        try:
+            track = store.tracks()[0]
+            path = os.path.join( self.directory, 'track.gpx' )
+            export_track( store, track.id, path )
+            self.assertEqual( len( elements( open( path ).read(), 'trkpt' ) ), track.points )
+        finally:
+            store.close()
+
+    def test_export_store (self):
+        directory = os.path.join( self.directory, 'export' )
+        paths = sorted( export_store( self.path, directory, 1 ) )
+        self.assertEqual( len(paths), len(self.track_log) + len(self.runs) )
+        self.assertEqual( sorted( os.listdir( directory ) ), [ os.path.basename(path) for path in paths ] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from garmin.layout import D304, D501, D1007, D1011
+from garmin.packet import Packet
+from garmin.synth  import SyntheticTransport
+from garmin        import synth
+from tests.support import session
+
+def payloads (stream, packet_id):
+    return [ packet.data[packet.offset:packet.end] for packet in [ Packet( data ) for data in stream ] if packet.id == packet_id ]
+
+class LayoutTest (unittest.TestCase):
+
+    def setUp (self):
+        self.dev = session( SyntheticTransport( track_points = 2000, laps = 10, course_laps = 8, almanac = 4 ) )
+
+    def test_almanac (self):
+        entries = self.dev.get_almanac()
+        expected = [ D501.struct.unpack( data ) for data in payloads( synth.almanac(4), Packet.ALMANAC_DATA ) ]
+        self.assertEqual( [ tuple(entry.values()) for entry in entries ], expected )
+        self.assertEqual( entries[0].week_number, 1500 )
+        self.assertEqual( entries[0].toc, 61440.0 )
+        self.assertEqual( entries[0].health, 0 )
+
+    def test_laps (self):
+        laps = self.dev.get_laps()
+        self.assertEqual( len(laps), 10 )
+        self.assertEqual( laps[3].index, 3 )
+        self.assertEqual( laps[3].begin, ( 545000000, -12000000 ) )
+        for lap, data in zip( laps, payloads( synth.laps(10), Packet.LAP ) ):
+            self.assertEqual( lap, D1011.unpack( data ) )
+        self.assertEqual( ( laps[1].start_time - laps[0].start_time ).seconds, 600 )
+
+    def test_course_laps (self):
+        laps = self.dev.get_course_laps()
+        expected = [ D1007.struct.unpack( data ) for data in payloads( synth.course_laps(8), Packet.COURSE_LAP ) ]
+        self.assertEqual( [ lap.course_index for lap in laps ], [ values[0] for values in expected ] )
+        self.assertEqual( [ lap.total_distance for lap in laps ], [ values[3] for values in expected ] )
+
+    def test_runs (self):
+        runs, laps, tracks = self.dev.get_runs()
+        self.assertEqual( [ ( run.first_lap_index, run.last_lap_index ) for run in runs ][:2], [ (0, 4), (5, 9) ] )
+
+    def test_track_points (self):
+        track_log = self.dev.get_track_log()
+        self.assertEqual( [ len(segment.data) for segment in track_log ], [ 2000 ] )
+        first = D304.unpack( iter( synth.track_points(1) ).next() )
+        self.assertEqual( track_log[0].data[0], first )
+
+if __name__ == '__main__':
+    unittest.main()
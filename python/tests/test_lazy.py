@@ -0,0 +1,35 @@
+import unittest
+from garmin.layout import D304, D1011
+from garmin.synth  import SyntheticTransport
+from garmin        import synth
+from tests.support import session
+
+class LazyRecordTest (unittest.TestCase):
+
+    def test_fields (self):
+        data = iter( synth.track_points(1) ).next()
+        point = D304.unpack( data )
+        lazy = D304.lazy( data )
+        self.assertEqual( lazy.time, point.time )
+        self.assertEqual( lazy.position, point.position )
+        self.assertEqual( lazy.materialize(), point )
+        self.assertEqual( lazy.values(), point.values() )
+
+    def test_offset (self):
+        data = 'xx' + iter( synth.track_points(1) ).next()
+        self.assertEqual( D304.lazy( data, 2 ).materialize(), D304.unpack( data, 2 ) )
+
+    def test_converted_layout (self):
+        # layouts with post processing have no lazy record
+        self.assertEqual( D1011.lazy_record is None, D1011.post is not None )
+
+    def test_session (self):
+        dev = session( SyntheticTransport( track_points = 2000 ) )
+        expected = dev.get_track_log()
+        dev.set_lazy( True )
+        track_log = dev.get_track_log()
+        self.assertEqual( [ [ point.materialize() for point in segment.data ] for segment in track_log ]
+            , [ segment.data for segment in expected ] )
+
+if __name__ == '__main__':
+    unittest.main()
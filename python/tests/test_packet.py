@@ -0,0 +1,91 @@
+import random, unittest
+from garmin.packet import Packet, PacketStream, HEADER
+from garmin.synth  import SyntheticTransport
+from garmin        import synth
+from tests.support import session, points
+
+def split (data, sizes):
+    chunks = []
+    offset = 0
+    for size in sizes:
+        chunks.append( data[offset:offset+size] )
+        offset += size
+    if offset < len(data):
+        chunks.append( data[offset:] )
+    return chunks
+
+class PacketStreamTest (unittest.TestCase):
+
+    def setUp (self):
+        self.packets = list( synth.laps(20) ) + list( synth.almanac(3) )
+        self.data = ''.join( self.packets )
+
+    def read_all (self, chunks):
+        stream = PacketStream()
+        result = []
+        for chunk in chunks:
+            stream.feed( chunk )
+            while True:
+                packet = stream.next_packet()
+                if packet is None:
+                    break
+                result.append( packet.data[packet.offset - HEADER.size:packet.end] )
+        self.assertEqual( stream.pending(), 0 )
+        return result
+
+    def test_whole (self):
+        self.assertEqual( self.read_all( [ self.data ] ), self.packets )
+
+    def test_byte_by_byte (self):
+        self.assertEqual( self.read_all( self.data ), self.packets )
+
+    def test_random_splits (self):
+        rnd = random.Random( 305 )
+        for i in xrange(20):
+            sizes = [ rnd.randint(1, 200) for j in xrange( len(self.data) // 50 ) ]
+            self.assertEqual( self.read_all( split( self.data, sizes ) ), self.packets )
+
+    def test_bytearray_reads (self):
+        chunks = [ bytearray(chunk) for chunk in split( self.data, [ 64 ] * ( len(self.data) // 64 ) ) ]
+        self.assertEqual( self.read_all( chunks ), self.packets )
+
+    def test_incomplete (self):
+        stream = PacketStream()
+        stream.feed( self.packets[0][:-1] )
+        self.assertEqual( stream.next_packet(), None )
+        stream.feed( self.packets[0][-1:] )
+        packet = stream.next_packet()
+        self.assertEqual( packet.id, Packet.RECORDS )
+
+class BulkSessionTest (unittest.TestCase):
+
+    def setUp (self):
+        self.expected = session( SyntheticTransport( track_points = 8000 ) )
+
+    def bulk_session (self):
+        return session( SyntheticTransport( track_points = 8000, bulk = True ) )
+
+    def test_bulk (self):
+        dev = self.bulk_session()
+        self.assertEqual( dev.get_laps(), self.expected.get_laps() )
+        self.assertEqual( points( dev.get_track_log() ), points( self.expected.get_track_log() ) )
+        self.assertEqual( dev.get_almanac(), self.expected.get_almanac() )
+
+    def test_bulk_pipelined (self):
+        dev = self.bulk_session()
+        dev.set_pipeline( 256 )
+        self.assertEqual( points( dev.get_track_log() ), points( self.expected.get_track_log() ) )
+        self.assertEqual( dev.get_laps(), self.expected.get_laps() )
+
+    def test_abandoned_transfer (self):
+        # a transfer left half read does not leak its bytes into the next one
+        for pipeline in ( 0, 256 ):
+            dev = self.bulk_session()
+            dev.set_pipeline( pipeline )
+            for segment in dev.iter_track_log():
+                break
+            self.assertEqual( dev.get_laps(), self.expected.get_laps() )
+            self.assertEqual( points( dev.get_track_log() ), points( self.expected.get_track_log() ) )
+
+if __name__ == '__main__':
+    unittest.main()
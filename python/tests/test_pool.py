@@ -0,0 +1,92 @@
+import threading, time, unittest
+from garmin.pool   import DevicePool
+from garmin.synth  import SyntheticTransport
+
+class SlowTransport (SyntheticTransport):
+
+    def __init__ (self, delay = 0.0005, **kwargs):
+        SyntheticTransport.__init__( self, **kwargs )
+        self.delay = delay
+        self.reads = 0
+
+    def read_interrupt (self, size, timeout):
+        time.sleep( self.delay )
+        self.reads += 1
+        return SyntheticTransport.read_interrupt( self, size, timeout )
+
+class HangingTransport (SlowTransport):
+    # blocks for ever in the laps command, like a wedged device
+
+    def __init__ (self, **kwargs):
+        SlowTransport.__init__( self, **kwargs )
+        self.release = threading.Event()
+
+    def write_bulk (self, data, timeout):
+        if len(data) > 12 and data[12] == '\x75':
+            self.release.wait()
+        return SlowTransport.write_bulk( self, data, timeout )
+
+def laps (dev):
+    return len( dev.get_laps() )
+
+class DevicePoolTest (unittest.TestCase):
+
+    def pool (self, transports, **kwargs):
+        pool = DevicePool( [ ( 'd%d' % i, transport ) for i, transport in enumerate(transports) ], **kwargs )
+        pool.POLL = 0.01
+        pool.ABORT_GRACE = 0.5
+        return pool
+
+    def test_parallel (self):
+        transports = [ SlowTransport( laps = 50, unit_id = i ) for i in xrange(4) ]
+        report = self.pool( transports, workers = 2 ).run( laps )
+        self.assertEqual( report.succeeded, 4 )
+        self.assertEqual( [ ( result.device_id, result.result ) for result in report.results ], [ ( i, 50 ) for i in xrange(4) ] )
+        self.assertTrue( report.bytes > 0 )
+
+    def test_failure (self):
+        def task (dev):
+            if dev.device_id == 1:
+                raise ValueError, 'task failed'
+            return laps( dev )
+        report = self.pool( [ SlowTransport( unit_id = i ) for i in xrange(3) ] ).run( task )
+        self.assertEqual( [ result.ok for result in report.results ], [ True, False, True ] )
+        self.assertTrue( 'task failed' in report.results[1].error )
+
+    def test_timeout_stops_the_session (self):
+        # the aborted session makes no transfer after the timeout, it has
+        # ended when run() returns
+        slow = SlowTransport( delay = 0.01, laps = 1000 )
+        finished = []
+        def task (dev):
+            result = laps( dev )
+            finished.append( dev.device_id )
+            return result
+        report = self.pool( [ slow ], timeout = 0.3 ).run( task )
+        self.assertEqual( report.results[0].error, 'timeout' )
+        reads = slow.reads
+        time.sleep( 0.3 )
+        self.assertEqual( slow.reads, reads )
+        self.assertEqual( finished, [] )
+        self.assertFalse( slow.is_open() )
+
+    def test_queued_session_runs_after_timeout (self):
+        transports = [ SlowTransport( delay = 0.01, laps = 1000 ), SlowTransport( laps = 10, unit_id = 1 ) ]
+        report = self.pool( transports, workers = 1, timeout = 0.5 ).run( laps )
+        self.assertEqual( [ result.error for result in report.results ], [ 'timeout', None ] )
+        self.assertEqual( report.results[1].result, 10 )
+
+    def test_stuck_session_cancels_the_queue (self):
+        hanging = HangingTransport( laps = 10 )
+        try:
+            started = time.time()
+            report = self.pool( [ hanging, SlowTransport( laps = 10, unit_id = 1 ) ], workers = 1, timeout = 0.3 ).run( laps )
+            self.assertTrue( time.time() - started < 5 )
+            # the other session is cancelled, unless it got the worker first
+            self.assertEqual( report.results[0].error, 'timeout' )
+            self.assertTrue( report.results[1].error in ( 'cancelled', None ) )
+        finally:
+            hanging.release.set()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import threading, time, unittest
+from garmin.device import Forerunner
+from garmin.layout import D800
+from garmin.pvt    import FixRing, PVTStream
+from garmin.synth  import SyntheticTransport
+
+def fix_data (i):
+    # every field of fix i holds i, a torn read mixes two fixes
+    return D800.struct.pack( i, i, i, i, i % 0x10000, i, i, i, i, i, i, i, i % 0x8000, i )
+
+class FailingTransport (SyntheticTransport):
+    # raises errors[n] on the nth interrupt read after the reset
+
+    def __init__ (self, **kwargs):
+        SyntheticTransport.__init__( self, **kwargs )
+        self.errors = {}
+        self.reads = 0
+
+    def fail (self, errors):
+        self.errors = errors
+        self.reads = 0
+
+    def read_interrupt (self, size, timeout):
+        self.reads += 1
+        error = self.errors.get( self.reads, None )
+        if error is not None:
+            raise error
+        return SyntheticTransport.read_interrupt( self, size, timeout )
+
+class FixRingTest (unittest.TestCase):
+
+    def test_put_and_fix (self):
+        ring = FixRing( 4 )
+        self.assertEqual( ring.latest(), None )
+        for i in xrange(6):
+            ring.put( 'xx' + fix_data(i), 2 )
+        self.assertEqual( ring.latest().time_of_week, 5 )
+        self.assertEqual( ring.fix(1), None )
+        self.assertEqual( [ ring.fix(i).time_of_week for i in xrange(2, 6) ], [ 2, 3, 4, 5 ] )
+        self.assertEqual( ring.fix(6), None )
+
+    def test_wait (self):
+        ring = FixRing( 4 )
+        self.assertFalse( ring.wait( 0, 0.05 ) )
+        threading.Timer( 0.05, ring.put, ( fix_data(0), ) ).start()
+        self.assertTrue( ring.wait( 0, 5 ) )
+
+    def test_end_wakes_waiters (self):
+        ring = FixRing( 4 )
+        threading.Timer( 0.05, ring.end ).start()
+        self.assertFalse( ring.wait( 0 ) )
+
+    def test_no_torn_reads (self):
+        ring = FixRing( 4 )
+        stop = threading.Event()
+        def write ():
+            i = 0
+            while not stop.is_set():
+                ring.put( fix_data(i) )
+                i += 1
+        writer = threading.Thread( target = write )
+        writer.start()
+        try:
+            deadline = time.time() + 0.5
+            while time.time() < deadline:
+                fix = ring.latest()
+                if fix is not None:
+                    self.assertEqual( fix.altitude, fix.time_of_week )
+                    self.assertEqual( fix.position, ( fix.time_of_week, fix.time_of_week ) )
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_subscriber_behind (self):
+        stream = PVTStream( None, 4 )
+        fixes = stream.fixes( timeout = 0 )
+        for i in xrange(10):
+            stream.ring.put( fix_data(i) )
+        self.assertEqual( [ fix.time_of_week for fix in fixes ], [ 6, 7, 8, 9 ] )
+        self.assertEqual( fixes.dropped, 6 )
+
+class PVTStreamTest (unittest.TestCase):
+
+    def setUp (self):
+        self.transport = FailingTransport()
+        self.dev = Forerunner( self.transport )
+        self.dev.start_session()
+        self.dev.get_device_capabilities()
+        self.stream = PVTStream( self.dev, 64 )
+
+    def tearDown (self):
+        self.stream.stop()
+
+    def test_fixes (self):
+        received = []
+        self.stream.subscribe( received.append )
+        fixes = self.stream.fixes( timeout = 5 )
+        self.stream.start()
+        first, second = fixes.next(), fixes.next()
+        self.assertEqual( second.time_of_week, first.time_of_week + 1 )
+        self.stream.stop()
+        self.assertTrue( len(received) >= 2 )
+        self.assertEqual( received[-1], self.stream.ring.latest() )
+
+    def test_stop_ends_subscriptions (self):
+        fixes = self.stream.fixes()
+        self.stream.start()
+        fixes.next()
+        reader = threading.Thread( target = list, args = ( fixes, ) )
+        reader.daemon = True
+        reader.start()
+        self.stream.stop()
+        reader.join( 5 )
+        self.assertFalse( reader.is_alive() )
+
+    def test_read_timeouts (self):
+        # pyusb read timeouts are IOErrors, the stream goes on
+        self.transport.fail( { 1: IOError( 'timeout' ), 3: IOError( 'timeout' ) } )
+        fixes = self.stream.fixes( timeout = 5 )
+        self.stream.start()
+        self.assertEqual( len( [ fixes.next() for i in xrange(5) ] ), 5 )
+        self.assertTrue( self.stream.thread.is_alive() )
+
+    def test_reader_failure (self):
+        # a subscriber waiting without timeout gets the error
+        self.transport.fail( { 3: ValueError( 'broken' ) } )
+        fixes = self.stream.fixes()
+        self.stream.start()
+        self.assertRaises( ValueError, list, fixes )
+
+if __name__ == '__main__':
+    unittest.main()
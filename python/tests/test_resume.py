@@ -0,0 +1,60 @@
+import struct, unittest
+from garmin.columnar import TrackColumns
+from garmin.packet   import Packet, UnexpectedPacketException
+from garmin.usbio    import USBException
+from tests.support   import session, points, FlakyTransport
+
+class StrayTransport (FlakyTransport):
+    # answers read n with a TRANSFER_COMPLETE, as a stream that lost its place
+
+    def read_interrupt (self, size, timeout):
+        if self.fail_at and self.reads + 1 == self.fail_at[0]:
+            self.reads += 1
+            self.fail_at.pop(0)
+            return Packet.encode_usb( Packet.TRANSFER_COMPLETE, struct.pack('<H', 0) )
+        return FlakyTransport.read_interrupt( self, size, timeout )
+
+class ResumeTest (unittest.TestCase):
+
+    # 20000 points: one transfer of two full segments and a partial one
+
+    def setUp (self):
+        self.expected = points( session( FlakyTransport( track_points = 20000 ) ).get_track_log() )
+
+    def track_log (self, fail_at, retries, columnar = False, transport_class = FlakyTransport):
+        transport = transport_class( track_points = 20000 )
+        dev = session( transport )
+        dev.set_retries( retries )
+        transport.reset( fail_at )
+        return dev.get_track_log( columnar ), dev
+
+    def test_timeout_mid_transfer (self):
+        for fail_at in ( [ 1 ], [ 400 ], [ 5000, 9000 ], [ 20000 ] ):
+            track_log, dev = self.track_log( fail_at, 3 )
+            self.assertEqual( points(track_log), self.expected )
+
+    def test_columnar (self):
+        track_log, dev = self.track_log( [ 5000 ], 3, True )
+        self.assertEqual( [ ( segment.header, segment.data.tostring() ) for segment in track_log ]
+            , [ ( header, TrackColumns.from_points( data ).tostring() ) for header, data in self.expected ] )
+
+    def test_laps_after_resume (self):
+        track_log, dev = self.track_log( [ 5000 ], 3 )
+        self.assertEqual( len( dev.get_laps() ), 100 )
+
+    def test_stray_packet (self):
+        for fail_at in ( [ 400 ], [ 5000, 9000 ] ):
+            track_log, dev = self.track_log( fail_at, 3, transport_class = StrayTransport )
+            self.assertEqual( points(track_log), self.expected )
+
+    def test_stray_packet_without_retries (self):
+        self.assertRaises( UnexpectedPacketException, self.track_log, [ 5000 ], 0, False, StrayTransport )
+
+    def test_without_retries (self):
+        self.assertRaises( USBException, self.track_log, [ 5000 ], 0 )
+
+    def test_gives_up (self):
+        self.assertRaises( USBException, self.track_log, [ 100, 200, 300, 400 ], 2 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os, unittest
+from garmin.store  import ActivityStore
+from garmin.synth  import SyntheticTransport, START_TIME
+from garmin.utils  import Obj
+from tests.support import session, TemporaryDirectoryTest
+
+class ActivityStoreTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.path = os.path.join( self.directory, 'activities.db' )
+        self.store = ActivityStore( self.path )
+        self.dev = session( SyntheticTransport( track_points = 8000, laps = 20, runs = 4 ) )
+        self.runs, self.laps, self.track_log = self.dev.get_runs()
+
+    def tearDown (self):
+        self.store.close()
+        TemporaryDirectoryTest.tearDown( self )
+
+    def ingest (self, device):
+        return ( self.store.ingest_laps( device, self.laps ) + self.store.ingest_runs( device, self.runs, self.laps )
+            + self.store.ingest_track_log( device, self.track_log ) )
+
+    def test_ingest (self):
+        self.assertEqual( self.ingest( 1 ), 20 + 4 + len(self.track_log) )
+        self.assertEqual( len( self.store.laps() ), 20 )
+        self.assertEqual( [ run.first_lap_index for run in self.store.runs() ], [ 0, 5, 10, 15 ] )
+        tracks = self.store.tracks()
+        self.assertEqual( sum( [ track.points for track in tracks ] ), 8000 )
+        self.assertEqual( self.store.points( tracks[0].id ).time[0], START_TIME )
+
+    def test_same_activities_from_another_device (self):
+        self.ingest( 1 )
+        self.assertEqual( self.ingest( 2 ), 0 )
+        run = self.store.runs()[0]
+        self.assertEqual( self.store.sources( 'run', run.hash ), [ 1, 2 ] )
+        self.assertEqual( len( self.store.laps( device = 2 ) ), 20 )
+        self.assertEqual( len( self.store.laps( device = [ 1, 3 ] ) ), 20 )
+        self.assertEqual( self.store.laps( device = 3 ), [] )
+
+    def test_time_range (self):
+        self.ingest( 1 )
+        laps = self.store.laps( START_TIME + 600, START_TIME + 1800 )
+        self.assertEqual( [ lap.lap_index for lap in laps ], [ 1, 2 ] )
+        tracks = self.store.tracks( START_TIME + 7000, START_TIME + 7001 )
+        self.assertEqual( len(tracks), 1 )
+        self.assertTrue( tracks[0].start_time <= START_TIME + 7000 <= tracks[0].end_time )
+
+    def test_area (self):
+        self.ingest( 1 )
+        track = self.store.tracks()[0]
+        area = ( track.min_latitude, track.min_latitude + 1, track.min_longitude, track.max_longitude )
+        self.assertTrue( track.id in [ found.id for found in self.store.tracks( area = area ) ] )
+        self.assertEqual( self.store.tracks( area = ( 0, 1, 0, 1 ) ), [] )
+        self.store.db.execute( 'delete from tracks where id = ?', ( track.id, ) )
+        self.assertFalse( track.id in [ found.id for found in self.store.tracks( area = area ) ] )
+
+    def test_run_laps (self):
+        self.ingest( 1 )
+        run = self.store.runs()[1]
+        self.assertEqual( [ lap.lap_index for lap in self.store.run_laps( run ) ], range(5, 10) )
+        self.assertEqual( run.start_time, START_TIME + 5 * 600 )
+        self.assertEqual( run.end_time, START_TIME + 10 * 600 )
+
+    def test_courses (self):
+        course_tracks = self.dev.get_course_tracks()
+        courses = [ Obj( index = 0, course_name = 'Park' ), Obj( index = 1, course_name = 'Park' ) ]
+        added = self.store.ingest_courses( 1, courses, course_tracks[:1] )
+        self.assertEqual( added, 2 + 1 )
+        self.assertEqual( self.store.ingest_courses( 2, courses, course_tracks[:1] ), 0 )
+        self.assertEqual( [ course.course_index for course in self.store.courses( device = 2 ) ], [ 0, 1 ] )
+
+    def test_reopen (self):
+        self.ingest( 1 )
+        self.store.close()
+        self.store = ActivityStore( self.path )
+        self.assertEqual( self.store.db.execute( 'pragma user_version' ).fetchone()[0], 1 )
+        self.assertEqual( self.ingest( 1 ), 0 )
+        self.assertEqual( len( self.store.tracks( area = ( -2 ** 31, 2 ** 31 - 1, -2 ** 31, 2 ** 31 - 1 ) ) ), len(self.track_log) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from garmin.columnar import TrackColumns
+from garmin.synth    import SyntheticTransport
+from tests.support   import session, points, FlakyTransport
+
+class StreamTest (unittest.TestCase):
+
+    def setUp (self):
+        self.dev = session( SyntheticTransport( track_points = 8000 ) )
+        self.expected = session( SyntheticTransport( track_points = 8000 ) )
+
+    def test_records (self):
+        self.assertEqual( list( self.dev.iter_runs() ), self.expected.get_runs()[0] )
+        self.assertEqual( list( self.dev.iter_laps() ), self.expected.get_laps() )
+
+    def test_track_log (self):
+        self.assertEqual( points( self.dev.iter_track_log() ), points( self.expected.get_track_log() ) )
+
+    def test_columnar (self):
+        segments = list( self.dev.iter_track_log( True ) )
+        self.assertTrue( isinstance( segments[0].data, TrackColumns ) )
+        self.assertEqual( [ ( segment.header, segment.data.tostring() ) for segment in segments ]
+            , [ ( segment.header, TrackColumns.from_points( segment.data ).tostring() ) for segment in self.expected.get_track_log() ] )
+
+    def test_course_tracks (self):
+        self.assertEqual( points( self.dev.iter_course_tracks() ), points( self.expected.get_course_tracks() ) )
+
+    def test_segments_in_order (self):
+        # each segment is emitted once complete, before the transfer ends
+        transport = FlakyTransport( track_points = 8000 )
+        stream = session( transport ).iter_track_log()
+        transport.reset( [] )
+        first = stream.next()
+        self.assertEqual( len(first.data), 3600 )
+        # RECORDS, both headers and the points of the first segment
+        self.assertEqual( transport.reads, 3603 )
+        self.assertEqual( [ segment.header for segment in stream ], [ 1, 2 ] )
+
+if __name__ == '__main__':
+    unittest.main()
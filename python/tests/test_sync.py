@@ -0,0 +1,58 @@
+import json, os, unittest
+from garmin.sync   import SyncState, IncrementalSync
+from garmin.synth  import SyntheticTransport, START_TIME
+from garmin.usbio  import USBException
+from tests.support import session, FlakyTransport, TemporaryDirectoryTest
+
+class IncrementalSyncTest (TemporaryDirectoryTest):
+
+    def setUp (self):
+        TemporaryDirectoryTest.setUp( self )
+        self.path = os.path.join( self.directory, 'sync.json' )
+        self.transport = SyntheticTransport( track_points = 5000, laps = 20, runs = 4 )
+        self.dev = session( self.transport )
+
+    def sync (self, columnar = False):
+        return IncrementalSync( self.dev, SyncState( self.path ) ).sync( columnar )
+
+    def test_full_then_nothing (self):
+        result = self.sync()
+        self.assertEqual( len(result.laps), 20 )
+        self.assertEqual( len(result.runs), 4 )
+        self.assertEqual( sum( [ len(segment.data) for segment in result.track_log ] ), 5000 )
+        watermarks = SyncState( self.path ).get( self.dev.device_id )
+        self.assertEqual( watermarks, dict( lap = START_TIME + 19 * 600, track = START_TIME + 4999 ) )
+
+        result = self.sync()
+        self.assertEqual( ( result.runs, result.laps, result.track_log ), ( [], [], [] ) )
+        self.assertEqual( SyncState( self.path ).get( self.dev.device_id ), watermarks )
+
+    def test_new_records (self):
+        self.sync()
+        self.transport.laps = 25
+        self.transport.runs = 5
+        self.transport.track_points = 5500
+        result = self.sync( True )
+        self.assertEqual( [ lap.index for lap in result.laps ], range(20, 25) )
+        self.assertEqual( [ run.first_lap_index for run in result.runs ], [ 20 ] )
+        self.assertEqual( sum( [ len(segment.data) for segment in result.track_log ] ), 500 )
+        self.assertEqual( result.track_log[0].data.time[0], START_TIME + 5000 )
+        self.assertEqual( SyncState( self.path ).get( self.dev.device_id ), dict( lap = START_TIME + 24 * 600, track = START_TIME + 5499 ) )
+
+    def test_corrupt_state (self):
+        open( self.path, 'w' ).write( '{ "3456789012": ' )
+        result = self.sync()
+        self.assertEqual( len(result.laps), 20 )
+        self.assertEqual( json.load( open( self.path ) ).keys(), [ str(self.dev.device_id) ] )
+
+    def test_failed_sync_keeps_watermarks (self):
+        transport = FlakyTransport( track_points = 5000, laps = 20, runs = 4 )
+        self.dev = session( transport )
+        self.sync()
+        transport.laps = 25
+        transport.reset( [ 100 ] )
+        self.assertRaises( USBException, self.sync )
+        self.assertEqual( SyncState( self.path ).get( self.dev.device_id )['lap'], START_TIME + 19 * 600 )
+
+if __name__ == '__main__':
+    unittest.main()
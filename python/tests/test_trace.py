@@ -0,0 +1,86 @@
+import sys, threading, unittest
+from garmin.synth   import SyntheticTransport
+from garmin.trace   import Tracer
+from tests.support  import session, FlakyTransport
+
+class ConstantTransport (SyntheticTransport):
+    # the same bytes on every read once constant is set
+
+    constant = False
+
+    def read_interrupt (self, size, timeout):
+        if self.constant:
+            return 'x' * 12
+        return SyntheticTransport.read_interrupt( self, size, timeout )
+
+class TracerTest (unittest.TestCase):
+
+    def traced (self, transport, retries = 0, pipeline = 0):
+        dev = session( transport )
+        dev.set_retries( retries )
+        dev.set_pipeline( pipeline )
+        tracer = Tracer()
+        tracer.attach( dev )
+        return dev, tracer
+
+    def transfers (self, tracer):
+        return [ ( name, args['packets'] ) for name, category, start, duration, tid, args in tracer.events
+            if category == 'transfer' ]
+
+    def test_transfer (self):
+        dev, tracer = self.traced( SyntheticTransport( track_points = 5000 ) )
+        dev.get_track_log()
+        # RECORDS, 5000 points, 2 headers and TRANSFER_COMPLETE
+        self.assertEqual( self.transfers( tracer ), [ ( 'TransferTrackLog', 5004 ) ] )
+        self.assertEqual( tracer.counters['packets_read'], 5004 )
+
+    def test_stream (self):
+        dev, tracer = self.traced( SyntheticTransport( laps = 30 ) )
+        self.assertEqual( len( list( dev.iter_laps() ) ), 30 )
+        self.assertEqual( self.transfers( tracer ), [ ( 'TransferLaps', 32 ) ] )
+
+    def test_stream_closed (self):
+        dev, tracer = self.traced( SyntheticTransport( track_points = 5000 ) )
+        stream = dev.iter_track_log()
+        stream.next()
+        stream.close()
+        self.assertEqual( [ name for name, packets in self.transfers( tracer ) ], [ 'TransferTrackLog' ] )
+
+    def test_resumed (self):
+        transport = FlakyTransport( track_points = 5000 )
+        dev, tracer = self.traced( transport, retries = 3 )
+        transport.reset( [ 1000 ] )
+        dev.get_track_log()
+        # one event for the whole transfer: the first attempt read 999
+        # packets and starting the session again one
+        self.assertEqual( self.transfers( tracer ), [ ( 'TransferTrackLog', 5004 + 999 + 1 ) ] )
+
+    def test_pipelined (self):
+        dev, tracer = self.traced( SyntheticTransport( track_points = 5000 ), pipeline = 64 )
+        dev.get_track_log()
+        self.assertEqual( tracer.counters['packets_read'], 5004 )
+        self.assertEqual( tracer.counters['usb_reads'], 5004 )
+        self.assertEqual( len( [ event for event in tracer.events if event[1] == 'usb' and event[0] != 'write_packet' ] ), 5004 )
+
+    def test_counters_across_threads (self):
+        dev, tracer = self.traced( ConstantTransport() )
+        dev.transport.constant = True
+        read = dev.transport.read_interrupt
+        def run ():
+            for i in xrange( 20000 ):
+                read( 12, 0 )
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval( 1 )
+        try:
+            threads = [ threading.Thread( target = run ) for i in range(4) ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setcheckinterval( interval )
+        self.assertEqual( tracer.counters['usb_reads'], 80000 )
+        self.assertEqual( tracer.counters['usb_bytes'], 80000 * 12 )
+
+if __name__ == '__main__':
+    unittest.main()
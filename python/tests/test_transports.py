@@ -0,0 +1,89 @@
+import os, unittest
+import GarminUSB
+from garmin             import transports
+from garmin.capture     import RecordingTransport, ReplayTransport
+from garmin.device      import Forerunner
+from garmin.synth       import SyntheticTransport
+from garmin.transports  import open_transport, make_transport, TransportException
+from garmin.usbio       import PyUSBTransport
+from garmin.utils       import Obj
+from tests.support      import session, TemporaryDirectoryTest
+
+class Unnamed:
+    # a transport without from_options()
+
+    def __init__ (self, *args):
+        self.args = args
+
+class TransportsTest (TemporaryDirectoryTest):
+
+    def options (self, **kwargs):
+        options = Obj( transport = 'pyusb', vendor_id = Forerunner.VENDOR_ID, product_id = Forerunner.PRODUCT_ID
+            , replay = None, record = None )
+        options.update( kwargs )
+        return options
+
+    def capture (self):
+        path = os.path.join( self.directory, 'session.capture' )
+        dev = session( make_transport( 'record', make_transport( 'synthetic', laps = 10 ), path ) )
+        laps = dev.get_laps()
+        dev.close()
+        return path, laps
+
+    def test_pyusb (self):
+        transport = open_transport( 'pyusb', self.options() )
+        self.assertTrue( isinstance( transport, PyUSBTransport ) )
+        self.assertEqual( ( transport.vendor_id, transport.product_id ), ( Forerunner.VENDOR_ID, Forerunner.PRODUCT_ID ) )
+        self.assertFalse( transport.is_open() )
+
+    def test_synthetic (self):
+        dev = session( open_transport( 'synthetic', self.options() ) )
+        self.assertEqual( len( dev.get_laps() ), 100 )
+
+    def test_synthetic_session (self):
+        # every command GarminUSB.py sends is answered
+        dev = session( open_transport( 'synthetic', self.options() ) )
+        self.assertEqual( dev.get_time().year, 2009 )
+        self.assertEqual( dev.get_fitness_profile().birthdate.year, 1980 )
+        self.assertEqual( dev.get_course_limits().max_courses, 100 )
+        self.assertEqual( ( dev.get_courses(), dev.get_course_points() ), ( [], [] ) )
+        self.assertEqual( dev.get_workouts(), ( [], [] ) )
+
+    def test_replay (self):
+        path, laps = self.capture()
+        transport = open_transport( 'replay', self.options( replay = path ) )
+        self.assertTrue( isinstance( transport, ReplayTransport ) )
+        self.assertEqual( session( transport ).get_laps(), laps )
+
+    def test_replay_without_capture (self):
+        self.assertRaises( TransportException, open_transport, 'replay', self.options() )
+
+    def test_record_by_name (self):
+        self.assertRaises( TransportException, open_transport, 'record', self.options( record = 'x' ) )
+
+    def test_unknown (self):
+        self.assertRaises( TransportException, open_transport, 'no-such-transport', self.options() )
+
+    def test_without_from_options (self):
+        transports.loaded['unnamed'] = Unnamed
+        try:
+            self.assertRaises( TransportException, open_transport, 'unnamed', self.options() )
+            self.assertEqual( make_transport( 'unnamed', 1, 2 ).args, ( 1, 2 ) )
+        finally:
+            del transports.loaded['unnamed']
+
+    def test_command_line (self):
+        path, laps = self.capture()
+        transport = GarminUSB.make_transport( self.options( transport = 'synthetic' ) )
+        self.assertTrue( isinstance( transport, SyntheticTransport ) )
+        transport = GarminUSB.make_transport( self.options( transport = 'synthetic', replay = path ) )
+        self.assertTrue( isinstance( transport, ReplayTransport ) )
+        recorded = os.path.join( self.directory, 'recorded.capture' )
+        transport = GarminUSB.make_transport( self.options( transport = 'synthetic', record = recorded ) )
+        self.assertTrue( isinstance( transport, RecordingTransport ) )
+        self.assertEqual( len( session( transport ).get_laps() ), 100 )
+        transport.close()
+        self.assertEqual( session( make_transport( 'replay', recorded ) ).get_laps()[:10], laps )
+
+if __name__ == '__main__':
+    unittest.main()
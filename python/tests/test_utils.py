@@ -0,0 +1,41 @@
+import array, unittest
+from garmin.packet import Packet
+from garmin.utils  import StructReader
+
+class StructReaderTest (unittest.TestCase):
+
+    DATA = 'ab\0Forerunner305 Software\0SQA\0\x01\x02'
+
+    def buffers (self):
+        data = self.DATA
+        return [ data, bytearray(data), memoryview(data), array.array( 'B', data ) ]
+
+    def test_strings (self):
+        for data in self.buffers():
+            sr = StructReader( data, '<', 3, len(self.DATA) - 2 )
+            self.assertEqual( sr.read_string(), 'Forerunner305 Software' )
+            self.assertEqual( sr.read_string(), 'SQA' )
+            self.assertTrue( sr.eof() )
+
+    def test_raw (self):
+        for data in self.buffers():
+            sr = StructReader( data, '<', len(self.DATA) - 2 )
+            self.assertEqual( sr.read_raw(), '\x01\x02' )
+            self.assertEqual( type( StructReader( data ).read_raw() ), str )
+
+    def test_unterminated (self):
+        sr = StructReader( bytearray('abc'), '<', 1 )
+        self.assertEqual( sr.read_string(), 'bc' )
+
+class PacketViewTest (unittest.TestCase):
+
+    def test_packets_share_the_buffer (self):
+        data = Packet.encode( 0x0100, 'first\0' ) + Packet.encode( 0x0101, 'second\0' )
+        first = Packet( data, 0, 18 )
+        second = Packet( data, 18 )
+        self.assertTrue( first.data is data and second.data is data )
+        self.assertEqual( second.reader().read_string(), 'second' )
+        self.assertEqual( first.payload.tobytes(), 'first\0' )
+
+if __name__ == '__main__':
+    unittest.main()